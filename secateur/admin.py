@@ -1,13 +1,16 @@
-from typing import Optional
+from math import ceil
+from typing import Any, Optional
 
 from django.contrib import admin
 from django.contrib.admin import ModelAdmin
 from django.contrib.auth.admin import UserAdmin
 from django.core.handlers.wsgi import WSGIRequest
 from django.core.paginator import Paginator
+from django.db import connection
 from django.db.models import QuerySet
 from django.http import HttpRequest
 from django.template.response import TemplateResponse
+from django.utils.functional import cached_property
 
 import social_django.admin
 from django.utils.html import format_html
@@ -24,6 +27,84 @@ from . import models
 # social_django.admin.UserSocialAuthOption.exclude = ["extra_data"]
 
 
+## LARGE TABLES
+## The account, relationship and log tables are far too big to COUNT(*), list every
+## distinct value of, or page through to the end of.
+
+
+def estimated_count(model: Any) -> int:
+    """The planner's estimate of the rows in a model's table, or all its partitions."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT coalesce(sum(greatest(reltuples, 0)), 0)::bigint FROM pg_class
+            WHERE oid = %(table)s::regclass OR oid IN (
+                SELECT inhrelid FROM pg_inherits WHERE inhparent = %(table)s::regclass
+            )
+            """,
+            {"table": model._meta.db_table},
+        )
+        return cursor.fetchone()[0]
+
+
+class LargeTablePaginator(Paginator):
+    """Counts an unfiltered list from planner statistics and a filtered one up to
+    MAX_ROWS, and only has pages for the first MAX_ROWS rows either way."""
+
+    MAX_ROWS = 10_000
+
+    @cached_property
+    def count(self) -> int:
+        if not self.object_list.query.has_filters():
+            return estimated_count(self.object_list.model)
+        return self.object_list[: self.MAX_ROWS].count()
+
+    @cached_property
+    def num_pages(self) -> int:
+        hits = max(1, min(self.count, self.MAX_ROWS) - self.orphans)
+        return ceil(hits / self.per_page)
+
+
+class RawIdListFilter(admin.SimpleListFilter):
+    """A list filter that takes an ID typed into a box, instead of listing every choice."""
+
+    template = "admin/raw_id_filter.html"
+    field: str
+
+    def lookups(self, request: HttpRequest, model_admin: ModelAdmin) -> Any:
+        # The filter is only shown if it has lookups.
+        return (("", ""),)
+
+    def queryset(self, request: HttpRequest, queryset: QuerySet) -> QuerySet:
+        value = self.value()
+        if value:
+            try:
+                return queryset.filter(**{self.field: int(value)})
+            except ValueError:
+                return queryset.none()
+        return queryset
+
+    def choices(self, changelist: Any) -> Any:
+        yield {
+            "selected": self.value() is None,
+            "query_string": changelist.get_query_string(remove=[self.parameter_name]),
+            "display": "All",
+            "parameter_name": self.parameter_name,
+            "value": self.value() or "",
+            "hidden": [
+                (key, value)
+                for key, value in changelist.get_filters_params().items()
+                if key != self.parameter_name
+            ],
+        }
+
+
+class UserIdListFilter(RawIdListFilter):
+    title = "user ID"
+    parameter_name = "user_id"
+    field = "user_id"
+
+
 def update_user_details(
     modeladmin: ModelAdmin, request: WSGIRequest, queryset: QuerySet
 ) -> Optional[TemplateResponse]:
@@ -124,6 +205,7 @@ class AccountAdmin(admin.ModelAdmin):
         "twitter_url",
         "screen_name",
         "profile_updated",
+        "profile_fetched",
         "name",
         "description",
         "location",
@@ -138,89 +220,112 @@ class AccountAdmin(admin.ModelAdmin):
     )
     actions = [get_user]
     show_full_result_count = False
+    paginator = LargeTablePaginator
 
     def twitter_url(self, obj: models.Account) -> str:
         return format_html('<a href="{url}">{url}</a>', url=obj.twitter_url)
 
     def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip().lstrip("@")
         if search_term:
+            # Uses the account_screen_name_upper index.
             queryset = queryset.filter(screen_name__iexact=search_term)
         return queryset, False
 
-    def get_paginator(
-        self,
-        request: HttpRequest,
-        queryset: QuerySet,
-        per_page: int,
-        orphans=0,
-        allow_empty_first_page=True,
-    ) -> Paginator:
-        MAX = 10_000
-        queryset = queryset[:MAX]
-        return super().get_paginator(
-            request=request,
-            queryset=queryset,
-            per_page=per_page,
-            orphans=orphans,
-            allow_empty_first_page=allow_empty_first_page,
-        )
-
 
 @admin.register(models.Relationship)
 class RelationshipAdmin(admin.ModelAdmin):
-    search_fields = ("object__screen_name__iexact", "subject__screen_name__iexact")
+    search_fields = ("subject__screen_name",)
+    search_help_text = "The screen name or user id of the subject."
     list_display = ("subject", "type", "object", "until", "updated")
-    list_filter = ("type",)
-    date_hierarchy = "updated"
+    list_select_related = ("subject", "object")
+    # Unlike date_hierarchy, this only filters on a range: it doesn't query for dates,
+    # and until_btree serves it. Nothing indexes 'updated', so it has no filter.
+    list_filter = ("type", ("until", admin.DateFieldListFilter))
     readonly_fields = ("subject", "type", "object", "updated")
     show_full_result_count = False
+    paginator = LargeTablePaginator
 
-    def get_paginator(
-        self,
-        request: HttpRequest,
-        queryset: QuerySet,
-        per_page: int,
-        orphans=0,
-        allow_empty_first_page=True,
-    ) -> Paginator:
-        MAX = 10_000
-        queryset = queryset[:MAX]
-        return super().get_paginator(
-            request=request,
-            queryset=queryset,
-            per_page=per_page,
-            orphans=orphans,
-            allow_empty_first_page=allow_empty_first_page,
-        )
+    def get_search_results(self, request, queryset, search_term):
+        # Find the account first, with the account_screen_name_upper index, then its
+        # relationships by subject. Nothing indexes the object, so that isn't searched.
+        search_term = search_term.strip().lstrip("@")
+        if search_term:
+            accounts = models.Account.objects.filter(screen_name__iexact=search_term)
+            if search_term.isdigit():
+                accounts = accounts | models.Account.objects.filter(
+                    user_id=int(search_term)
+                )
+            queryset = queryset.filter(
+                subject_id__in=list(accounts.values_list("user_id", flat=True)[:100])
+            )
+        return queryset, False
 
 
 @admin.register(models.LogMessage)
 class LogMessageAdmin(admin.ModelAdmin):
     list_display = ("time", "user", "action", "account", "get_followers_count", "until")
-    list_filter = ("action", "user")
-    # date_hierarchy = "time"
-    raw_id_fields = ("account",)
+    list_select_related = ("user", "account")
+    list_filter = ("action", UserIdListFilter, ("time", admin.DateFieldListFilter))
+    raw_id_fields = ("user", "account")
     show_full_result_count = False
+    paginator = LargeTablePaginator
 
     def get_followers_count(self, obj):
         return obj.account.followers_count if obj.account else None
 
     get_followers_count.short_description = "Followers"
 
-    def get_paginator(
-        self,
-        request: HttpRequest,
-        queryset: QuerySet,
-        per_page: int,
-        orphans=0,
-        allow_empty_first_page=True,
-    ) -> Paginator:
-        MAX = 10_000
-        queryset = queryset[:MAX]
-        return super().get_paginator(
-            request=request,
-            queryset=queryset,
-            per_page=per_page,
-            orphans=orphans,
-            allow_empty_first_page=allow_empty_first_page,
-        )
+
+def resume_paged_jobs(
+    modeladmin: ModelAdmin, request: WSGIRequest, queryset: QuerySet
+) -> Optional[TemplateResponse]:
+    import secateur.tasks
+
+    # A running run already has a page on the way, and resuming it would start a second
+    # one on the same cursor. Stalled ones are resumed by tasks.resume_paged_jobs().
+    Status = models.PagedJobRun.Status
+    for run in queryset.filter(status__in=(Status.PAUSED, Status.FAILED)):
+        secateur.tasks.resume_paged_job(run)
+    return None
+
+
+@admin.register(models.PagedJobRun)
+class PagedJobRunAdmin(admin.ModelAdmin):
+    list_display = (
+        "created",
+        "user",
+        "endpoint",
+        "status",
+        "pages",
+        "accounts",
+        "updated",
+    )
+    list_filter = ("status", UserIdListFilter)
+    list_select_related = ("user",)
+    raw_id_fields = ("user",)
+    readonly_fields = (
+        "user",
+        "job",
+        "cursor",
+        "pages",
+        "accounts",
+        "created",
+        "updated",
+        "error",
+    )
+    actions = [resume_paged_jobs]
+    show_full_result_count = False
+
+    def endpoint(self, obj: models.PagedJobRun) -> str:
+        return obj.job.get("endpoint")
+
+
+@admin.register(models.Operation)
+class OperationAdmin(admin.ModelAdmin):
+    list_display = ("due", "user", "action", "target_id", "until", "created")
+    list_filter = ("action", UserIdListFilter)
+    list_select_related = ("user",)
+    raw_id_fields = ("user",)
+    show_full_result_count = False
+    paginator = LargeTablePaginator
@@ -0,0 +1,350 @@
+"""A local stand-in for the Twitter API, for benchmarking secateur without Twitter.
+
+It serves the endpoints TwitterClient calls, from a made-up world where account N
+has `followers` followers, and keeps each access token's blocks and mutes. Like
+Twitter, it counts each token's calls to each endpoint in 15 minute windows and
+reports them in the x-rate-limit-* headers, turning calls down with error 88 once a
+window is used up. It can also be made slow, return errors at random, and drop
+connections at random.
+
+Point secateur at it by setting TWITTER_API_BASE_URL to its `base_url`.
+"""
+
+import json
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Set, Tuple
+from urllib.parse import parse_qs, urlparse
+
+import structlog
+
+logger = structlog.get_logger(__name__)
+
+WINDOW = 15 * 60
+FOLLOWERS_PER_ACCOUNT = 10_000_000
+
+# The HTTP status Twitter sends each error code with.
+ERROR_STATUSES = {34: 404, 50: 404, 63: 403, 88: 429, 89: 401, 272: 403, 326: 403}
+ERROR_MESSAGES = {
+    34: "Sorry, that page does not exist.",
+    50: "User not found.",
+    63: "User has been suspended.",
+    88: "Rate limit exceeded",
+    89: "Invalid or expired token.",
+    272: "You are not muting the specified user.",
+    326: "To protect our users from spam and other malicious activity, this account is temporarily locked.",
+}
+
+DEFAULT_RATE_LIMITS = {
+    "/blocks/create": 900,
+    "/blocks/destroy": 900,
+    "/mutes/users/create": 900,
+    "/mutes/users/destroy": 900,
+    "/followers/ids": 15,
+    "/friends/ids": 15,
+    "/friends/list": 15,
+    "/blocks/ids": 15,
+    "/mutes/users/ids": 15,
+    "/users/show": 900,
+    "/users/lookup": 900,
+}
+
+_OAUTH_TOKEN = re.compile(r'oauth_token="([^"]*)"')
+
+
+@dataclass
+class Call:
+    path: str
+    token: str
+    status: int
+    start: float
+    end: float
+    # The account blocked, muted, unblocked or unmuted, if it was one of those.
+    target: Optional[int] = None
+
+
+@dataclass
+class FakeTwitter:
+    """The fake API's world and settings.
+
+    - `followers`: how many followers every account has, unless it's in
+      `followers_by_account`.
+    - `latency` and `jitter`: each response takes `latency` plus up to `jitter` seconds.
+    - `rate_limits`: calls per token per 15 minute window, by endpoint path.
+    - `errors`: the chance of a call failing with each error code.
+    - `drop_rate`: the chance of a connection being closed without a response.
+    - `missing_ids`: accounts that don't exist.
+    """
+
+    followers: int = 0
+    followers_by_account: Dict[int, int] = field(default_factory=dict)
+    latency: float = 0.0
+    jitter: float = 0.0
+    rate_limits: Dict[str, int] = field(
+        default_factory=lambda: dict(DEFAULT_RATE_LIMITS)
+    )
+    errors: Dict[int, float] = field(default_factory=dict)
+    drop_rate: float = 0.0
+    missing_ids: Set[int] = field(default_factory=set)
+
+    def __post_init__(self) -> None:
+        self.lock = threading.Lock()
+        self.blocks: Dict[str, Set[int]] = {}
+        self.mutes: Dict[str, Set[int]] = {}
+        self.windows: Dict[Tuple[str, str], Tuple[float, int]] = {}
+        self.calls: List[Call] = []
+
+    ## THE WORLD
+
+    def follower_ids(self, user_id: int) -> range:
+        """Account N's followers are N * FOLLOWERS_PER_ACCOUNT + 1 and up."""
+        count = self.followers_by_account.get(user_id, self.followers)
+        first = user_id * FOLLOWERS_PER_ACCOUNT + 1
+        return range(first, first + count)
+
+    def user(self, user_id: int) -> Dict[str, Any]:
+        return {
+            "id": user_id,
+            "id_str": str(user_id),
+            "screen_name": f"user{user_id}",
+            "name": f"User {user_id}",
+            "description": "",
+            "location": "",
+            "profile_image_url_https": None,
+            "followers_count": len(self.follower_ids(user_id)),
+            "friends_count": 0,
+            "statuses_count": 0,
+            "favourites_count": 0,
+            "listed_count": 0,
+            "created_at": "Wed Aug 27 13:08:45 +0000 2008",
+        }
+
+    @staticmethod
+    def user_id_for(screen_name: str) -> Optional[int]:
+        match = re.fullmatch(r"user(-?\d+)", screen_name, re.IGNORECASE)
+        return int(match.group(1)) if match else None
+
+    ## RATE LIMITS
+
+    def rate_limit(self, token: str, path: str, now: float) -> Tuple[int, int, int]:
+        """Count a call, returning the limit, the calls remaining and the reset time."""
+        limit = self.rate_limits.get(path, 900)
+        with self.lock:
+            start, used = self.windows.get((token, path), (now, 0))
+            if now >= start + WINDOW:
+                start, used = now, 0
+            used += 1
+            self.windows[(token, path)] = (start, used)
+        return limit, limit - used, int(start + WINDOW)
+
+    def record(self, call: Call) -> None:
+        with self.lock:
+            self.calls.append(call)
+
+    def reset(self) -> None:
+        """Forget the calls made so far, and the rate limit windows."""
+        with self.lock:
+            self.calls = []
+            self.windows = {}
+
+    ## ENDPOINTS
+
+    def handle(
+        self, method: str, path: str, params: Dict[str, str], token: str
+    ) -> Tuple[int, Any]:
+        """The status and JSON body of a response to a call that wasn't turned down."""
+        if path in (
+            "/blocks/create",
+            "/blocks/destroy",
+            "/mutes/users/create",
+            "/mutes/users/destroy",
+        ):
+            if method != "POST":
+                return self.error(34)
+            user_id = self._target(params)
+            if user_id is None or user_id in self.missing_ids:
+                return self.error(34 if path.endswith("destroy") else 50)
+            relationships = self.blocks if path.startswith("/blocks") else self.mutes
+            with self.lock:
+                targets = relationships.setdefault(token, set())
+                if path.endswith("create"):
+                    targets.add(user_id)
+                elif path == "/mutes/users/destroy" and user_id not in targets:
+                    return self.error(272)
+                else:
+                    targets.discard(user_id)
+            return 200, self.user(user_id)
+        elif path in ("/followers/ids", "/friends/ids", "/friends/list"):
+            user_id = self._target(params)
+            if user_id is None or user_id in self.missing_ids:
+                return self.error(34)
+            ids = self.follower_ids(user_id) if path == "/followers/ids" else range(0)
+            return 200, self._page(ids, params, users=path == "/friends/list")
+        elif path in ("/blocks/ids", "/mutes/users/ids"):
+            relationships = self.blocks if path == "/blocks/ids" else self.mutes
+            with self.lock:
+                ids = sorted(relationships.get(token, ()))
+            return 200, self._page(ids, params)
+        elif path == "/users/show":
+            user_id = self._target(params)
+            if user_id is None or user_id in self.missing_ids:
+                return self.error(50)
+            return 200, self.user(user_id)
+        elif path == "/users/lookup":
+            user_ids = [int(i) for i in params.get("user_id", "").split(",") if i]
+            return 200, [self.user(i) for i in user_ids if i not in self.missing_ids]
+        return self.error(34)
+
+    def _target(self, params: Dict[str, str]) -> Optional[int]:
+        if params.get("user_id"):
+            return int(params["user_id"])
+        if params.get("screen_name"):
+            return self.user_id_for(params["screen_name"])
+        return None
+
+    def _page(
+        self, ids: Any, params: Dict[str, str], users: bool = False
+    ) -> Dict[str, Any]:
+        # The cursor is just the offset into the list.
+        cursor = int(params.get("cursor", -1))
+        offset = max(cursor, 0)
+        count = int(params.get("count", 200 if users else 5000))
+        page = list(ids[offset : offset + count])
+        more = offset + count < len(ids)
+        return {
+            "users" if users else "ids": (
+                [self.user(i) for i in page] if users else page
+            ),
+            "next_cursor": offset + count if more else 0,
+            "previous_cursor": -offset if offset else 0,
+        }
+
+    @staticmethod
+    def error(code: int) -> Tuple[int, Any]:
+        return ERROR_STATUSES[code], {
+            "errors": [{"code": code, "message": ERROR_MESSAGES[code]}]
+        }
+
+    ## STATS
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Calls, errors and latency percentiles in seconds, by endpoint."""
+        with self.lock:
+            calls = list(self.calls)
+        by_path: Dict[str, List[Call]] = {}
+        for call in calls:
+            by_path.setdefault(call.path, []).append(call)
+        return {
+            path: dict(
+                calls=len(path_calls),
+                errors=sum(1 for call in path_calls if call.status >= 400),
+                p50=percentile([call.end - call.start for call in path_calls], 50),
+                p99=percentile([call.end - call.start for call in path_calls], 99),
+            )
+            for path, path_calls in sorted(by_path.items())
+        }
+
+    def completed(self, path: str) -> Dict[Tuple[str, int], float]:
+        """When each token's first successful call to `path` for each target finished."""
+        with self.lock:
+            calls = list(self.calls)
+        completed: Dict[Tuple[str, int], float] = {}
+        for call in calls:
+            if call.path == path and call.status == 200 and call.target is not None:
+                key = (call.token, call.target)
+                completed[key] = min(completed.get(key, call.end), call.end)
+        return completed
+
+
+def percentile(values: List[float], percent: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(len(values) * percent / 100), len(values) - 1)]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "FakeTwitterServer"
+
+    def do_GET(self) -> None:
+        self._respond("GET")
+
+    def do_POST(self) -> None:
+        self._respond("POST")
+
+    def _respond(self, method: str) -> None:
+        fake = self.server.fake
+        start = time.time()
+        url = urlparse(self.path)
+        path = url.path.replace("/1.1", "", 1).replace(".json", "")
+        query = url.query
+        if method == "POST":
+            length = int(self.headers.get("Content-Length") or 0)
+            query = self.rfile.read(length).decode()
+        params = {k: v[-1] for k, v in parse_qs(query).items()}
+        match = _OAUTH_TOKEN.search(self.headers.get("Authorization", ""))
+        token = match.group(1) if match else ""
+        # Blocks, mutes and undoing them are the calls made for one account.
+        target = fake._target(params) if method == "POST" else None
+
+        if fake.latency or fake.jitter:
+            time.sleep(fake.latency + random.uniform(0, fake.jitter))
+        if random.random() < fake.drop_rate:
+            fake.record(Call(path, token, 0, start, time.time(), target))
+            self.close_connection = True
+            return
+
+        limit, remaining, reset = fake.rate_limit(token, path, start)
+        if not token:
+            status, body = fake.error(89)
+        elif remaining < 0:
+            status, body = fake.error(88)
+        else:
+            injected = [
+                code for code, chance in fake.errors.items() if random.random() < chance
+            ]
+            if injected:
+                status, body = fake.error(injected[0])
+            else:
+                status, body = fake.handle(method, path, params, token)
+
+        content = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.send_header("x-rate-limit-limit", str(limit))
+        self.send_header("x-rate-limit-remaining", str(max(remaining, 0)))
+        self.send_header("x-rate-limit-reset", str(reset))
+        self.end_headers()
+        self.wfile.write(content)
+        fake.record(Call(path, token, status, start, time.time(), target))
+
+    def log_message(self, format: str, *args: Any) -> None:
+        logger.debug("fake twitter request", message=format % args)
+
+
+class FakeTwitterServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, fake: FakeTwitter, host: str = "127.0.0.1", port: int = 0):
+        self.fake = fake
+        super().__init__((host, port), _Handler)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/1.1"
+
+    def start(self) -> "FakeTwitterServer":
+        """Serve from a background thread."""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
@@ -36,6 +36,9 @@ class BlockAccountsForm(forms.Form):
 class Search(forms.Form):
     screen_name = forms.CharField(help_text="Twitter screen name", required=False)
 
+    def clean_screen_name(self) -> str:
+        return self.cleaned_data["screen_name"].lstrip("@")
+
 
 class UpdateFollowing(forms.Form):
     pass
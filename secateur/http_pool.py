@@ -0,0 +1,84 @@
+"""One pool of HTTP connections to Twitter, shared by every user's API client.
+
+Each user's twitter.Api signs its own requests with its own OAuth1 credentials, so
+they can all send them through the same requests.Session. That way a connection, and
+its TLS handshake, is reused by whoever needs one next rather than belonging to one
+user, and there's a limit on how many connections a process can have open.
+"""
+
+import http.cookiejar
+from functools import lru_cache
+from typing import Any
+
+import requests
+import requests.adapters
+import urllib3
+from django.conf import settings
+
+from . import otel
+
+
+class _CountingPoolMixin:
+    """Counts whether each request got an open connection from the pool.
+
+    A request waits at most settings.TWITTER_HTTP_POOL_TIMEOUT seconds for a free
+    connection, so a leaked or stuck one can't hold up every greenlet for good, and
+    giving up raises urllib3's EmptyPoolError, which is counted too.
+    """
+
+    def _get_conn(self, timeout: Any = None) -> Any:
+        if timeout is None:
+            timeout = settings.TWITTER_HTTP_POOL_TIMEOUT
+        try:
+            conn = super()._get_conn(timeout)  # type: ignore
+        except urllib3.exceptions.EmptyPoolError:
+            otel.twitter_http_pool_exhausted_counter.add(1)
+            raise
+        if getattr(conn, "sock", None) is not None:
+            otel.twitter_http_pool_hit_counter.add(1)
+        else:
+            otel.twitter_http_pool_miss_counter.add(1)
+        return conn
+
+
+class _CountingHTTPConnectionPool(_CountingPoolMixin, urllib3.HTTPConnectionPool):
+    pass
+
+
+class _CountingHTTPSConnectionPool(_CountingPoolMixin, urllib3.HTTPSConnectionPool):
+    pass
+
+
+class SharedPoolAdapter(requests.adapters.HTTPAdapter):
+    """An HTTPAdapter whose pools wait rather than open more than `pool_maxsize`."""
+
+    def init_poolmanager(self, *args: Any, **kwargs: Any) -> None:
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _CountingHTTPConnectionPool,
+            "https": _CountingHTTPSConnectionPool,
+        }
+
+
+class _NoCookies(http.cookiejar.DefaultCookiePolicy):
+    # The session is shared between users, so nothing one response sets should be sent
+    # with another user's requests.
+    def set_ok(self, cookie: Any, request: Any) -> bool:
+        return False
+
+
+@lru_cache(maxsize=None)
+def get_session() -> requests.Session:
+    """The process's shared session for talking to Twitter."""
+    session = requests.Session()
+    session.cookies.set_policy(_NoCookies())
+    adapter = SharedPoolAdapter(
+        # One pool per host: api.twitter.com and upload.twitter.com.
+        pool_connections=4,
+        pool_maxsize=settings.TWITTER_HTTP_POOL_SIZE,
+        pool_block=True,
+        max_retries=1,
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
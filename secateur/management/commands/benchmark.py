@@ -0,0 +1,410 @@
+"""Measure block and unblock throughput against a fake Twitter API.
+
+Starts secateur.fake_twitter in this process and Celery workers pointed at it, then:
+
+- block-followers: some benchmark users each block every follower of one account.
+- unblock drain: all those blocks expire at once, and unblock_expired() drains them.
+
+For each, it reports accounts per second, the p50 and p99 of how long each account
+took (from the start of the run to the end of the fake API's first successful call
+for it) and of the API calls, and how many transactions, and statements if
+pg_stat_statements is installed, the database ran.
+
+It needs the broker and the database the settings point at, and won't run unless
+DEBUG is on or it's passed --i-know-this-is-not-production. Its accounts all have
+negative ids, which no real Twitter account has, and when it's done it deletes the
+users, accounts and relationships it made, and its users' lane and rate limit cache
+keys. If a run was killed before it could clean up, the next one stops rather than
+reuse what it left, unless it's passed --clean-up-leftovers.
+"""
+
+import datetime
+import json
+import os
+import subprocess
+import sys
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from secateur import models, tasks
+from secateur.fake_twitter import (
+    FOLLOWERS_PER_ACCOUNT,
+    FakeTwitter,
+    FakeTwitterServer,
+    percentile,
+)
+
+# Twitter ids are positive, so the benchmark's are negative. The account the users
+# block the followers of is -1, whose followers are -9999999 and up, and the users'
+# accounts are -20000000 and down.
+TARGET_ACCOUNT = -1
+BENCHMARK_ACCOUNTS = -20_000_000
+# Seconds a run can go without progress, with nothing queued, before it's over.
+STALLED_AFTER = 10
+
+
+def _errors(value: str) -> Dict[int, float]:
+    """Parse "88=0.01,326=0.001" into error code chances."""
+    errors = {}
+    for item in value.split(","):
+        if item:
+            code, chance = item.split("=")
+            errors[int(code)] = float(chance)
+    return errors
+
+
+def _round(seconds: Optional[float]) -> Optional[float]:
+    return round(seconds, 4) if seconds is not None else None
+
+
+class Command(BaseCommand):
+    help = "Benchmark blocking followers and draining unblocks against a fake Twitter."
+
+    def add_arguments(self, parser: Any) -> None:
+        parser.add_argument("--users", type=int, default=4)
+        parser.add_argument("--followers", type=int, default=5_000)
+        parser.add_argument("--workers", type=int, default=2)
+        parser.add_argument("--concurrency", type=int, default=80)
+        parser.add_argument("--port", type=int, default=0)
+        parser.add_argument(
+            "--latency", type=float, default=0.05, help="Seconds per API call."
+        )
+        parser.add_argument("--jitter", type=float, default=0.05)
+        parser.add_argument(
+            "--rate-limit",
+            type=int,
+            default=100_000,
+            help="Block and unblock calls per user per 15 minutes.",
+        )
+        parser.add_argument(
+            "--errors", type=_errors, default={}, help='e.g. "88=0.01,326=0.001"'
+        )
+        parser.add_argument("--drop-rate", type=float, default=0.0)
+        parser.add_argument("--timeout", type=int, default=600)
+        parser.add_argument(
+            "--eager",
+            action="store_true",
+            help="Run the tasks in this process instead of in workers.",
+        )
+        parser.add_argument("--json", action="store_true")
+        parser.add_argument(
+            "--i-know-this-is-not-production",
+            action="store_true",
+            help="Run even though DEBUG is off.",
+        )
+        parser.add_argument(
+            "--clean-up-leftovers",
+            action="store_true",
+            help="Delete what a killed run left behind before starting.",
+        )
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        if not (settings.DEBUG or options["i_know_this_is_not_production"]):
+            raise CommandError(
+                "The benchmark creates and deletes users, accounts and relationships."
+                " Run it with DEBUG on, or pass --i-know-this-is-not-production."
+            )
+        if options["followers"] >= FOLLOWERS_PER_ACCOUNT:
+            raise CommandError(f"--followers must be under {FOLLOWERS_PER_ACCOUNT}")
+        if self._leftovers():
+            if not options["clean_up_leftovers"]:
+                raise CommandError(
+                    "A previous run left benchmark users or accounts behind."
+                    " Pass --clean-up-leftovers to delete them."
+                )
+            self._clean_up_leftovers()
+        fake = FakeTwitter(
+            followers_by_account={TARGET_ACCOUNT: options["followers"]},
+            latency=options["latency"],
+            jitter=options["jitter"],
+            errors=options["errors"],
+            drop_rate=options["drop_rate"],
+        )
+        for path in (
+            "/blocks/create",
+            "/blocks/destroy",
+            "/mutes/users/create",
+            "/mutes/users/destroy",
+        ):
+            fake.rate_limits[path] = options["rate_limit"]
+        server = FakeTwitterServer(fake, port=options["port"]).start()
+        # The fake API doesn't check signatures, but the client needs something to sign with.
+        os.environ.setdefault("CONSUMER_KEY", "benchmark")
+        os.environ.setdefault("CONSUMER_SECRET", "benchmark")
+        self.timeout = options["timeout"]
+        workers: List[subprocess.Popen] = []
+        users: List[models.User] = []
+        results = {}
+        try:
+            if options["eager"]:
+                settings.TWITTER_API_BASE_URL = server.base_url
+                tasks.app.conf.task_always_eager = True
+            else:
+                workers = self._start_workers(
+                    server.base_url, options["workers"], options["concurrency"]
+                )
+            self._create_users(users, options["users"])
+            expected = options["users"] * options["followers"]
+            results["block_followers"] = self._block_followers(fake, users, expected)
+            results["unblock_drain"] = self._unblock_drain(fake, users)
+        finally:
+            for worker in workers:
+                worker.terminate()
+            for worker in workers:
+                worker.wait()
+            server.stop()
+            self._clean_up(fake, users)
+
+        if options["json"]:
+            self.stdout.write(json.dumps(results, indent=2))
+        else:
+            for name, result in results.items():
+                self.stdout.write(name)
+                for key, value in result.items():
+                    self.stdout.write(f"  {key}: {value}")
+
+    ## SETUP
+
+    def _start_workers(
+        self, base_url: str, count: int, concurrency: int
+    ) -> List[subprocess.Popen]:
+        env = dict(os.environ, TWITTER_API_BASE_URL=base_url)
+        return [
+            subprocess.Popen(
+                [
+                    sys.executable,
+                    "-m",
+                    "celery",
+                    "-A",
+                    "secateur",
+                    "worker",
+                    "--pool",
+                    "gevent",
+                    "--concurrency",
+                    str(concurrency),
+                    "--queues",
+                    "celery,blocker",
+                    "--loglevel",
+                    "warning",
+                    "--hostname",
+                    f"benchmark{i}@%h",
+                ],
+                env=env,
+            )
+            for i in range(count)
+        ]
+
+    def _create_users(self, users: List[models.User], count: int) -> None:
+        """Add `count` users to `users`, as they're made, so they can be cleaned up."""
+        for i in range(count):
+            account = models.Account.get_account(BENCHMARK_ACCOUNTS - i)
+            user = models.User(
+                username=f"benchmark{i}",
+                account=account,
+                oauth_token=f"benchmark-token-{i}",
+                oauth_token_secret="benchmark-secret",
+                token_bucket_max=10**9,
+                token_bucket_value=10**9,
+            )
+            # A killed run may have left its cache keys behind.
+            self._clear_cache(user)
+            user.save()
+            users.append(user)
+
+    def _clear_cache(self, user: models.User) -> None:
+        keys = [
+            tasks._BlockerLane(user).queued_key,
+            tasks._BlockerLane(user).greenlets_key,
+        ]
+        for endpoint in tasks._RateLimitPacer.ENDPOINT_PATHS:
+            pacer = tasks._RateLimitPacer(user, None, endpoint)
+            keys += [pacer.key, pacer.status_key]
+        cache.delete_many(keys)
+
+    def _clean_up(self, fake: FakeTwitter, users: List[models.User]) -> None:
+        """Delete the users this run made, and their accounts, blocks and mutes, and
+        the accounts of the target and its followers."""
+        followers = fake.follower_ids(TARGET_ACCOUNT)
+        account_ids = [user.account_id for user in users]
+        models.Relationship.objects.filter(subject_id__in=account_ids).delete()
+        models.RelationshipCount.objects.filter(account_id__in=account_ids).delete()
+        models.User.objects.filter(pk__in=[user.pk for user in users]).delete()
+        models.Account.objects.filter(
+            user_id__in=account_ids + [TARGET_ACCOUNT]
+        ).delete()
+        models.Account.objects.filter(
+            user_id__gte=followers.start, user_id__lt=followers.stop
+        ).delete()
+        for user in users:
+            self._clear_cache(user)
+
+    def _leftovers(self) -> bool:
+        return (
+            models.User.objects.filter(account_id__lt=0).exists()
+            or models.Account.objects.filter(user_id__lt=0).exists()
+            or models.RelationshipCount.objects.filter(account_id__lt=0).exists()
+        )
+
+    def _clean_up_leftovers(self) -> None:
+        """Delete everything with a negative Twitter id, which only a benchmark makes."""
+        models.Relationship.objects.filter(subject_id__lt=0).delete()
+        models.RelationshipCount.objects.filter(account_id__lt=0).delete()
+        models.User.objects.filter(account_id__lt=0).delete()
+        models.Account.objects.filter(user_id__lt=0).delete()
+
+    ## MEASURING
+
+    def _db_counters(self) -> Dict[str, int]:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT xact_commit + xact_rollback FROM pg_stat_database"
+                " WHERE datname = current_database()"
+            )
+            counters = {"transactions": cursor.fetchone()[0]}
+            cursor.execute(
+                "SELECT 1 FROM pg_extension WHERE extname = 'pg_stat_statements'"
+            )
+            if cursor.fetchone():
+                cursor.execute("SELECT sum(calls) FROM pg_stat_statements")
+                counters["statements"] = int(cursor.fetchone()[0])
+        return counters
+
+    def _wait(
+        self,
+        users: List[models.User],
+        progress: Callable[[], int],
+        finished: Callable[[int], bool],
+    ) -> None:
+        """Wait till `finished(progress())`, dispatching due operations as beat would.
+
+        Some accounts may never be done, if the fake API turned them down, so it also
+        stops once the users have nothing queued and progress has stopped for a while.
+        """
+        deadline = time.monotonic() + self.timeout
+        last, stalled_since = None, time.monotonic()
+        while True:
+            value = progress()
+            if finished(value):
+                return
+            if value != last:
+                last, stalled_since = value, time.monotonic()
+            idle = not (
+                models.Operation.objects.filter(user__in=users).exists()
+                or models.PagedJobRun.objects.filter(
+                    user__in=users, status=models.PagedJobRun.Status.RUNNING
+                ).exists()
+            )
+            if idle and time.monotonic() - stalled_since > STALLED_AFTER:
+                return
+            if time.monotonic() > deadline:
+                raise CommandError("Timed out")
+            tasks.dispatch_operations.delay()
+            time.sleep(1)
+
+    def _blocks(self, users: List[models.User]) -> "models.QuerySet":
+        return models.Relationship.objects.filter(
+            subject_id__in=[user.account_id for user in users],
+            type=models.Relationship.BLOCKS,
+        )
+
+    def _report(
+        self,
+        fake: FakeTwitter,
+        path: str,
+        accounts: int,
+        elapsed: float,
+        db_before: Dict[str, int],
+        latencies: Optional[List[float]] = None,
+    ) -> Dict[str, Any]:
+        db_after = self._db_counters()
+        api = fake.stats().get(path, {})
+        result = {
+            "accounts": accounts,
+            "seconds": round(elapsed, 3),
+            "accounts_per_second": round(accounts / elapsed, 1) if elapsed else None,
+            "api_calls": api.get("calls", 0),
+            "api_errors": api.get("errors", 0),
+            "api_p50": _round(api.get("p50")),
+            "api_p99": _round(api.get("p99")),
+        }
+        if latencies is not None:
+            result["account_p50"] = _round(percentile(latencies, 50))
+            result["account_p99"] = _round(percentile(latencies, 99))
+        for name, value in db_after.items():
+            result[f"db_{name}"] = value - db_before.get(name, 0)
+        return result
+
+    def _latencies(
+        self, fake: FakeTwitter, path: str, users: List[models.User], start: float
+    ) -> List[float]:
+        """Seconds from `start` till each of the users' calls to `path` succeeded."""
+        tokens = {user.oauth_token for user in users}
+        return [
+            end - start
+            for (token, _), end in fake.completed(path).items()
+            if token in tokens
+        ]
+
+    ## SCENARIOS
+
+    def _block_followers(
+        self, fake: FakeTwitter, users: List[models.User], expected: int
+    ) -> Dict[str, Any]:
+        fake.reset()
+        target = models.Account.get_account(TARGET_ACCOUNT)
+        db_before = self._db_counters()
+        start = time.time()
+        with transaction.atomic():
+            for user in users:
+                tasks.twitter_block_followers(
+                    user,
+                    models.Relationship.BLOCKS,
+                    target,
+                    duration=datetime.timedelta(weeks=1),
+                )
+            # Don't wait 15 minutes between pages of followers.
+            models.PagedJobRun.objects.filter(user__in=users).update(
+                delay_between_pages=0
+            )
+        self._wait(users, self._blocks(users).count, lambda count: count >= expected)
+        elapsed = time.time() - start
+        return self._report(
+            fake,
+            "/blocks/create",
+            self._blocks(users).count(),
+            elapsed,
+            db_before,
+            self._latencies(fake, "/blocks/create", users, start),
+        )
+
+    def _unblock_drain(
+        self, fake: FakeTwitter, users: List[models.User]
+    ) -> Dict[str, Any]:
+        fake.reset()
+        blocks = self._blocks(users)
+        count = blocks.update(until=timezone.now() - datetime.timedelta(seconds=1))
+        db_before = self._db_counters()
+        start = time.time()
+
+        def remaining() -> int:
+            # unblock_expired() takes the expired blocks 5,000 at a time.
+            if blocks.filter(until__lt=timezone.now()).exists():
+                tasks.unblock_expired()
+            return blocks.count()
+
+        self._wait(users, remaining, lambda count: count == 0)
+        count -= blocks.count()
+        return self._report(
+            fake,
+            "/blocks/destroy",
+            count,
+            time.time() - start,
+            db_before,
+            self._latencies(fake, "/blocks/destroy", users, start),
+        )
@@ -0,0 +1,81 @@
+# Generated by Django 4.1.7 on 2026-10-17 06:04
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import psqlextra.manager.manager
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("secateur", "0050_logmessage_secateur_lo_time_9f1798_brin"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PagedJobRun",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("job", models.JSONField(editable=False)),
+                (
+                    "status",
+                    models.IntegerField(
+                        choices=[
+                            (1, "Running"),
+                            (2, "Paused"),
+                            (3, "Done"),
+                            (4, "Failed"),
+                        ],
+                        default=1,
+                    ),
+                ),
+                ("cursor", models.BigIntegerField(default=-1, editable=False)),
+                ("pages", models.IntegerField(default=0, editable=False)),
+                ("max_pages", models.IntegerField(default=300)),
+                ("accounts", models.IntegerField(default=0, editable=False)),
+                ("delay_between_pages", models.IntegerField(default=0)),
+                (
+                    "created",
+                    models.DateTimeField(
+                        default=django.utils.timezone.now, editable=False
+                    ),
+                ),
+                (
+                    "updated",
+                    models.DateTimeField(
+                        default=django.utils.timezone.now, editable=False
+                    ),
+                ),
+                ("error", models.TextField(blank=True, editable=False, null=True)),
+                (
+                    "user",
+                    models.ForeignKey(
+                        editable=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            managers=[
+                ("objects", psqlextra.manager.manager.PostgresManager()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="pagedjobrun",
+            index=models.Index(
+                condition=models.Q(("status__in", [1, 2])),
+                fields=["updated"],
+                name="pagedjobrun_active_updated",
+            ),
+        ),
+    ]
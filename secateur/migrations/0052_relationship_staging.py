@@ -0,0 +1,23 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("secateur", "0051_pagedjobrun"),
+    ]
+
+    operations = [
+        # UNLOGGED: staged IDs are only needed until their run finishes, and
+        # Relationship.sync_staged() refuses to apply a run that lost rows in a crash.
+        migrations.RunSQL(
+            sql="""
+                CREATE UNLOGGED TABLE secateur_relationship_staging (
+                    run_id bigint NOT NULL,
+                    user_id bigint NOT NULL
+                );
+                CREATE INDEX secateur_relationship_staging_run_id
+                    ON secateur_relationship_staging (run_id);
+            """,
+            reverse_sql="DROP TABLE secateur_relationship_staging;",
+        ),
+    ]
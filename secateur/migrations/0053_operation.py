@@ -0,0 +1,62 @@
+# Generated by Django 4.1.7 on 2026-10-17 06:11
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import psqlextra.manager.manager
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("secateur", "0052_relationship_staging"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Operation",
+            fields=[
+                ("id", models.BigAutoField(primary_key=True, serialize=False)),
+                (
+                    "action",
+                    models.IntegerField(
+                        choices=[
+                            (2, "Create Block"),
+                            (3, "Destroy Block"),
+                            (4, "Create Mute"),
+                            (5, "Destroy Mute"),
+                        ]
+                    ),
+                ),
+                ("target_id", models.BigIntegerField()),
+                ("until", models.DateTimeField(blank=True, null=True)),
+                ("due", models.DateTimeField()),
+                (
+                    "created",
+                    models.DateTimeField(
+                        default=django.utils.timezone.now, editable=False
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            managers=[
+                ("objects", psqlextra.manager.manager.PostgresManager()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="operation",
+            index=models.Index(fields=["due"], name="operation_due"),
+        ),
+        migrations.AddIndex(
+            model_name="operation",
+            index=models.Index(fields=["user", "due"], name="operation_user_due"),
+        ),
+    ]
@@ -0,0 +1,178 @@
+import datetime
+
+from django.conf import settings
+from django.contrib.postgres.indexes import BrinIndex
+from django.db import migrations, models
+import django.db.models.deletion
+import psqlextra.backend.migrations.operations
+import psqlextra.models.partitioned
+import psqlextra.types
+from psqlextra.partitioning import (
+    PostgresCurrentTimePartitioningStrategy,
+    PostgresTimePartitionSize,
+)
+from psqlextra.partitioning.constants import AUTO_PARTITIONED_COMMENT
+import secateur.models
+
+# Block and mute messages are kept for 14 days. Everything else is kept for good, and
+# goes in the "never" partition.
+EXPIRING_ACTIONS = "(2, 3, 4, 5)"
+NEVER = datetime.datetime(9999, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def create_partitions(apps, schema_editor):
+    # The daily partitions have to exist before the old rows are copied in: postgres
+    # won't create a partition over rows that are already in the default partition.
+    LogMessage = apps.get_model("secateur", "LogMessage")
+    strategy = PostgresCurrentTimePartitioningStrategy(
+        size=PostgresTimePartitionSize(days=1), count=16
+    )
+    for partition in strategy.to_create():
+        partition.create(LogMessage, schema_editor, comment=AUTO_PARTITIONED_COMMENT)
+
+
+class Migration(migrations.Migration):
+    # This copies the old LogMessage table into a new partitioned one and drops the old
+    # one, so it can't be undone: the RunSQL operations have no reverse_sql, and
+    # unapplying it raises IrreversibleError.
+
+    dependencies = [
+        ("secateur", "0053_operation"),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            """
+            ALTER TABLE secateur_logmessage RENAME TO secateur_logmessage_old;
+            ALTER INDEX secateur_logmessage_pkey RENAME TO secateur_logmessage_old_pkey;
+            ALTER INDEX log_user_id RENAME TO log_old_user_id;
+            ALTER INDEX secateur_lo_time_9f1798_brin RENAME TO secateur_lo_old_time_brin;
+            DO $$
+            BEGIN
+                EXECUTE format(
+                    'ALTER SEQUENCE %s RENAME TO secateur_logmessage_old_id_seq',
+                    pg_get_serial_sequence('secateur_logmessage_old', 'id')
+                );
+            END
+            $$;
+            """,
+        ),
+        migrations.SeparateDatabaseAndState(
+            state_operations=[migrations.DeleteModel(name="LogMessage")],
+        ),
+        psqlextra.backend.migrations.operations.PostgresCreatePartitionedModel(
+            name="LogMessage",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("time", models.DateTimeField()),
+                (
+                    "action",
+                    models.IntegerField(
+                        choices=[
+                            (1, "Get User"),
+                            (2, "Create Block"),
+                            (3, "Destroy Block"),
+                            (4, "Create Mute"),
+                            (5, "Destroy Mute"),
+                            (6, "Get Followers"),
+                            (7, "Get Friends"),
+                            (8, "Get Blocks"),
+                            (9, "Get Mutes"),
+                            (10, "Mute Followers"),
+                            (11, "Block Followers"),
+                            (12, "Log In"),
+                            (13, "Log Out"),
+                            (14, "Disconnect"),
+                            (15, "Unblock Everybody"),
+                        ]
+                    ),
+                ),
+                ("until", models.DateTimeField(null=True)),
+                ("rate_limited", models.BooleanField(null=True)),
+                ("expires", models.DateTimeField(editable=False)),
+                (
+                    "account",
+                    models.ForeignKey(
+                        db_index=False,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        to="secateur.account",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        db_index=False,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(fields=["user", "-id"], name="log_user_id"),
+                    BrinIndex(
+                        autosummarize=True,
+                        fields=["time"],
+                        name="secateur_lo_time_9f1798_brin",
+                    ),
+                ],
+            },
+            partitioning_options={
+                "method": psqlextra.types.PostgresPartitioningMethod["RANGE"],
+                "key": ["expires"],
+            },
+            bases=(psqlextra.models.partitioned.PostgresPartitionedModel,),
+            managers=[
+                ("objects", secateur.models.LogMessageManager()),
+            ],
+        ),
+        psqlextra.backend.migrations.operations.PostgresAddDefaultPartition(
+            model_name="logmessage",
+            name="default",
+        ),
+        # Every time a daily partition is created, postgres scans the whole default
+        # partition, under an ACCESS EXCLUSIVE lock, to check none of its rows belong in
+        # the new one. So the messages kept for good, which all expire at NEVER, get a
+        # partition of their own instead of growing the default one forever. The
+        # default is then only for block and mute messages that expire past the
+        # partitions created so far, and stays empty as long as they're created daily.
+        psqlextra.backend.migrations.operations.PostgresAddRangePartition(
+            model_name="logmessage",
+            name="never",
+            from_values=NEVER,
+            to_values=NEVER + datetime.timedelta(days=1),
+        ),
+        migrations.RunPython(create_partitions, migrations.RunPython.noop),
+        migrations.RunSQL(
+            f"""
+            INSERT INTO secateur_logmessage
+                (id, time, user_id, account_id, action, until, rate_limited, expires)
+            SELECT
+                id, time, user_id, account_id, action, until, rate_limited,
+                CASE WHEN action IN {EXPIRING_ACTIONS}
+                    THEN time + interval '14 days'
+                    ELSE '9999-01-01T00:00:00Z'::timestamptz
+                END
+            FROM secateur_logmessage_old
+            WHERE action NOT IN {EXPIRING_ACTIONS} OR time > now() - interval '14 days';
+
+            SELECT setval(
+                pg_get_serial_sequence('secateur_logmessage', 'id'),
+                coalesce((SELECT max(id) FROM secateur_logmessage), 0) + 1,
+                false
+            );
+
+            DROP TABLE secateur_logmessage_old;
+            """,
+        ),
+    ]
@@ -0,0 +1,215 @@
+from django.db import migrations, models
+import django.db.models.deletion
+import psqlextra.backend.migrations.operations
+import psqlextra.manager.manager
+import psqlextra.models.partitioned
+import psqlextra.types
+
+PARTITIONS = 16
+
+
+class Migration(migrations.Migration):
+    # This copies the old Relationship table into a new partitioned one and drops the old
+    # one, so it can't be undone: the RunSQL operations have no reverse_sql, and
+    # unapplying it raises IrreversibleError.
+
+    dependencies = [
+        ("secateur", "0054_partition_logmessage"),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            """
+            ALTER TABLE secateur_relationship RENAME TO secateur_relationship_old;
+            ALTER INDEX secateur_relationship_pkey
+                RENAME TO secateur_relationship_old_pkey;
+            ALTER INDEX secateur_relationship_type_subject_id_object_id_d2839381_uniq
+                RENAME TO secateur_relationship_old_uniq;
+            ALTER INDEX until_btree RENAME TO until_btree_old;
+            DO $$
+            BEGIN
+                EXECUTE format(
+                    'ALTER SEQUENCE %s RENAME TO secateur_relationship_old_id_seq',
+                    pg_get_serial_sequence('secateur_relationship_old', 'id')
+                );
+            END
+            $$;
+            """,
+        ),
+        migrations.SeparateDatabaseAndState(
+            state_operations=[migrations.DeleteModel(name="Relationship")],
+        ),
+        psqlextra.backend.migrations.operations.PostgresCreatePartitionedModel(
+            name="Relationship",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "type",
+                    models.IntegerField(
+                        choices=[(1, "follows"), (2, "blocks"), (3, "mutes")],
+                        editable=False,
+                    ),
+                ),
+                ("updated", models.DateTimeField(editable=False)),
+                ("until", models.DateTimeField(blank=True, null=True)),
+                (
+                    "object",
+                    models.ForeignKey(
+                        db_index=False,
+                        editable=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="relationship_object_set",
+                        to="secateur.account",
+                    ),
+                ),
+                (
+                    "subject",
+                    models.ForeignKey(
+                        db_index=False,
+                        editable=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="relationship_subject_set",
+                        to="secateur.account",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        condition=models.Q(("until__isnull", False)),
+                        fields=["until", "subject"],
+                        name="until_btree",
+                    ),
+                ],
+                "unique_together": {("type", "subject", "object")},
+            },
+            partitioning_options={
+                "method": psqlextra.types.PostgresPartitioningMethod["HASH"],
+                "key": ["subject_id"],
+            },
+            bases=(psqlextra.models.partitioned.PostgresPartitionedModel,),
+            managers=[
+                ("objects", psqlextra.manager.manager.PostgresManager()),
+            ],
+        ),
+        psqlextra.backend.migrations.operations.PostgresAddHashPartition(
+            model_name="relationship",
+            name="p0",
+            modulus=PARTITIONS,
+            remainder=0,
+        ),
+        psqlextra.backend.migrations.operations.PostgresAddHashPartition(
+            model_name="relationship",
+            name="p1",
+            modulus=PARTITIONS,
+            remainder=1,
+        ),
+        psqlextra.backend.migrations.operations.PostgresAddHashPartition(
+            model_name="relationship",
+            name="p2",
+            modulus=PARTITIONS,
+            remainder=2,
+        ),
+        psqlextra.backend.migrations.operations.PostgresAddHashPartition(
+            model_name="relationship",
+            name="p3",
+            modulus=PARTITIONS,
+            remainder=3,
+        ),
+        psqlextra.backend.migrations.operations.PostgresAddHashPartition(
+            model_name="relationship",
+            name="p4",
+            modulus=PARTITIONS,
+            remainder=4,
+        ),
+        psqlextra.backend.migrations.operations.PostgresAddHashPartition(
+            model_name="relationship",
+            name="p5",
+            modulus=PARTITIONS,
+            remainder=5,
+        ),
+        psqlextra.backend.migrations.operations.PostgresAddHashPartition(
+            model_name="relationship",
+            name="p6",
+            modulus=PARTITIONS,
+            remainder=6,
+        ),
+        psqlextra.backend.migrations.operations.PostgresAddHashPartition(
+            model_name="relationship",
+            name="p7",
+            modulus=PARTITIONS,
+            remainder=7,
+        ),
+        psqlextra.backend.migrations.operations.PostgresAddHashPartition(
+            model_name="relationship",
+            name="p8",
+            modulus=PARTITIONS,
+            remainder=8,
+        ),
+        psqlextra.backend.migrations.operations.PostgresAddHashPartition(
+            model_name="relationship",
+            name="p9",
+            modulus=PARTITIONS,
+            remainder=9,
+        ),
+        psqlextra.backend.migrations.operations.PostgresAddHashPartition(
+            model_name="relationship",
+            name="p10",
+            modulus=PARTITIONS,
+            remainder=10,
+        ),
+        psqlextra.backend.migrations.operations.PostgresAddHashPartition(
+            model_name="relationship",
+            name="p11",
+            modulus=PARTITIONS,
+            remainder=11,
+        ),
+        psqlextra.backend.migrations.operations.PostgresAddHashPartition(
+            model_name="relationship",
+            name="p12",
+            modulus=PARTITIONS,
+            remainder=12,
+        ),
+        psqlextra.backend.migrations.operations.PostgresAddHashPartition(
+            model_name="relationship",
+            name="p13",
+            modulus=PARTITIONS,
+            remainder=13,
+        ),
+        psqlextra.backend.migrations.operations.PostgresAddHashPartition(
+            model_name="relationship",
+            name="p14",
+            modulus=PARTITIONS,
+            remainder=14,
+        ),
+        psqlextra.backend.migrations.operations.PostgresAddHashPartition(
+            model_name="relationship",
+            name="p15",
+            modulus=PARTITIONS,
+            remainder=15,
+        ),
+        migrations.RunSQL(
+            """
+            INSERT INTO secateur_relationship
+                (id, type, subject_id, object_id, updated, until)
+            SELECT id, type, subject_id, object_id, updated, until
+            FROM secateur_relationship_old;
+
+            SELECT setval(
+                pg_get_serial_sequence('secateur_relationship', 'id'),
+                coalesce((SELECT max(id) FROM secateur_relationship), 0) + 1,
+                false
+            );
+
+            DROP TABLE secateur_relationship_old;
+            """,
+        ),
+    ]
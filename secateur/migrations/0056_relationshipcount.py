@@ -0,0 +1,122 @@
+# Generated by Django 4.1.7 on 2026-10-17 06:22
+
+from django.db import migrations, models
+import django.db.models.deletion
+import psqlextra.manager.manager
+
+# Add each statement's net change per (subject, type) to secateur_relationshipcount.
+# Rows are aggregated from the statement's transition tables, and upserted in key
+# order so that concurrent statements take the counter row locks in the same order.
+UPSERT_COUNTS = """
+    INSERT INTO secateur_relationshipcount (account_id, type, count, expiring)
+    SELECT subject_id, type, sum(count), sum(expiring)
+    FROM ({rows}) AS changes (subject_id, type, count, expiring)
+    WHERE type IN (2, 3)
+    GROUP BY subject_id, type
+    HAVING sum(count) <> 0 OR sum(expiring) <> 0
+    ORDER BY subject_id, type
+    ON CONFLICT (account_id, type) DO UPDATE SET
+        count = secateur_relationshipcount.count + EXCLUDED.count,
+        expiring = secateur_relationshipcount.expiring + EXCLUDED.expiring;
+"""
+NEW_ROWS = "SELECT subject_id, type, 1, (until IS NOT NULL)::int FROM new_rows"
+OLD_ROWS = "SELECT subject_id, type, -1, -(until IS NOT NULL)::int FROM old_rows"
+
+CREATE_TRIGGERS = f"""
+CREATE FUNCTION secateur_relationshipcount_insert() RETURNS trigger AS $$
+BEGIN
+    {UPSERT_COUNTS.format(rows=NEW_ROWS)}
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE FUNCTION secateur_relationshipcount_delete() RETURNS trigger AS $$
+BEGIN
+    {UPSERT_COUNTS.format(rows=OLD_ROWS)}
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE FUNCTION secateur_relationshipcount_update() RETURNS trigger AS $$
+BEGIN
+    {UPSERT_COUNTS.format(rows=NEW_ROWS + " UNION ALL " + OLD_ROWS)}
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+LOCK TABLE secateur_relationship IN SHARE ROW EXCLUSIVE MODE;
+
+CREATE TRIGGER relationshipcount_insert AFTER INSERT ON secateur_relationship
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION secateur_relationshipcount_insert();
+CREATE TRIGGER relationshipcount_delete AFTER DELETE ON secateur_relationship
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION secateur_relationshipcount_delete();
+CREATE TRIGGER relationshipcount_update AFTER UPDATE ON secateur_relationship
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION secateur_relationshipcount_update();
+
+INSERT INTO secateur_relationshipcount (account_id, type, count, expiring)
+SELECT subject_id, type, count(*), count(until)
+FROM secateur_relationship
+WHERE type IN (2, 3)
+GROUP BY subject_id, type;
+"""
+
+DROP_TRIGGERS = """
+DROP TRIGGER relationshipcount_insert ON secateur_relationship;
+DROP TRIGGER relationshipcount_delete ON secateur_relationship;
+DROP TRIGGER relationshipcount_update ON secateur_relationship;
+DROP FUNCTION secateur_relationshipcount_insert();
+DROP FUNCTION secateur_relationshipcount_delete();
+DROP FUNCTION secateur_relationshipcount_update();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("secateur", "0055_partition_relationship"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RelationshipCount",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "type",
+                    models.IntegerField(
+                        choices=[(1, "follows"), (2, "blocks"), (3, "mutes")]
+                    ),
+                ),
+                ("count", models.BigIntegerField(default=0)),
+                ("expiring", models.BigIntegerField(default=0)),
+                (
+                    "account",
+                    models.ForeignKey(
+                        db_constraint=False,
+                        db_index=False,
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        related_name="+",
+                        to="secateur.account",
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("account", "type")},
+            },
+            managers=[
+                ("objects", psqlextra.manager.manager.PostgresManager()),
+            ],
+        ),
+        migrations.RunSQL(CREATE_TRIGGERS, DROP_TRIGGERS),
+    ]
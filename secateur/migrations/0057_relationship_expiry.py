@@ -0,0 +1,76 @@
+# Generated by Django 4.1.7 on 2026-10-17 06:24
+
+import datetime
+from django.db import migrations, models
+import django.db.models.functions.comparison
+
+COLUMNS = (
+    "subject_id, type,"
+    " COALESCE(until, '9999-01-01 00:00:00+00'::timestamp with time zone),"
+    " object_id"
+)
+
+
+def create_index(apps, schema_editor):
+    # A plain CREATE INDEX on the partitioned table would lock every partition against
+    # writes while it builds. Instead, create the index on the parent alone, build each
+    # partition's without locking out writes, and attach them one at a time. The
+    # parent's index is valid once every partition's is attached.
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT inhrelid::regclass::text FROM pg_inherits"
+            " WHERE inhparent = 'secateur_relationship'::regclass"
+            " ORDER BY inhrelid::regclass::text"
+        )
+        partitions = [partition for (partition,) in cursor.fetchall()]
+    schema_editor.execute(
+        "CREATE INDEX IF NOT EXISTS relationship_expiry"
+        f" ON ONLY secateur_relationship ({COLUMNS})"
+    )
+    for partition in partitions:
+        index = f"{partition}_expiry"
+        schema_editor.execute(
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {index} ON {partition} ({COLUMNS})"
+        )
+        schema_editor.execute(
+            f"ALTER INDEX relationship_expiry ATTACH PARTITION {index}"
+        )
+
+
+def drop_index(apps, schema_editor):
+    # Dropping the parent's index drops the partitions' too.
+    schema_editor.execute("DROP INDEX IF EXISTS relationship_expiry")
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY can't run in a transaction.
+    atomic = False
+
+    dependencies = [
+        ("secateur", "0056_relationshipcount"),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[migrations.RunPython(create_index, drop_index)],
+            state_operations=[
+                migrations.AddIndex(
+                    model_name="relationship",
+                    index=models.Index(
+                        models.F("subject"),
+                        models.F("type"),
+                        django.db.models.functions.comparison.Coalesce(
+                            "until",
+                            models.Value(
+                                datetime.datetime(
+                                    9999, 1, 1, 0, 0, tzinfo=datetime.timezone.utc
+                                )
+                            ),
+                        ),
+                        models.F("object"),
+                        name="relationship_expiry",
+                    ),
+                ),
+            ],
+        ),
+    ]
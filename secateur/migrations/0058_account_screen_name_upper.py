@@ -0,0 +1,33 @@
+# Generated by Django 4.1.7 on 2026-10-17 06:28
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.operations
+from django.db import migrations, models
+import django.db.models.functions.comparison
+import django.db.models.functions.text
+
+
+class Migration(migrations.Migration):
+    # The account table is big, so build the index without locking out writes.
+    atomic = False
+
+    dependencies = [
+        ("secateur", "0057_relationship_expiry"),
+    ]
+
+    operations = [
+        django.contrib.postgres.operations.AddIndexConcurrently(
+            model_name="account",
+            index=models.Index(
+                django.contrib.postgres.indexes.OpClass(
+                    django.db.models.functions.text.Upper(
+                        django.db.models.functions.comparison.Cast(
+                            "screen_name", output_field=models.TextField()
+                        )
+                    ),
+                    name="text_pattern_ops",
+                ),
+                name="account_screen_name_upper",
+            ),
+        ),
+    ]
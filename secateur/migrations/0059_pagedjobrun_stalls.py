@@ -0,0 +1,18 @@
+# Generated by Django 4.1.7 on 2026-10-17 06:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("secateur", "0058_account_screen_name_upper"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="pagedjobrun",
+            name="stalls",
+            field=models.IntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.1.7 on 2026-10-17 07:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("secateur", "0059_pagedjobrun_stalls"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="account",
+            name="profile_fetched",
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+    ]
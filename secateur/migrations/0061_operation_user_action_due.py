@@ -0,0 +1,27 @@
+# Generated by Django 4.1.7 on 2026-10-17 07:40
+
+import django.contrib.postgres.operations
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # The operations queue can hold millions of rows, so build and drop the indexes
+    # without locking out writes.
+    atomic = False
+
+    dependencies = [
+        ("secateur", "0060_account_profile_fetched"),
+    ]
+
+    operations = [
+        django.contrib.postgres.operations.AddIndexConcurrently(
+            model_name="operation",
+            index=models.Index(
+                fields=["user", "action", "due"], name="operation_user_action_due"
+            ),
+        ),
+        django.contrib.postgres.operations.RemoveIndexConcurrently(
+            model_name="operation",
+            name="operation_user_due",
+        ),
+    ]
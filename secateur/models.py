@@ -1,21 +1,26 @@
+import io
+import itertools
 import time
 import os
 from functools import lru_cache
 from typing import Optional, Union, Tuple, List, Iterable, Any, Dict
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone as dt_timezone
 from email.utils import parsedate_to_datetime
 
-import requests
 import structlog
 from django.contrib.auth.models import AbstractUser
-from django.contrib.postgres.indexes import BrinIndex
-from django.db import models, transaction
-from django.db.models import QuerySet, Q
+from django.contrib.postgres.indexes import BrinIndex, OpClass
+from django.db import connection, models, transaction
+from django.db.models import F, QuerySet, Q, Value
+from django.db.models.functions import Cast, Coalesce, Upper
 from django.utils import timezone
 from django.utils.functional import cached_property
 
 # from psqlextra.models import PostgresModel
+import psqlextra.manager
 import psqlextra.models
+import psqlextra.types
+import opentelemetry.trace
 
 import twitter
 
@@ -24,6 +29,7 @@ from django.utils.html import format_html
 
 from . import tasks, otel
 from . import utils
+from .twitter_client import TwitterClient, UserDict
 
 logger = structlog.get_logger(__name__)
 
@@ -32,6 +38,10 @@ class TwitterApiDisabled(Exception):
     pass
 
 
+class StagedRelationshipsLost(Exception):
+    """Staged IDs for a sync are missing, probably because a crash truncated the table."""
+
+
 def token_bucket_time() -> float:
     # Use "days since the epoch" as the time unit for the token bucket.
     return time.time() / 24 / 60 / 60
@@ -50,15 +60,47 @@ def default_token_bucket_value() -> float:
     return 50_000.00
 
 
-@lru_cache(maxsize=32)
-def get_cached_twitter_api(**kwargs):
-    api = twitter.Api(**kwargs)
-    # patch the API session object to use a larger connection pool and allow a retry
-    https_adapter = requests.adapters.HTTPAdapter(
-        pool_connections=40, pool_maxsize=40, max_retries=1
+def twitter_user_id(arg: Union[int, twitter.User, UserDict]) -> int:
+    """The user id of a user ID, twitter.User or user dict from the Twitter API."""
+    if isinstance(arg, dict):
+        return arg["id"]
+    return getattr(arg, "id", arg)
+
+
+@lru_cache(maxsize=1024)
+def get_cached_twitter_api(**kwargs) -> TwitterClient:
+    # The client is per-user, for its OAuth credentials and the rate limits from its
+    # responses, but its requests go through the process's shared connection pool.
+    return TwitterClient(**kwargs)
+
+
+def _unnest_insert(
+    model: Any,
+    columns: Dict[str, list],
+    on_conflict: str,
+    returning: Optional[str] = None,
+) -> Optional[list]:
+    """INSERT rows passed as one array parameter per column, with a single statement.
+
+    `columns` maps field names to equal length lists of values, `on_conflict` is what
+    follows ON CONFLICT, and `returning` is the field to return from each row written.
+    """
+    quote_name = connection.ops.quote_name
+    fields = [model._meta.get_field(name) for name in columns]
+    table = quote_name(model._meta.db_table)
+    column_names = ", ".join(quote_name(f.column) for f in fields)
+    arrays = ", ".join(f"%s::{f.db_type(connection)}[]" for f in fields)
+    sql = (
+        f"INSERT INTO {table} ({column_names}) SELECT * FROM unnest({arrays})"
+        f" ON CONFLICT {on_conflict}"
     )
-    api._session.mount("https://", https_adapter)
-    return api
+    if returning is not None:
+        sql += " RETURNING " + quote_name(model._meta.get_field(returning).column)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, list(columns.values()))
+        if returning is not None:
+            return [row[0] for row in cursor.fetchall()]
+    return None
 
 
 class User(AbstractUser):
@@ -104,12 +146,94 @@ class User(AbstractUser):
         return int(self.token_bucket.value_at(token_bucket_time()))
 
     def withdraw_tokens(self, value: int) -> None:
-        if value > self.current_tokens:
+        """Take `value` tokens from the bucket, raising ValueError if there aren't enough.
+
+        This is done in the database rather than by saving the bucket, so concurrent
+        withdrawals can't both spend the same tokens. There's no need to save afterwards.
+        """
+        rows = self._withdraw_tokens({self.pk: value}, partial=False)
+        if not rows:
             raise ValueError("Rate limit exceeded.")
-        self.token_bucket = self.token_bucket.withdraw(
-            time=token_bucket_time(), value=value
-        )
-        otel.tokens_consumed_counter.add(value)
+        [(_, _, self.token_bucket_time, self.token_bucket_value)] = rows
+
+    @classmethod
+    def withdraw_tokens_bulk(
+        cls, amounts: Dict[int, int], partial: bool = False
+    ) -> Dict[int, int]:
+        """Withdraw tokens from several users' buckets at once.
+
+        `amounts` maps user pks to how many tokens to take. The result maps them to how
+        many were taken: with `partial` a user gets as many as they have, up to the
+        amount, otherwise all or nothing. Users who got nothing are left out.
+        """
+        return {
+            pk: granted
+            for pk, granted, _, _ in cls._withdraw_tokens(amounts, partial=partial)
+        }
+
+    @classmethod
+    def _withdraw_tokens(
+        cls, amounts: Dict[int, int], partial: bool
+    ) -> List[Tuple[int, int, float, float]]:
+        """Withdraw tokens in one statement, returning (pk, granted, time, value) rows.
+
+        The buckets are read with FOR UPDATE so that a concurrent withdrawal from the
+        same bucket is waited for and then seen, and the row lock is only held for the
+        statement unless there's an enclosing transaction.
+        """
+        if not amounts:
+            return []
+        table = connection.ops.quote_name(cls._meta.db_table)
+        sql = f"""
+            WITH current AS (
+                SELECT
+                    u.id,
+                    wanted.amount,
+                    LEAST(
+                        u.token_bucket_value
+                            + COALESCE(u.token_bucket_rate, %(rate)s)
+                            * (%(now)s - u.token_bucket_time),
+                        COALESCE(u.token_bucket_max, %(max)s)
+                    ) AS available
+                FROM {table} AS u
+                JOIN unnest(%(pks)s::integer[], %(amounts)s::integer[])
+                    AS wanted (id, amount) USING (id)
+                ORDER BY u.id
+                FOR UPDATE OF u
+            ), granted AS (
+                SELECT
+                    id,
+                    available,
+                    CASE WHEN %(partial)s
+                        THEN LEAST(amount, GREATEST(floor(available), 0))::integer
+                        ELSE amount
+                    END AS granted
+                FROM current
+            )
+            UPDATE {table} AS u
+            SET token_bucket_time = %(now)s,
+                token_bucket_value = granted.available - granted.granted
+            FROM granted
+            WHERE u.id = granted.id
+                AND granted.granted > 0
+                AND granted.granted <= granted.available
+            RETURNING u.id, granted.granted, u.token_bucket_time, u.token_bucket_value
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                sql,
+                dict(
+                    rate=default_token_bucket_rate(),
+                    max=default_token_bucket_max(),
+                    now=token_bucket_time(),
+                    pks=list(amounts),
+                    amounts=list(amounts.values()),
+                    partial=partial,
+                ),
+            )
+            rows = cursor.fetchall()
+        otel.tokens_consumed_counter.add(sum(granted for _, granted, _, _ in rows))
+        return rows
 
     @cached_property
     def twitter_social_auth(self) -> social_django.models.UserSocialAuth:
@@ -123,7 +247,7 @@ class User(AbstractUser):
         return int(self.twitter_social_auth.uid)
 
     @cached_property
-    def api(self) -> twitter.Api:
+    def api(self) -> TwitterClient:
         if not self.is_twitter_api_enabled:
             raise TwitterApiDisabled()
         if not self.oauth_token:
@@ -133,14 +257,12 @@ class User(AbstractUser):
             consumer_secret=os.environ.get("CONSUMER_SECRET"),
             access_token_key=self.oauth_token,
             access_token_secret=self.oauth_token_secret,
-            sleep_on_rate_limit=False,
             timeout=30,
         )
         return api
 
     def get_account_by_screen_name(self, screen_name: str) -> "Optional[Account]":
-        logger.debug("Fetching user %s from Twitter API.", screen_name)
-        return tasks.get_user(self.pk, screen_name=screen_name)
+        return tasks.resolve_account(self.pk, screen_name)
 
     def remove_unneeded_credentials(self):
         days_since_login = 28
@@ -194,12 +316,22 @@ class Account(psqlextra.models.PostgresModel):
     class Meta:
         indexes = (
             models.Index(fields=["screen_name"]),
+            # For screen_name__iexact and screen_name__istartswith, which compare
+            # UPPER(screen_name::text). The pattern opclass lets it serve LIKE 'PREFIX%'.
+            models.Index(
+                OpClass(
+                    Upper(Cast("screen_name", output_field=models.TextField())),
+                    name="text_pattern_ops",
+                ),
+                name="account_screen_name_upper",
+            ),
             BrinIndex(fields=["profile_updated"], autosummarize=True),
         )
 
     user_id = models.BigIntegerField(primary_key=True, editable=False)
 
     profile_updated = models.DateTimeField(null=True, editable=False)
+    profile_fetched = models.DateTimeField(null=True, editable=False)
 
     # TWITTER PROFILE FIELDS
     screen_name = models.CharField(max_length=100, null=True, editable=False)
@@ -227,64 +359,142 @@ class Account(psqlextra.models.PostgresModel):
 
     @classmethod
     def get_account(
-        cls, arg: Union[int, twitter.User], now: datetime = None
+        cls, arg: Union[int, twitter.User, UserDict], now: datetime = None
     ) -> "Account":
         return cls.get_accounts(arg, now=now).get()
 
     @classmethod
     def get_accounts(
-        cls, *args: Union[int, twitter.User], now: Optional[datetime] = None
+        cls,
+        *args: Union[int, twitter.User, UserDict],
+        now: Optional[datetime] = None,
     ) -> "QuerySet[Account]":
         """Update account objects from a result returned from the Twitter API.
 
         Twitter API calls either return lists of big-integer User IDs, or lists
-        of instances of 'twitter.model.User' objects.
+        of instances of 'twitter.model.User' objects, or from our own
+        TwitterClient, the JSON dicts those are made from.
 
         Either way, we need to create an 'Account' object for each twitter ID
         we see, and if we see a User object we also want to update the profile
         and 'screen_name' of the Account.
 
         This method unmagically does the right thing with whatever you pass it.
+
+        IDs are only inserted if they're missing. A profile always sets
+        'profile_fetched', so that's when it was last seen, but 'profile_updated' only
+        moves when something in it changed.
         """
         if not args:
             return cls.objects.none()
+        cls.write_accounts(*args, now=now)
+        return cls.objects.filter(user_id__in=[twitter_user_id(arg) for arg in args])
+
+    @classmethod
+    def write_accounts(
+        cls,
+        *args: Union[int, twitter.User, UserDict],
+        now: Optional[datetime] = None,
+        return_ids: bool = False,
+    ) -> Optional[List[int]]:
+        """Write what 'get_accounts' writes, without querying for the accounts.
+
+        Each column goes to postgres as one array parameter of a single INSERT ...
+        SELECT FROM unnest(...), instead of a row of VALUES per account. If
+        `return_ids` is set, returns the user_ids of the accounts that were inserted,
+        or for profiles written, otherwise nothing.
+        """
+        if not args:
+            return [] if return_ids else None
         if now is None:
             now = timezone.now()
-        rows = []
-        ids = []
         if isinstance(args[0], int):
-            for user_id in args:
-                rows.append(dict(user_id=user_id))
-            ids = args
-        elif isinstance(args[0], twitter.User):
-            for twitter_user in args:
-                rows.append(cls.dict_from_twitter_user(twitter_user, now))
-                ids.append(twitter_user.id)
-        if rows:
-            cls.objects.bulk_upsert(conflict_target=["user_id"], rows=rows)
-        return cls.objects.filter(user_id__in=ids)
+            columns = {"user_id": list(dict.fromkeys(args))}
+            conflict = "DO NOTHING"
+        else:
+            profiles = {twitter_user_id(user): user for user in args}
+            rows = [cls.dict_from_twitter_user(user, now) for user in profiles.values()]
+            columns = {
+                name: [row[name] for row in rows]
+                for name in ("user_id",) + cls.PROFILE_FIELDS
+            }
+            columns["profile_updated"] = [now] * len(rows)
+            columns["profile_fetched"] = [now] * len(rows)
+            # Rewriting an unchanged profile column with the value it already has
+            # doesn't touch its indexes, so only 'profile_updated' needs the check.
+            quote_name = connection.ops.quote_name
+            table = quote_name(cls._meta.db_table)
+            updated = quote_name("profile_updated")
+            conflict = "DO UPDATE SET {}, {} = CASE WHEN {} THEN {} ELSE {} END".format(
+                ", ".join(
+                    f"{column} = EXCLUDED.{column}"
+                    for column in map(quote_name, columns)
+                    if column not in (quote_name("user_id"), updated)
+                ),
+                updated,
+                cls._profile_changed_sql(),
+                f"EXCLUDED.{updated}",
+                f"{table}.{updated}",
+            )
+        return _unnest_insert(
+            cls,
+            columns,
+            on_conflict=f"(user_id) {conflict}",
+            returning="user_id" if return_ids else None,
+        )
+
+    # The fields of 'dict_from_twitter_user' that are worth updating an account for.
+    PROFILE_FIELDS = (
+        "screen_name",
+        "name",
+        "description",
+        "location",
+        "profile_image_url_https",
+        "profile_banner_url",
+        "favourites_count",
+        "followers_count",
+        "friends_count",
+        "statuses_count",
+        "listed_count",
+        "created_at",
+    )
+
+    @classmethod
+    def _profile_changed_sql(cls) -> str:
+        columns = [
+            connection.ops.quote_name(cls._meta.get_field(name).column)
+            for name in cls.PROFILE_FIELDS
+        ]
+        table = connection.ops.quote_name(cls._meta.db_table)
+        return "({}) IS DISTINCT FROM ({})".format(
+            ", ".join(f"{table}.{column}" for column in columns),
+            ", ".join(f"EXCLUDED.{column}" for column in columns),
+        )
 
     @classmethod
     def dict_from_twitter_user(
-        cls, user: twitter.User, now: Optional[datetime] = None
+        cls, user: Union[twitter.User, UserDict], now: Optional[datetime] = None
     ) -> dict:
+        if isinstance(user, dict):
+            get = user.get
+        else:
+            get = lambda name: getattr(user, name)
+        created_at = get("created_at")
         return {
-            "user_id": user.id,
-            "screen_name": user.screen_name,
-            "name": user.name,
+            "user_id": get("id"),
+            "screen_name": get("screen_name"),
+            "name": get("name"),
             "profile_updated": now,
-            "description": user.description,
-            "location": user.location,
-            "profile_image_url_https": user.profile_image_url_https,
-            "profile_banner_url": user.profile_banner_url,
-            "favourites_count": user.favourites_count,
-            "followers_count": user.followers_count,
-            "friends_count": user.friends_count,
-            "statuses_count": user.statuses_count,
-            "listed_count": user.listed_count,
-            "created_at": (
-                parsedate_to_datetime(user.created_at) if user.created_at else None
-            ),
+            "description": get("description"),
+            "location": get("location"),
+            "profile_image_url_https": get("profile_image_url_https"),
+            "profile_banner_url": get("profile_banner_url"),
+            "favourites_count": get("favourites_count"),
+            "followers_count": get("followers_count"),
+            "friends_count": get("friends_count"),
+            "statuses_count": get("statuses_count"),
+            "listed_count": get("listed_count"),
+            "created_at": parsedate_to_datetime(created_at) if created_at else None,
         }
 
     @property
@@ -397,7 +607,18 @@ class Account(psqlextra.models.PostgresModel):
         )
 
 
-class Relationship(psqlextra.models.PostgresModel):
+# What Relationship 'until's sort as when they're null, because they never expire.
+NEVER_EXPIRES = datetime(9999, 1, 1, tzinfo=dt_timezone.utc)
+
+
+class Relationship(psqlextra.models.PostgresPartitionedModel):
+    """A block, mute or follow between two accounts.
+
+    The table is hash partitioned by `subject`, so everything we know about one
+    account's blocks, mutes and friends is in one of `PARTITIONS` partitions, each
+    with its own (type, subject, object) unique index and until_btree index.
+    """
+
     class Meta:
         unique_together = (("type", "subject", "object"),)
         indexes = (
@@ -406,8 +627,26 @@ class Relationship(psqlextra.models.PostgresModel):
                 condition=Q(until__isnull=False),
                 name="until_btree",
             ),
+            # For paging through an account's blocks in order of expiry.
+            models.Index(
+                F("subject"),
+                F("type"),
+                Coalesce("until", Value(NEVER_EXPIRES)),
+                F("object"),
+                name="relationship_expiry",
+            ),
         )
 
+    class PartitioningMeta:
+        method = psqlextra.types.PostgresPartitioningMethod.HASH
+        key = ["subject_id"]
+
+    # The hash partitions are created by migration 0055, changing this needs another.
+    PARTITIONS = 16
+
+    # When a relationship expires, for sorting: the expression relationship_expiry indexes.
+    EXPIRY = Coalesce("until", Value(NEVER_EXPIRES))
+
     FOLLOWS = 1
     BLOCKS = 2
     MUTES = 3
@@ -446,39 +685,279 @@ class Relationship(psqlextra.models.PostgresModel):
         updated: datetime,
         until: Optional[datetime] = None,
     ) -> "QuerySet[Relationship]":
-        rows = []
-        for object in objects:
-            for subject in subjects:
-                rows.append(
-                    dict(
-                        type=type,
-                        subject=subject,
-                        object=object,
-                        updated=updated,
-                        until=until,
-                    )
-                )
-        cls.objects.bulk_upsert(
-            conflict_target=["type", "subject", "object"], rows=rows
+        subjects, objects = list(subjects), list(objects)
+        cls.write_relationships(
+            type=type,
+            subject_ids=[subject.pk for subject in subjects],
+            object_ids=[object.pk for object in objects],
+            updated=updated,
+            until=until,
         )
         result = cls.objects.filter(type=type, subject__in=subjects, object__in=objects)
         return result
 
+    @classmethod
+    def write_relationships(
+        cls,
+        type: int,
+        subject_ids: Iterable[int],
+        object_ids: Iterable[int],
+        updated: datetime,
+        until: Optional[datetime] = None,
+        return_ids: bool = False,
+    ) -> Optional[List[int]]:
+        """Upsert a relationship from every subject to every object.
+
+        Like 'add_relationships', but takes IDs and doesn't query for the relationships
+        afterwards. If `return_ids` is set, returns the ids of the rows written.
+        """
+        pairs = list(
+            dict.fromkeys(
+                (subject_id, object_id)
+                for subject_id in subject_ids
+                for object_id in object_ids
+            )
+        )
+        return _unnest_insert(
+            cls,
+            {
+                "type": [type] * len(pairs),
+                "subject_id": [subject_id for subject_id, _ in pairs],
+                "object_id": [object_id for _, object_id in pairs],
+                "updated": [updated] * len(pairs),
+                "until": [until] * len(pairs),
+            },
+            on_conflict=(
+                "(type, subject_id, object_id) DO UPDATE"
+                " SET updated = EXCLUDED.updated, until = EXCLUDED.until"
+            ),
+            returning="id" if return_ids else None,
+        )
+
+    # How many rows 'remove_relationships' deletes per statement.
+    REMOVE_BATCH_SIZE = 5000
+
     @classmethod
     def remove_relationships(cls, **kwargs: Any) -> int:
-        relationships = cls.objects.filter(**kwargs)
-        if relationships:
-            logger.debug("Removing relationships: {}".format(relationships))
-        return relationships.delete()[0]
+        """Delete the relationships matching `kwargs`, and return how many there were.
+
+        The matching rows are found with a single scan, streamed from a server-side
+        cursor, and deleted in batches of up to REMOVE_BATCH_SIZE by their (type,
+        subject, object) key, which the unique index serves. So no batch scans for rows
+        again, none holds its locks for long, and no rows are loaded into memory. A row
+        written again since the scan, with a newer 'updated', is left alone.
+        """
+        log = logger.bind(
+            function="remove_relationships",
+            filter={k: str(v) for k, v in kwargs.items()},
+        )
+        table = connection.ops.quote_name(cls._meta.db_table)
+        sql = f"""
+            DELETE FROM {table} AS r
+            USING unnest(%s::integer[], %s::bigint[], %s::bigint[], %s::timestamptz[])
+                AS k (type, subject_id, object_id, updated)
+            WHERE r.type = k.type
+                AND r.subject_id = k.subject_id
+                AND r.object_id = k.object_id
+                AND r.updated = k.updated
+        """
+        keys = (
+            cls.objects.filter(**kwargs)
+            .values_list("type", "subject_id", "object_id", "updated")
+            .iterator(chunk_size=cls.REMOVE_BATCH_SIZE)
+        )
+        deleted = batches = 0
+        while True:
+            batch = list(itertools.islice(keys, cls.REMOVE_BATCH_SIZE))
+            if not batch:
+                break
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(sql, [list(column) for column in zip(*batch)])
+                count = cursor.rowcount
+            deleted += count
+            batches += 1
+            log.debug("Removed a batch of relationships", count=count, deleted=deleted)
+        if deleted:
+            log.info("Removed relationships", deleted=deleted, batches=batches)
+            otel.relationships_removed_counter.add(deleted)
+        opentelemetry.trace.get_current_span().set_attribute(
+            "relationships_removed", deleted
+        )
+        return deleted
+
+    ## SET-BASED SYNC
+    ## A list sync stages every ID it fetches in the UNLOGGED
+    ## secateur_relationship_staging table (see migration 0052), and when the
+    ## list has been fetched, applies just the difference to this table.
+
+    @staticmethod
+    def stage(run_id: int, user_ids: Iterable[int]) -> None:
+        """COPY a page of fetched IDs into the staging table for a sync run."""
+        buffer = io.StringIO("".join(f"{run_id}\t{user_id}\n" for user_id in user_ids))
+        with connection.cursor() as cursor:
+            cursor.copy_expert(
+                "COPY secateur_relationship_staging (run_id, user_id) FROM STDIN",
+                buffer,
+            )
+
+    @staticmethod
+    def clear_staged(run_id: int) -> None:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "DELETE FROM secateur_relationship_staging WHERE run_id = %s",
+                [run_id],
+            )
+
+    @classmethod
+    @transaction.atomic
+    def sync_staged(
+        cls,
+        run_id: int,
+        expected: int,
+        type: int,
+        account: Account,
+        updated: datetime,
+        reverse: bool = False,
+    ) -> Tuple[int, int]:
+        """Make the staged IDs the complete list of `account`'s relationships of `type`.
+
+        Rows are inserted for new IDs and deleted for missing ones, leaving the
+        rest untouched. If `reverse` is set, the staged IDs are the subjects and
+        `account` the object (that is, they're followers). `expected` is how many
+        IDs were staged: if the staging table was truncated by a crash, this raises
+        rather than deleting relationships that
+        are still there.
+
+        Returns (added, removed).
+        """
+        staged_column, account_column = (
+            ("subject_id", "object_id") if reverse else ("object_id", "subject_id")
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT count(*) FROM secateur_relationship_staging WHERE run_id = %s",
+                [run_id],
+            )
+            (staged,) = cursor.fetchone()
+            if staged != expected:
+                raise StagedRelationshipsLost(
+                    f"Expected {expected} staged IDs for run {run_id}, found {staged}"
+                )
+            cursor.execute(
+                f"""
+                WITH staged AS (
+                    SELECT DISTINCT user_id FROM secateur_relationship_staging
+                    WHERE run_id = %(run_id)s
+                ),
+                added AS (
+                    INSERT INTO secateur_relationship
+                        (type, {account_column}, {staged_column}, updated)
+                    SELECT %(type)s, %(account_id)s, user_id, %(updated)s FROM staged
+                    ON CONFLICT (type, subject_id, object_id) DO NOTHING
+                    RETURNING 1
+                ),
+                removed AS (
+                    DELETE FROM secateur_relationship r
+                    WHERE r.type = %(type)s
+                    AND r.{account_column} = %(account_id)s
+                    AND NOT EXISTS (
+                        SELECT 1 FROM staged WHERE staged.user_id = r.{staged_column}
+                    )
+                    RETURNING 1
+                ),
+                cleared AS (
+                    DELETE FROM secateur_relationship_staging WHERE run_id = %(run_id)s
+                )
+                SELECT (SELECT count(*) FROM added), (SELECT count(*) FROM removed)
+                """,
+                dict(run_id=run_id, type=type, account_id=account.pk, updated=updated),
+            )
+            added, removed = cursor.fetchone()
+        logger.info(
+            "Synced relationships",
+            account_id=account.pk,
+            type=type,
+            added=added,
+            removed=removed,
+        )
+        return added, removed
+
+
+class RelationshipCount(psqlextra.models.PostgresModel):
+    """How many blocks or mutes an account has, and how many of them have an 'until'.
+
+    Rows are kept up to date by statement triggers on Relationship (see migration
+    0056), so every way of writing relationships counts, including raw SQL. Follows
+    aren't counted: a page of followers would touch a row for every follower.
+    """
+
+    class Meta:
+        unique_together = (("account", "type"),)
+
+    COUNTED_TYPES = (Relationship.BLOCKS, Relationship.MUTES)
+
+    # Not a real foreign key: the triggers can write a row for an account that's
+    # being deleted.
+    account = models.ForeignKey(
+        Account,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        db_index=False,
+        related_name="+",
+    )
+    type = models.IntegerField(choices=Relationship.TYPE_CHOICES)
+    count = models.BigIntegerField(default=0)
+    expiring = models.BigIntegerField(default=0)
+
+    @classmethod
+    def for_account(cls, account_id: int) -> Dict[int, "RelationshipCount"]:
+        """The counts for each of COUNTED_TYPES, by type."""
+        counts = {
+            type: cls(account_id=account_id, type=type) for type in cls.COUNTED_TYPES
+        }
+        counts.update(
+            (count.type, count) for count in cls.objects.filter(account_id=account_id)
+        )
+        return counts
+
+
+class LogMessageManager(psqlextra.manager.PostgresManager):
+    def bulk_create(
+        self, objs: Iterable["LogMessage"], *args: Any, **kwargs: Any
+    ) -> Any:
+        objs = list(objs)
+        for obj in objs:
+            obj.set_expires()
+        return super().bulk_create(objs, *args, **kwargs)
 
 
-class LogMessage(psqlextra.models.PostgresModel):
+class LogMessage(psqlextra.models.PostgresPartitionedModel):
+    """Something that happened, shown to the user in their log.
+
+    The table is range partitioned by `expires`, a day per partition. Block and mute
+    messages expire `RETENTION` after they're logged and everything else expires at
+    `NEVER`, which has a partition of its own, so the default partition stays empty
+    (see migration 0054). `partitioning.manager` creates partitions ahead of time and
+    drops them once everything in them has expired.
+    """
+
     class Meta:
         indexes = (
             models.Index(name="log_user_id", fields=["user", "-id"]),
             BrinIndex(fields=["time"], autosummarize=True),
         )
 
+    class PartitioningMeta:
+        method = psqlextra.types.PostgresPartitioningMethod.RANGE
+        key = ["expires"]
+
+    objects = LogMessageManager()
+
+    # How long block and mute messages are kept for.
+    RETENTION = timedelta(days=14)
+    # The 'expires' of messages that are kept for good. The partition key can't be null.
+    NEVER = datetime(9999, 1, 1, tzinfo=dt_timezone.utc)
+
     class Action(models.IntegerChoices):
         GET_USER = 1
         CREATE_BLOCK = 2
@@ -504,6 +983,25 @@ class LogMessage(psqlextra.models.PostgresModel):
     )
     until = models.DateTimeField(null=True)
     rate_limited = models.BooleanField(null=True)
+    expires = models.DateTimeField(editable=False)
+
+    def set_expires(self) -> None:
+        if self.expires is None:
+            self.expires = (
+                self.time + self.RETENTION
+                if self.action
+                in (
+                    self.Action.CREATE_BLOCK,
+                    self.Action.DESTROY_BLOCK,
+                    self.Action.CREATE_MUTE,
+                    self.Action.DESTROY_MUTE,
+                )
+                else self.NEVER
+            )
+
+    def save(self, *args: Any, **kwargs: Any) -> None:
+        self.set_expires()
+        super().save(*args, **kwargs)
 
     def format_message(self) -> str:
         if self.action == self.Action.CREATE_BLOCK:
@@ -578,3 +1076,175 @@ class LogMessage(psqlextra.models.PostgresModel):
             )
         else:
             return format_html("{}", self.action)
+
+
+class PagedJobRun(psqlextra.models.PostgresModel):
+    """A run of a paged Twitter API fetch (a `tasks.PagedJob`), checkpointed after every page.
+
+    The cursor is only advanced in the same transaction that stores a page, so a run that
+    loses its Celery message can be resumed from where it got to.
+    """
+
+    class Meta:
+        indexes = (
+            models.Index(
+                fields=["updated"],
+                condition=Q(status__in=[1, 2]),
+                name="pagedjobrun_active_updated",
+            ),
+        )
+
+    class Status(models.IntegerChoices):
+        RUNNING = 1
+        PAUSED = 2
+        DONE = 3
+        FAILED = 4
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, editable=False)
+    job = models.JSONField(editable=False)
+    status = models.IntegerField(choices=Status.choices, default=Status.RUNNING)
+    cursor = models.BigIntegerField(default=-1, editable=False)
+    pages = models.IntegerField(default=0, editable=False)
+    # The run pauses when 'pages' reaches this, and resuming it raises it again.
+    max_pages = models.IntegerField(default=300)
+    accounts = models.IntegerField(default=0, editable=False)
+    delay_between_pages = models.IntegerField(default=0)
+    created = models.DateTimeField(default=timezone.now, editable=False)
+    updated = models.DateTimeField(default=timezone.now, editable=False)
+    error = models.TextField(null=True, blank=True, editable=False)
+    # How many times the run has been resumed after going quiet while running.
+    stalls = models.IntegerField(default=0, editable=False)
+
+    def __str__(self) -> str:
+        return "{endpoint} for {user} ({status})".format(
+            endpoint=self.job.get("endpoint"),
+            user=self.user,
+            status=self.get_status_display(),
+        )
+
+
+class Operation(psqlextra.models.PostgresModel):
+    """A block, mute, unblock or unmute waiting in the operations queue.
+
+    Operations are claimed in batches by `tasks.dispatch_operations()`, which deletes them
+    as it hands them to `create_relationships()` and `destroy_relationships()` chunks. So
+    this table only holds work that hasn't started: its size is the backlog, and deleting
+    rows from it cancels them.
+    """
+
+    class Meta:
+        indexes = (
+            models.Index(fields=["due"], name="operation_due"),
+            models.Index(
+                fields=["user", "action", "due"], name="operation_user_action_due"
+            ),
+        )
+
+    class Action(models.IntegerChoices):
+        # The same values as the matching LogMessage.Action.
+        CREATE_BLOCK = 2
+        DESTROY_BLOCK = 3
+        CREATE_MUTE = 4
+        DESTROY_MUTE = 5
+
+    # Rows come and go all the time, so the ids run out faster than most tables'.
+    id = models.BigAutoField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False)
+    action = models.IntegerField(choices=Action.choices)
+    # The Twitter user id of the account to block, mute, unblock or unmute.
+    target_id = models.BigIntegerField()
+    until = models.DateTimeField(null=True, blank=True)
+    due = models.DateTimeField()
+    created = models.DateTimeField(default=timezone.now, editable=False)
+
+    @classmethod
+    def schedule(
+        cls,
+        user_id: int,
+        action: int,
+        target_ids: Iterable[int],
+        due: datetime,
+        until: Optional[datetime] = None,
+    ) -> int:
+        operations = cls.objects.bulk_create(
+            cls(
+                user_id=user_id,
+                action=action,
+                target_id=target_id,
+                until=until,
+                due=due,
+            )
+            for target_id in target_ids
+        )
+        return len(operations)
+
+    @staticmethod
+    def due_groups(now: datetime, limit: int) -> List[Tuple[int, int]]:
+        """Up to `limit` (user_id, action) pairs that have operations due.
+
+        A DISTINCT over the due rows would read every one of them, and there can be
+        millions. Instead this skips through operation_user_action_due from one pair to
+        the next, and checks each pair's earliest operation, so it costs a couple of
+        index lookups per pair however many operations each has.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                WITH RECURSIVE pairs AS (
+                    (
+                        SELECT user_id, action FROM secateur_operation
+                        ORDER BY user_id, action
+                        LIMIT 1
+                    )
+                    UNION ALL
+                    SELECT next.user_id, next.action FROM pairs, LATERAL (
+                        SELECT user_id, action FROM secateur_operation
+                        WHERE (user_id, action) > (pairs.user_id, pairs.action)
+                        ORDER BY user_id, action
+                        LIMIT 1
+                    ) AS next
+                )
+                SELECT user_id, action FROM pairs
+                WHERE EXISTS (
+                    SELECT 1 FROM secateur_operation
+                    WHERE user_id = pairs.user_id
+                    AND action = pairs.action
+                    AND due <= %s
+                )
+                LIMIT %s
+                """,
+                [now, limit],
+            )
+            return cursor.fetchall()
+
+    @classmethod
+    def claim(
+        cls, user_id: int, action: int, limit: int, now: datetime
+    ) -> List[Tuple[int, Optional[datetime]]]:
+        """Delete up to `limit` of a user's due operations, returning (target_id, until).
+
+        Rows another worker is claiming are skipped rather than waited for. Whatever's
+        claimed must be dispatched in the same transaction.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                DELETE FROM secateur_operation WHERE id IN (
+                    SELECT id FROM secateur_operation
+                    WHERE user_id = %s AND action = %s AND due <= %s
+                    ORDER BY due
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING target_id, until
+                """,
+                [user_id, action, now, limit],
+            )
+            return cursor.fetchall()
+
+    @classmethod
+    def postpone(cls, user_id: int, action: int, now: datetime, due: datetime) -> int:
+        """Make a user's operations that are due by `now` due at `due` instead."""
+        return cls.objects.filter(user_id=user_id, action=action, due__lte=now).update(
+            due=due
+        )
@@ -89,3 +89,22 @@ signup_counter = meter.create_counter(
     name="signup",
     unit="1",
 )
+relationships_removed_counter = meter.create_counter(
+    name="relationships_removed",
+    unit="1",
+)
+twitter_http_pool_hit_counter = meter.create_counter(
+    name="twitter_http_pool_hit",
+    description="Requests to Twitter that reused an open connection.",
+    unit="1",
+)
+twitter_http_pool_miss_counter = meter.create_counter(
+    name="twitter_http_pool_miss",
+    description="Requests to Twitter that had to open a new connection.",
+    unit="1",
+)
+twitter_http_pool_exhausted_counter = meter.create_counter(
+    name="twitter_http_pool_exhausted",
+    description="Requests to Twitter that gave up waiting for a free connection.",
+    unit="1",
+)
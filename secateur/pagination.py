@@ -0,0 +1,185 @@
+"""Keyset pagination.
+
+Each page is fetched by seeking past the sort key of the last row of the previous page,
+so a page costs the same however deep it is, and rows written while someone's paging
+don't shift the pages along.
+"""
+
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from django.core import signing
+from django.core.exceptions import ImproperlyConfigured
+from django.db import models
+from django.db.models import F, Func, Value
+from django.db.models.expressions import Combinable
+from django.http import Http404
+
+_SALT = "secateur.pagination"
+
+
+class Row(Func):
+    """A row constructor, which compares column by column: (a, b) > (c, d)."""
+
+    function = "ROW"
+    output_field = models.Field()
+
+
+@dataclass
+class KeysetPage:
+    object_list: List[Any]
+    next_cursor: Optional[str]
+    previous_cursor: Optional[str]
+
+    @property
+    def has_next(self) -> bool:
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self) -> bool:
+        return self.previous_cursor is not None
+
+    def has_other_pages(self) -> bool:
+        return self.has_next or self.has_previous
+
+    def __iter__(self) -> Any:
+        return iter(self.object_list)
+
+    def __len__(self) -> int:
+        return len(self.object_list)
+
+
+class KeysetPaginator:
+    """Pages through `queryset` in order of `keys`, which must identify a row.
+
+    `keys` are (expression, output_field) pairs, all sorted in the same direction so
+    they can be compared as a row, and there should be an index that matches them. The
+    cursors handed out are opaque and signed.
+    """
+
+    def __init__(
+        self,
+        queryset: models.QuerySet,
+        keys: Sequence[Tuple[Combinable, models.Field]],
+        per_page: int,
+        descending: bool = False,
+    ) -> None:
+        self.keys = keys
+        self.per_page = per_page
+        self.descending = descending
+        self.aliases = [f"_keyset_{i}" for i in range(len(keys))]
+        self.queryset = queryset.annotate(
+            **{alias: key for alias, (key, _) in zip(self.aliases, keys)}
+        )
+
+    def _encode(self, direction: str, obj: Any) -> str:
+        values = [
+            value.isoformat() if isinstance(value, datetime) else value
+            for value in (getattr(obj, alias) for alias in self.aliases)
+        ]
+        return signing.dumps([direction, values], salt=_SALT, compress=True)
+
+    def _decode(self, cursor: str) -> Tuple[str, List[Any]]:
+        try:
+            direction, values = signing.loads(cursor, salt=_SALT)
+        except (signing.BadSignature, ValueError) as e:
+            raise Http404("Invalid page cursor") from e
+        if direction not in ("next", "previous") or len(values) != len(self.keys):
+            raise Http404("Invalid page cursor")
+        return direction, [
+            output_field.to_python(value)
+            for value, (_, output_field) in zip(values, self.keys)
+        ]
+
+    def page(self, cursor: Optional[str] = None) -> KeysetPage:
+        direction, values = self._decode(cursor) if cursor else ("next", None)
+        # Fetching the previous page is fetching the next page in the opposite order.
+        backwards = direction == "previous"
+        descending = self.descending != backwards
+        queryset = self.queryset
+        if values is not None:
+            row = Row(*(F(alias) for alias in self.aliases))
+            after = Row(
+                *(
+                    Value(value, output_field=output_field)
+                    for value, (_, output_field) in zip(values, self.keys)
+                )
+            )
+            queryset = queryset.alias(_keyset=row).filter(
+                **{"_keyset__lt" if descending else "_keyset__gt": after}
+            )
+        queryset = queryset.order_by(
+            *(f"-{alias}" if descending else alias for alias in self.aliases)
+        )
+        object_list = list(queryset[: self.per_page + 1])
+        more = len(object_list) > self.per_page
+        object_list = object_list[: self.per_page]
+        if backwards:
+            object_list.reverse()
+        if not object_list:
+            return KeysetPage([], None, None)
+        return KeysetPage(
+            object_list,
+            next_cursor=(
+                self._encode("next", object_list[-1]) if more or backwards else None
+            ),
+            previous_cursor=(
+                self._encode("previous", object_list[0])
+                if (more if backwards else values is not None)
+                else None
+            ),
+        )
+
+
+class KeysetPaginationMixin:
+    """Keyset pagination for a ListView, with the cursor in the "page" GET parameter.
+
+    Views set `keyset` to the `KeysetPaginator` keys to page by, or override
+    `get_keyset()` if they depend on the request.
+
+    The page is in the context as `page_obj`, as with Django's pagination, but it only
+    knows whether there are next and previous pages, so the context has `next_page_url`
+    and `previous_page_url` for the pagination.html template instead of page numbers.
+    """
+
+    paginate_by: int
+    request: Any
+    keyset: Optional[Sequence[Tuple[Combinable, models.Field]]] = None
+    keyset_descending = False
+
+    def get_keyset(self) -> Sequence[Tuple[Combinable, models.Field]]:
+        if self.keyset is None:
+            raise ImproperlyConfigured(
+                f"{self.__class__.__name__} is missing a keyset. Define "
+                f"{self.__class__.__name__}.keyset or override "
+                f"{self.__class__.__name__}.get_keyset()."
+            )
+        return self.keyset
+
+    def paginate_queryset(
+        self, queryset: models.QuerySet, page_size: int
+    ) -> Tuple[KeysetPaginator, KeysetPage, List[Any], bool]:
+        paginator = KeysetPaginator(
+            queryset,
+            self.get_keyset(),
+            per_page=page_size,
+            descending=self.keyset_descending,
+        )
+        page = paginator.page(self.request.GET.get("page"))
+        return paginator, page, page.object_list, page.has_other_pages()
+
+    def _page_url(self, cursor: Optional[str]) -> Optional[str]:
+        if cursor is None:
+            return None
+        query = self.request.GET.copy()
+        query["page"] = cursor
+        return "?" + query.urlencode()
+
+    def get_context_data(self, **kwargs: Any) -> Dict[str, Any]:
+        context = super().get_context_data(**kwargs)  # type: ignore
+        page = context.get("page_obj")
+        if page is not None:
+            context["next_page_url"] = self._page_url(page.next_cursor)
+            context["previous_page_url"] = self._page_url(page.previous_cursor)
+        return context
@@ -0,0 +1,21 @@
+from dateutil.relativedelta import relativedelta
+from psqlextra.partitioning import (
+    PostgresPartitioningManager,
+    partition_by_current_time,
+)
+
+from . import models
+
+# Applied by the delete_old_block_log_messages task, or `python manage.py pgpartition`.
+manager = PostgresPartitioningManager(
+    [
+        # LogMessage is partitioned by when messages expire, so the partitions to create
+        # run up to RETENTION ahead, and yesterday's partition is entirely expired.
+        partition_by_current_time(
+            models.LogMessage,
+            days=1,
+            count=models.LogMessage.RETENTION.days + 2,
+            max_age=relativedelta(days=1),
+        ),
+    ]
+)
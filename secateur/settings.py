@@ -95,6 +95,7 @@ DATABASES = {
     "default": dj_database_url.config(default="postgres://postgres@postgres/postgres")
 }
 DATABASES["default"]["ENGINE"] = "psqlextra.backend"
+PSQLEXTRA_PARTITIONING_MANAGER = "secateur.partitioning.manager"
 
 # Password validation
 # https://docs.djangoproject.com/en/2.0/ref/settings/#auth-password-validators
@@ -165,6 +166,8 @@ if CELERY_BROKER_URL.lower().startswith("redis"):
     CELERY_BROKER_TRANSPORT_OPTIONS = {
         "visibility_timeout": 60 * 60 * 24,
         "queue_order_strategy": "priority",
+        # One step per priority, so _BlockerLane's priorities are all distinct.
+        "priority_steps": list(range(10)),
     }
 elif CELERY_BROKER_URL.lower().startswith("sqs"):
     CELERY_BROKER_TRANSPORT_OPTIONS = {
@@ -176,18 +179,45 @@ elif CELERY_BROKER_URL.lower().startswith("sqs"):
     }
 CELERY_RESULT_BACKEND = "redis://redis/1"
 CELERY_IMPORTS = ["secateur.tasks"]
-CELERY_TASK_SERIALIZER = (
-    "pickle"  # 'pickle' because I'm passing partial functions around.
-)
-CELERY_RESULT_SERIALIZER = "pickle"
-CELERY_ACCEPT_CONTENT = ["pickle"]
+CELERY_TASK_SERIALIZER = "json"
+CELERY_RESULT_SERIALIZER = "json"
+# 'pickle' is only still accepted so that messages queued before the switch to JSON can
+# drain. Drop it once they have.
+CELERY_ACCEPT_CONTENT = ["json", "pickle"]
 CELERY_TASK_ROUTES = {
     "secateur.tasks.create_relationship": {"queue": "blocker"},
     "secateur.tasks.create_relationships": {"queue": "blocker"},
     "secateur.tasks.destroy_relationship": {"queue": "blocker"},
+    "secateur.tasks.destroy_relationships": {"queue": "blocker"},
+    "secateur.tasks.dispatch_operations": {"queue": "blocker"},
     "secateur.tasks.mem_top": {"queue": "blocker"},
 }
 
+# How many Twitter API calls a single create_relationships() chunk makes at once.
+CREATE_RELATIONSHIPS_CONCURRENCY = int(
+    os.environ.get("CREATE_RELATIONSHIPS_CONCURRENCY", "5")
+)
+# How many Twitter API calls a single destroy_relationships() chunk makes at once.
+DESTROY_RELATIONSHIPS_CONCURRENCY = int(
+    os.environ.get("DESTROY_RELATIONSHIPS_CONCURRENCY", "5")
+)
+# How many greenlets one user's blocker tasks can occupy at once, across all workers.
+BLOCKER_GREENLETS_PER_USER = int(os.environ.get("BLOCKER_GREENLETS_PER_USER", "10"))
+# Where to find the Twitter API. Benchmarks point this at secateur.fake_twitter.
+TWITTER_API_BASE_URL = os.environ.get(
+    "TWITTER_API_BASE_URL", "https://api.twitter.com/1.1"
+)
+# How many connections to Twitter one process keeps open, shared between all its users.
+# Requests wait for a free connection once they're all in use, for up to
+# TWITTER_HTTP_POOL_TIMEOUT seconds.
+TWITTER_HTTP_POOL_SIZE = int(os.environ.get("TWITTER_HTTP_POOL_SIZE", "80"))
+TWITTER_HTTP_POOL_TIMEOUT = float(os.environ.get("TWITTER_HTTP_POOL_TIMEOUT", "30"))
+# How many seconds a profile we've fetched from Twitter is good for when looking an
+# account up by screen name, before we ask Twitter again.
+ACCOUNT_PROFILE_MAX_AGE = int(
+    os.environ.get("ACCOUNT_PROFILE_MAX_AGE", str(24 * 60 * 60))
+)
+
 
 CACHES = {
     "default": {
@@ -2,23 +2,30 @@ import datetime
 import enum
 
 import random
-from functools import partial
+import time
+from dataclasses import asdict, dataclass, field
 from importlib import import_module
-from typing import Optional, Callable, List, Iterable
+from typing import Any, Optional, Callable, Dict, List, Iterable, Set, Tuple, Union
 
 import celery
+import gevent.event
+import gevent.pool
 import structlog
 import requests.exceptions
 import opentelemetry.trace
+import twitter
+from django.conf import settings
 from django.db import transaction
 from django.core.cache import cache
 from django.db.models import Q, F
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from twitter.error import TwitterError
 
 from . import models
 from .celery import app
-from .utils import ErrorCode, fudge_duration, chunks
+from .twitter_client import TwitterClient, UserDict
+from .utils import ErrorCode, EndpointRateLimit, fudge_duration, chunks
 from . import otel
 
 logger = structlog.get_logger(__name__)
@@ -32,6 +39,15 @@ class RelationshipType(enum.IntEnum):
     MUTE = 3
 
 
+def _as_datetime(
+    value: "Union[None, str, datetime.datetime]",
+) -> Optional[datetime.datetime]:
+    """Datetime task arguments arrive as ISO 8601 strings after going through the JSON serializer."""
+    if isinstance(value, str):
+        return parse_datetime(value)
+    return value
+
+
 def _twitter_retry_timeout(base: int = 900, retries: int = 0) -> int:
     """
     Twitter calculates all its rate limiting in 15 minute blocks. If we
@@ -62,10 +78,140 @@ def _twitter_retry_timeout(base: int = 900, retries: int = 0) -> int:
     return timeout
 
 
-@app.task
-def get_user(
+def _rate_limit_countdown(until: datetime.datetime, now: datetime.datetime) -> int:
+    """Seconds to wait till a rate limit window resets.
+
+    There's a little jitter so everything waiting on the same window doesn't wake up at once.
+    """
+    return max(int((until - now).total_seconds()), 0) + random.randint(5, 60)
+
+
+class _RateLimitPacer:
+    """Paces one secateur user's calls to one Twitter endpoint.
+
+    Every response from Twitter says how many calls are left in the current 15 minute window
+    and when it resets. We keep that in the cache so every worker can see it, and once the
+    window is used up nobody calls the endpoint again till it resets.
+    """
+
+    ENDPOINT_PATHS = {
+        "create_block": "/blocks/create",
+        "create_mute": "/mutes/users/create",
+        "destroy_block": "/blocks/destroy",
+        "destroy_mute": "/mutes/users/destroy",
+    }
+
+    def __init__(
+        self,
+        secateur_user: "models.User",
+        api: Optional[TwitterClient],
+        endpoint: str,
+    ) -> None:
+        # The api is only needed to record rate limits, not to check them.
+        self.api = api
+        self.path = self.ENDPOINT_PATHS[endpoint]
+        self.key = "{}:{}:rate-limit".format(secateur_user.username, endpoint)
+        self.status_key = self.key + "-status"
+
+    def limited_until(self, now: datetime.datetime) -> Optional[datetime.datetime]:
+        """If the window is used up, the time it resets."""
+        until = cache.get(self.key)
+        return until if until and until > now else None
+
+    def status(self) -> Optional[EndpointRateLimit]:
+        """The calls left in the current window and when it resets, if we know."""
+        return cache.get(self.status_key)
+
+    def record(self, now: datetime.datetime) -> None:
+        """Save the rate limit from the headers of the latest response."""
+        assert self.api is not None
+        status = EndpointRateLimit.from_api(self.api, self.path)
+        if status is None:
+            return
+        timeout = max(int(status.reset - now.timestamp()), 1)
+        cache.set(self.status_key, status, timeout)
+        if status.remaining <= 0:
+            cache.set(self.key, status.reset_time, timeout)
+
+    def rate_limited(self, now: datetime.datetime) -> datetime.datetime:
+        """Twitter turned a call down, so stop calling till the window resets."""
+        assert self.api is not None
+        status = EndpointRateLimit.from_api(self.api, self.path)
+        if status is not None and status.reset > now.timestamp():
+            until = status.reset_time
+        else:
+            until = now + datetime.timedelta(seconds=15 * 60)
+        cache.set(self.key, until, max(int((until - now).total_seconds()), 1))
+        return until
+
+
+class _BlockerLane:
+    """One secateur user's lane on the shared blocker queue.
+
+    Each chunk a user queues takes the next place in their lane, and its Celery priority
+    is that place: everybody's first chunk is served before anybody's second, and so on.
+    Past the lowest priority, a heavy user's chunks only compete with each other, so a
+    user with one chunk queued doesn't wait behind someone else's million.
+
+    The lane also caps how many greenlets the user's tasks can occupy at once, across
+    all the blocker workers, and dispatch_operations() only queues as many chunks as
+    would fill them.
+    """
+
+    LOWEST_PRIORITY = 9
+    TIMEOUT = 60 * 60
+
+    def __init__(self, secateur_user: "models.User") -> None:
+        self.queued_key = "{}:blocker-queued".format(secateur_user.username)
+        self.greenlets_key = "{}:blocker-greenlets".format(secateur_user.username)
+
+    @staticmethod
+    def _incr(key: str, delta: int, timeout: int) -> int:
+        # The timeouts mean that a count that drifts, say when a worker is killed, is
+        # eventually forgotten rather than penalising the user forever.
+        cache.add(key, 0, timeout)
+        try:
+            return cache.incr(key, delta)
+        except ValueError:
+            cache.set(key, max(delta, 0), timeout)
+            return max(delta, 0)
+
+    def enqueue(self) -> int:
+        """Take the next place in the lane, returning the Celery priority to queue with."""
+        position = self._incr(self.queued_key, 1, self.TIMEOUT) - 1
+        return min(max(position, 0), self.LOWEST_PRIORITY)
+
+    def dequeued(self) -> None:
+        """A chunk from the lane has started."""
+        if self._incr(self.queued_key, -1, self.TIMEOUT) < 0:
+            cache.set(self.queued_key, 0, self.TIMEOUT)
+
+    def room(self, concurrency: int) -> int:
+        """How many more chunks of `concurrency` calls to queue for the user right now.
+
+        That's as many as the user's greenlets can run at once, less those already
+        waiting in the broker.
+        """
+        chunks = -(-settings.BLOCKER_GREENLETS_PER_USER // max(concurrency, 1))
+        return max(chunks - (cache.get(self.queued_key) or 0), 0)
+
+    def acquire(self, wanted: int) -> int:
+        """Claim up to `wanted` greenlets, returning how many were granted."""
+        in_use = self._incr(self.greenlets_key, wanted, self.TIMEOUT)
+        excess = min(max(in_use - settings.BLOCKER_GREENLETS_PER_USER, 0), wanted)
+        if excess:
+            self._incr(self.greenlets_key, -excess, self.TIMEOUT)
+        return wanted - excess
+
+    def release(self, greenlets: int) -> None:
+        if greenlets:
+            self._incr(self.greenlets_key, -greenlets, self.TIMEOUT)
+
+
+def fetch_account(
     secateur_user_pk: int, user_id: int = None, screen_name: str = None
 ) -> "Optional[models.Account]":
+    """Fetch a profile from Twitter, returning None if the user is suspended or doesn't exist."""
     secateur_user = models.User.objects.get(pk=secateur_user_pk)
     api = secateur_user.api
     try:
@@ -89,7 +235,238 @@ def get_user(
     return account
 
 
-@app.task(bind=True, ignore_result=True)
+@app.task
+def get_user(
+    secateur_user_pk: int, user_id: int = None, screen_name: str = None
+) -> Optional[int]:
+    """`fetch_account()` as a task. The result is the account's user_id, not the Account."""
+    account = fetch_account(secateur_user_pk, user_id=user_id, screen_name=screen_name)
+    return account.user_id if account is not None else None
+
+
+## SCREEN NAME RESOLUTION
+#
+# The cache maps a screen name to the user_id we last fetched it as, for as long as that
+# fetch is fresh, so everybody looking the same name up shares one GetUser call. On a
+# cache miss, an Account with the screen name whose profile_fetched is fresh enough
+# will do too, and only if there isn't one do we ask Twitter.
+
+_SCREEN_NAME_NOT_FOUND = 0
+# How long to remember that a screen name doesn't exist or is suspended.
+_SCREEN_NAME_NOT_FOUND_TIMEOUT = 5 * 60
+# How long one lookup can hold the lock before others give up waiting for it.
+_SCREEN_NAME_LOCK_TIMEOUT = 30
+_SCREEN_NAME_POLL_INTERVAL = 0.1
+
+
+def _screen_name_key(screen_name: str) -> str:
+    return "screen-name:{}".format(screen_name.lower())
+
+
+def _cached_account(screen_name: str, user_id: int) -> "Optional[models.Account]":
+    """The account the cache says has `screen_name`, if it still has it."""
+    account = models.Account.objects.filter(pk=user_id).first()
+    if account is None or (account.screen_name or "").lower() != screen_name.lower():
+        return None
+    return account
+
+
+def _local_account(screen_name: str) -> "Optional[models.Account]":
+    """The account we most recently saw with `screen_name`, however long ago."""
+    return (
+        models.Account.objects.filter(screen_name__iexact=screen_name)
+        .order_by(F("profile_fetched").desc(nulls_last=True))
+        .first()
+    )
+
+
+def resolve_account(
+    secateur_user_pk: int, screen_name: str, max_age: Optional[int] = None
+) -> "Optional[models.Account]":
+    """Find the account with `screen_name`, only asking Twitter if we haven't lately.
+
+    Returns None if the user is suspended or doesn't exist. `max_age` is how many
+    seconds a fetch is good for, and defaults to settings.ACCOUNT_PROFILE_MAX_AGE.
+    Concurrent lookups of the same name wait for whichever of them got in first rather
+    than each calling GetUser. If the secateur user's API is disabled, it makes do with
+    whatever we have locally, however stale.
+    """
+    if max_age is None:
+        max_age = settings.ACCOUNT_PROFILE_MAX_AGE
+    log = logger.bind(screen_name=screen_name)
+    key = _screen_name_key(screen_name)
+    lock_key = key + ":lock"
+    deadline = time.monotonic() + _SCREEN_NAME_LOCK_TIMEOUT
+
+    while True:
+        user_id = cache.get(key)
+        if user_id == _SCREEN_NAME_NOT_FOUND:
+            log.debug("Screen name cached as not found.")
+            return None
+        elif user_id is not None:
+            account = _cached_account(screen_name, user_id)
+            if account is not None:
+                log.debug("Screen name resolved from cache.", user_id=user_id)
+                return account
+
+        account = _local_account(screen_name)
+        if account is not None and account.profile_fetched is not None:
+            age = (timezone.now() - account.profile_fetched).total_seconds()
+            if age < max_age:
+                log.debug("Screen name resolved from the database.", user_id=account.pk)
+                cache.set(key, account.user_id, max(int(max_age - age), 1))
+                return account
+
+        if cache.add(lock_key, True, _SCREEN_NAME_LOCK_TIMEOUT):
+            break
+        if time.monotonic() > deadline:
+            log.warning("Gave up waiting for another lookup of the screen name.")
+            break
+        time.sleep(_SCREEN_NAME_POLL_INTERVAL)
+
+    try:
+        log.debug("Fetching screen name from Twitter.")
+        try:
+            account = fetch_account(secateur_user_pk, screen_name=screen_name)
+        except models.TwitterApiDisabled:
+            log.info("Twitter API disabled, resolving screen name from the database.")
+            return _local_account(screen_name)
+        if account is None:
+            cache.set(key, _SCREEN_NAME_NOT_FOUND, _SCREEN_NAME_NOT_FOUND_TIMEOUT)
+        else:
+            cache.set(key, account.user_id, max_age)
+        return account
+    finally:
+        cache.delete(lock_key)
+
+
+def _create_relationship_api(
+    secateur_user: "models.User", api: TwitterClient, type: RelationshipType
+) -> "Tuple[models.LogMessage.Action, Callable, _RateLimitPacer, Any]":
+    """Pick the log action, API function, rate limit pacer and counter for `type`."""
+    if type is RelationshipType.BLOCK:
+        return (
+            models.LogMessage.Action.CREATE_BLOCK,
+            api.CreateBlock,
+            _RateLimitPacer(secateur_user, api, "create_block"),
+            otel.twitter_block_counter,
+        )
+    elif type is RelationshipType.MUTE:
+        return (
+            models.LogMessage.Action.CREATE_MUTE,
+            api.CreateMute,
+            _RateLimitPacer(secateur_user, api, "create_mute"),
+            otel.twitter_mute_counter,
+        )
+    else:
+        raise ValueError("Don't know how to handle type %r", type)
+
+
+# Any of these errors means the rest of a create_relationships() chunk would fail too.
+_STOP_CHUNK_ERROR_CODES = (
+    ErrorCode.RATE_LIMITED_EXCEEDED,
+    ErrorCode.INVALID_OR_EXPIRED_TOKEN,
+    ErrorCode.ACCOUNT_SUSPENDED,
+    ErrorCode.ACCOUNT_TEMPORARILY_LOCKED,
+)
+# How long the rest of a chunk waits to be tried again after a call fails in a way we
+# don't know how to handle.
+_FAILED_CHUNK_COUNTDOWN = 5 * 60
+
+
+def _chunk_error_code(e: Exception) -> Optional[ErrorCode]:
+    """The ErrorCode of `e`, or None if it isn't a TwitterError with a code we know."""
+    if not isinstance(e, TwitterError):
+        return None
+    try:
+        return ErrorCode.from_exception(e)
+    except ValueError:
+        return None
+
+
+class _CreatedRelationshipsBuffer:
+    """Collects the results of a chunk of block/mute calls and saves them in bulk.
+
+    Instead of an Account upsert, a Relationship upsert and a LogMessage insert for every
+    account, `flush()` writes everything it has collected with one statement each. It
+    flushes itself when it reaches `max_size`, and must be flushed once more at the end
+    of the chunk.
+    """
+
+    def __init__(
+        self,
+        secateur_user: "models.User",
+        type: RelationshipType,
+        action: "models.LogMessage.Action",
+        now: datetime.datetime,
+        until: Optional[datetime.datetime],
+        max_size: int = 500,
+    ) -> None:
+        self.secateur_user = secateur_user
+        self.type = type
+        self.action = action
+        self.now = now
+        self.until = until
+        self.max_size = max_size
+        self.twitter_users: "Dict[int, Union[twitter.User, UserDict]]" = {}
+        self.rate_limited = 0
+
+    def __len__(self) -> int:
+        return len(self.twitter_users) + self.rate_limited
+
+    def add(self, twitter_user: "Union[twitter.User, UserDict]") -> None:
+        self.twitter_users[models.twitter_user_id(twitter_user)] = twitter_user
+        if len(self) >= self.max_size:
+            self.flush()
+
+    def add_rate_limited(self) -> None:
+        self.rate_limited += 1
+
+    @transaction.atomic
+    def flush(self) -> None:
+        if not len(self):
+            return
+        log_messages = [
+            models.LogMessage(
+                user=self.secateur_user,
+                action=self.action,
+                rate_limited=True,
+                time=self.now,
+            )
+            for _ in range(self.rate_limited)
+        ]
+        if self.twitter_users:
+            models.Account.write_accounts(*self.twitter_users.values(), now=self.now)
+            models.Relationship.write_relationships(
+                type=self.type,
+                subject_ids=[self.secateur_user.account_id],
+                object_ids=self.twitter_users,
+                updated=self.now,
+                until=self.until,
+            )
+            log_messages.extend(
+                models.LogMessage(
+                    user=self.secateur_user,
+                    time=self.now,
+                    action=self.action,
+                    account_id=user_id,
+                    until=self.until,
+                )
+                for user_id in self.twitter_users
+            )
+        models.LogMessage.objects.bulk_create(log_messages)
+        logger.debug(
+            "Flushed created relationships",
+            user=self.secateur_user.username,
+            type=self.type.name,
+            len_accounts=len(self.twitter_users),
+            rate_limited=self.rate_limited,
+        )
+        self.twitter_users = {}
+        self.rate_limited = 0
+
+
+@app.task(bind=True, max_retries=15, ignore_result=True)
 def create_relationships(
     self: celery.Task,
     secateur_user_pk: int,
@@ -98,32 +475,220 @@ def create_relationships(
     screen_name: Optional[str] = None,
     until: Optional[datetime.datetime] = None,
 ) -> None:
-    """Directly calls 'create_relationship() for each id in `user_ids`. Doesn't call it as a task.
+    """Create a block or mute for each id in `user_ids`.
 
     This is for grouping a chunk of blocks into a single celery task, reducing the number of Celery
-    messages being sent through the Celery broker.
+    messages being sent through the Celery broker. The secateur user, the relationships that already
+    exist, the user's friends and the cached rate limit are all loaded once for the whole chunk, so
+    the only per-id work is the Twitter API call. Up to `settings.CREATE_RELATIONSHIPS_CONCURRENCY`
+    calls run at once, as long as the user's `_BlockerLane` has that many greenlets to spare, and
+    results are saved in bulk by `_CreatedRelationshipsBuffer`.
 
-    It might do strange wrong things on errors.
+    If we hit a rate limit part way through, the ids that are left go back in the operations queue.
     """
-    current_span = opentelemetry.trace.get_current_span()
-    current_span.set_attributes(
-        dict(secateur_user_pk=secateur_user_pk, type=str(type), until=str(until))
-    )
-    for user_id in user_ids:
+    if screen_name is not None:
+        # Screen names can't be checked in bulk, so hand them to the single version.
         create_relationship.apply(
             [],
             dict(
                 secateur_user_pk=secateur_user_pk,
                 type=type,
-                user_id=user_id,
                 screen_name=screen_name,
                 until=until,
             ),
             throw=True,
         )
-    logger.debug(
+    if not user_ids:
+        return
+
+    until = _as_datetime(until)
+    current_span = opentelemetry.trace.get_current_span()
+    current_span.set_attributes(
+        dict(secateur_user_pk=secateur_user_pk, type=str(type), until=str(until))
+    )
+
+    secateur_user = models.User.objects.select_related("account").get(
+        pk=secateur_user_pk
+    )
+    log = logger.bind(user=secateur_user.username, function="create_relationships")
+    lane = _BlockerLane(secateur_user)
+    if not self.request.retries:
+        lane.dequeued()
+    try:
+        api = secateur_user.api
+    except models.TwitterApiDisabled as e:
+        current_span.record_exception(e)
+        log.error("Twitter API not enabled")
+        return
+    now = timezone.now()
+    type = RelationshipType(type)
+    action, api_function, pacer, counter = _create_relationship_api(
+        secateur_user, api, type
+    )
+    log = log.bind(
+        action=action.name, until=str(until) if until else until, type=type.name
+    )
+    assert secateur_user.account is not None
+
+    def reschedule(remaining: List[int], countdown: int) -> None:
+        """Put `remaining` back in the operations queue, due in `countdown` seconds."""
+        models.Operation.schedule(
+            user_id=secateur_user_pk,
+            action=action,
+            target_ids=remaining,
+            due=timezone.now() + datetime.timedelta(seconds=countdown),
+            until=until,
+        )
+
+    ## CHECK WHICH RELATIONSHIPS ALREADY EXIST
+    existing_rel_qs = models.Relationship.objects.filter(
+        subject_id=secateur_user.account_id, type=type, object_id__in=user_ids
+    )
+    already_existing = set(existing_rel_qs.values_list("object_id", flat=True))
+    if already_existing:
+        existing_rel_qs.update(until=until)
+    friends = set(
+        models.Relationship.objects.filter(
+            subject_id=secateur_user.account_id,
+            type=models.Relationship.FOLLOWS,
+            object_id__in=user_ids,
+        ).values_list("object_id", flat=True)
+    )
+    pending = [
+        user_id
+        for user_id in user_ids
+        if user_id not in already_existing and user_id not in friends
+    ]
+    log.info(
+        "create_relationships filtered",
+        len_user_ids=len(user_ids),
+        len_already_existing=len(already_existing),
+        len_friends=len(friends),
+        len_pending=len(pending),
+    )
+    if not pending:
+        return
+
+    ## CHECK CACHED RATE LIMIT
+    # Anything that has to wait goes back in the operations queue, rather than sitting in
+    # the broker with a countdown.
+    limited_until = pacer.limited_until(now)
+    if limited_until:
+        log.debug("local rate limit exceeded", limited_until=str(limited_until))
+        reschedule(pending, _rate_limit_countdown(limited_until, now))
+        return
+    status = pacer.status()
+    if status is not None and status.remaining < len(pending):
+        # Only make the calls that are left in this window, and do the rest once it resets.
+        deferred = pending[status.remaining :]
+        pending = pending[: status.remaining]
+        log.debug("deferring past the rate limit window", len_deferred=len(deferred))
+        reschedule(deferred, _rate_limit_countdown(status.reset_time, now))
+
+    greenlets = lane.acquire(
+        min(settings.CREATE_RELATIONSHIPS_CONCURRENCY, len(pending))
+    )
+    if not greenlets:
+        log.debug("user's greenlets are all busy, rescheduling")
+        reschedule(pending, random.randint(5, 30))
+        return
+
+    ## CALL THE TWITTER API
+    # The calls run concurrently in a small greenlet pool, but everything that touches the
+    # database stays in this greenlet: under gevent each greenlet gets its own DB connection.
+    stop_calls = gevent.event.Event()
+
+    def call_api(user_id: int) -> Tuple[int, Any]:
+        """Returns the API result or the exception raised, or None if the chunk was stopped."""
+        if stop_calls.is_set():
+            return user_id, None
+        counter.add(1)
+        try:
+            return user_id, api_function(
+                user_id=user_id,
+                include_entities=False,
+                skip_status=True,
+            )
+        except Exception as e:
+            if _chunk_error_code(e) in _STOP_CHUNK_ERROR_CODES:
+                stop_calls.set()
+            return user_id, e
+
+    buffer = _CreatedRelationshipsBuffer(
+        secateur_user=secateur_user, type=type, action=action, now=now, until=until
+    )
+    pool = gevent.pool.Pool(greenlets)
+    not_attempted: Set[int] = set()
+    disabled_by: Optional[ErrorCode] = None
+    # The first error we don't know how to handle, raised once the chunk is wrapped up.
+    failed: Optional[Exception] = None
+    try:
+        for user_id, result in pool.imap_unordered(call_api, pending):
+            code = _chunk_error_code(result) if isinstance(result, Exception) else None
+            if isinstance(result, Exception):
+                current_span.record_exception(result)
+            if result is None:
+                not_attempted.add(user_id)
+            elif isinstance(result, requests.exceptions.ConnectionError):
+                log.error("connection error", user_id=user_id, exc_info=result)
+            elif code == ErrorCode.RATE_LIMITED_EXCEEDED:
+                not_attempted.add(user_id)
+                if not buffer.rate_limited:
+                    limited_until = pacer.rate_limited(timezone.now())
+                    log.warning("rate limit exceeded", limited_until=str(limited_until))
+                    buffer.add_rate_limited()
+            elif code in _STOP_CHUNK_ERROR_CODES:
+                disabled_by = code
+            elif code == ErrorCode.USER_NOT_FOUND:
+                log.info("user not found", user_id=user_id)
+            elif isinstance(result, Exception):
+                log.error(
+                    "error during create_relationships",
+                    user_id=user_id,
+                    exc_info=result,
+                )
+                # Skip the calls that haven't started, and try this one and those again.
+                stop_calls.set()
+                not_attempted.add(user_id)
+                failed = failed or result
+            else:
+                buffer.add(result)
+    finally:
+        pool.kill()
+        lane.release(greenlets)
+        buffer.flush()
+    if limited_until is None:
+        pacer.record(timezone.now())
+
+    if disabled_by is not None:
+        # These are the error codes for which we disable the secateur account -- something's
+        # gone wrong that's going to take invervention to fix.
+        secateur_user.is_twitter_api_enabled = False
+        secateur_user.save(update_fields=["is_twitter_api_enabled"])
+        log.warning(
+            "Received error code, disabling twitter api",
+            error_code=str(disabled_by),
+        )
+        return
+    if not_attempted:
+        # The only other reasons to stop early are a rate limit and an unknown error.
+        assert limited_until is not None or failed is not None
+        log.info(
+            "stopped early, rescheduling the rest", len_remaining=len(not_attempted)
+        )
+        reschedule(
+            [user_id for user_id in pending if user_id in not_attempted],
+            (
+                _rate_limit_countdown(limited_until, timezone.now())
+                if limited_until is not None
+                else _FAILED_CHUNK_COUNTDOWN
+            ),
+        )
+    if failed is not None:
+        raise failed
+
+    log.debug(
         "Finished create_relationships()",
-        type=type,
         secateur_user_pk=secateur_user_pk,
         len_user_ids=len(user_ids),
     )
@@ -142,6 +707,7 @@ def create_relationship(
     ## SANITY CHECKS
     if screen_name is None and user_id is None:
         raise ValueError("Must provide either user_id or screen_name.")
+    until = _as_datetime(until)
 
     current_span = opentelemetry.trace.get_current_span()
 
@@ -168,24 +734,9 @@ def create_relationship(
     now = timezone.now()
     type = RelationshipType(type)
 
-    if type is RelationshipType.BLOCK:
-        action = models.LogMessage.Action.CREATE_BLOCK
-        past_tense_verb = "blocked"
-        api_function = api.CreateBlock
-        rate_limit_key = "{}:{}:rate-limit".format(
-            secateur_user.username, "create_block"
-        )
-        counter = otel.twitter_block_counter
-    elif type is RelationshipType.MUTE:
-        action = models.LogMessage.Action.CREATE_MUTE
-        past_tense_verb = "muted"
-        api_function = api.CreateMute
-        rate_limit_key = "{}:{}:rate-limit".format(
-            secateur_user.username, "create_mute"
-        )
-        counter = otel.twitter_mute_counter
-    else:
-        raise ValueError("Don't know how to handle type %r", type)
+    action, api_function, pacer, counter = _create_relationship_api(
+        secateur_user, api, type
+    )
 
     log = log.bind(
         action=action.name,
@@ -217,15 +768,10 @@ def create_relationship(
         return
 
     ## CHECK CACHED RATE LIMIT
-    rate_limited = cache.get(rate_limit_key)
-    if rate_limited:
-        time_remaining = (rate_limited - now).total_seconds()
-        log.debug("local rate limit exceeded", time_remaining=time_remaining)
-        self.retry(
-            countdown=_twitter_retry_timeout(
-                base=time_remaining + 5, retries=self.request.retries
-            )
-        )
+    limited_until = pacer.limited_until(now)
+    if limited_until:
+        log.debug("local rate limit exceeded", limited_until=str(limited_until))
+        self.retry(countdown=_rate_limit_countdown(limited_until, now))
 
     ## CALL THE TWITTER API
     try:
@@ -243,17 +789,15 @@ def create_relationship(
     except TwitterError as e:
         current_span.record_exception(e)
         if ErrorCode.from_exception(e) == ErrorCode.RATE_LIMITED_EXCEEDED:
-            log.warning("rate limit exceeded")
-            cache.set(
-                rate_limit_key, now + datetime.timedelta(seconds=15 * 60), 15 * 60
-            )
+            limited_until = pacer.rate_limited(now)
+            log.warning("rate limit exceeded", limited_until=str(limited_until))
             models.LogMessage.objects.create(
                 user=secateur_user,
                 action=action,
                 rate_limited=True,
                 time=now,
             )
-            self.retry(countdown=_twitter_retry_timeout(retries=self.request.retries))
+            self.retry(countdown=_rate_limit_countdown(limited_until, now))
         elif ErrorCode.from_exception(e) in [
             ErrorCode.INVALID_OR_EXPIRED_TOKEN,
             ErrorCode.ACCOUNT_SUSPENDED,
@@ -277,6 +821,8 @@ def create_relationship(
             )
             raise
 
+    pacer.record(now)
+
     ## UPDATE DATABASE
     account = models.Account.get_account(api_result)
     log = log.bind(account_id=account.user_id, account_screen_name=account.screen_name)
@@ -331,17 +877,13 @@ def destroy_relationship(
     if type is RelationshipType.BLOCK:
         past_tense_verb = "unblocked"
         api_function = api.DestroyBlock
-        rate_limit_key = "{}:{}:rate-limit".format(
-            secateur_user.username, "destroy_block"
-        )
+        pacer = _RateLimitPacer(secateur_user, api, "destroy_block")
         action = models.LogMessage.Action.DESTROY_BLOCK
         counter = otel.twitter_unblock_counter
     elif type is RelationshipType.MUTE:
         past_tense_verb = "unmuted"
         api_function = api.DestroyMute
-        rate_limit_key = "{}:{}:rate-limit".format(
-            secateur_user.username, "destroy_mute"
-        )
+        pacer = _RateLimitPacer(secateur_user, api, "destroy_mute")
         action = models.LogMessage.Action.DESTROY_MUTE
         counter = otel.twitter_unmute_counter
     else:
@@ -364,15 +906,10 @@ def destroy_relationship(
         )
         return
 
-    rate_limited = cache.get(rate_limit_key)
-    if rate_limited:
-        time_remaining = (rate_limited - now).total_seconds()
-        logger.debug("Locally cached rate limit exceeded ('%s')", rate_limited)
-        self.retry(
-            countdown=_twitter_retry_timeout(
-                base=time_remaining, retries=self.request.retries
-            )
-        )
+    limited_until = pacer.limited_until(now)
+    if limited_until:
+        logger.debug("Locally cached rate limit exceeded ('%s')", limited_until)
+        self.retry(countdown=_rate_limit_countdown(limited_until, now))
 
     ## CALL THE TWITTER API
     try:
@@ -388,10 +925,9 @@ def destroy_relationship(
     except TwitterError as e:
         code = ErrorCode.from_exception(e)
         if code is ErrorCode.RATE_LIMITED_EXCEEDED:
-            logger.warning("API rate limit exceeded.")
-            wait = 15 * 60
-            cache.set(rate_limit_key, now + datetime.timedelta(seconds=wait), wait)
-            self.retry(countdown=_twitter_retry_timeout(retries=self.request.retries))
+            limited_until = pacer.rate_limited(now)
+            logger.warning("API rate limit exceeded.", limited_until=str(limited_until))
+            self.retry(countdown=_rate_limit_countdown(limited_until, now))
         elif code is ErrorCode.NOT_MUTING_SPECIFIED_USER:
             logger.warning("API: not muting specified user, removing relationship.")
             existing_qs.delete()
@@ -430,6 +966,7 @@ def destroy_relationship(
             )
             raise
 
+    pacer.record(now)
     models.Relationship.objects.filter(
         subject=secateur_user.account, type=type, object=account
     ).delete()
@@ -449,78 +986,595 @@ def destroy_relationship(
     )
 
 
+@app.task(ignore_result=True)
+def destroy_relationships(
+    secateur_user_pk: int,
+    type: int,
+    user_ids: List[int],
+) -> None:
+    """Remove the block or mute on each id in `user_ids`.
+
+    This is the batched counterpart to `destroy_relationship()`, dispatched from the
+    operations queue: one task, one user lookup and one API context for a chunk of
+    accounts, with the results saved in bulk at the end.
+    """
+    secateur_user = models.User.objects.select_related("account").get(
+        pk=secateur_user_pk
+    )
+    log = logger.bind(user=secateur_user.username, type=type)
+    lane = _BlockerLane(secateur_user)
+    lane.dequeued()
+    try:
+        api = secateur_user.api
+    except models.TwitterApiDisabled:
+        log.error("Twitter API not enabled, unsetting 'until' on relationships")
+        models.Relationship.objects.filter(
+            type=type, subject=secateur_user.account_id, object__in=user_ids
+        ).update(until=None)
+        return
+    now = timezone.now()
+
+    type = RelationshipType(type)
+    if type is RelationshipType.BLOCK:
+        api_function = api.DestroyBlock
+        pacer = _RateLimitPacer(secateur_user, api, "destroy_block")
+        action = models.LogMessage.Action.DESTROY_BLOCK
+        counter = otel.twitter_unblock_counter
+    elif type is RelationshipType.MUTE:
+        api_function = api.DestroyMute
+        pacer = _RateLimitPacer(secateur_user, api, "destroy_mute")
+        action = models.LogMessage.Action.DESTROY_MUTE
+        counter = otel.twitter_unmute_counter
+    else:
+        raise ValueError("Don't know how to handle type %r", type)
+
+    existing = set(
+        models.Relationship.objects.filter(
+            subject=secateur_user.account_id, type=type, object__in=user_ids
+        ).values_list("object_id", flat=True)
+    )
+    pending = [user_id for user_id in user_ids if user_id in existing]
+    if not pending:
+        return
+
+    def reschedule(remaining: List[int], countdown: int) -> None:
+        """Put `remaining` back in the operations queue, due in `countdown` seconds."""
+        models.Operation.schedule(
+            user_id=secateur_user_pk,
+            action=action,
+            target_ids=remaining,
+            due=timezone.now() + datetime.timedelta(seconds=countdown),
+        )
+
+    limited_until = pacer.limited_until(now)
+    if limited_until:
+        log.debug("local rate limit exceeded", limited_until=str(limited_until))
+        reschedule(pending, _rate_limit_countdown(limited_until, now))
+        return
+    status = pacer.status()
+    if status is not None and status.remaining < len(pending):
+        # As in create_relationships(), only make the calls that are left in this window.
+        deferred = pending[status.remaining :]
+        pending = pending[: status.remaining]
+        log.debug("deferring past the rate limit window", len_deferred=len(deferred))
+        reschedule(deferred, _rate_limit_countdown(status.reset_time, now))
+        if not pending:
+            return
+
+    greenlets = lane.acquire(
+        min(settings.DESTROY_RELATIONSHIPS_CONCURRENCY, len(pending))
+    )
+    if not greenlets:
+        log.debug("user's greenlets are all busy, rescheduling")
+        reschedule(pending, random.randint(5, 30))
+        return
+
+    ## CALL THE TWITTER API
+    # As in create_relationships(), only the API calls run in the greenlet pool.
+    stop_calls = gevent.event.Event()
+
+    def call_api(user_id: int) -> Tuple[int, Any]:
+        """Returns the API result or the exception raised, or None if the chunk was stopped."""
+        if stop_calls.is_set():
+            return user_id, None
+        counter.add(1)
+        try:
+            return user_id, api_function(
+                user_id=user_id, include_entities=False, skip_status=True
+            )
+        except Exception as e:
+            if _chunk_error_code(e) in _STOP_CHUNK_ERROR_CODES:
+                stop_calls.set()
+            return user_id, e
+
+    twitter_users: "List[Union[twitter.User, UserDict]]" = []
+    # Accounts Twitter says aren't blocked or muted any more, whether or not we did it.
+    removed: List[int] = []
+    # Accounts that were unblocked or unmuted, and get a log message.
+    logged: List[int] = []
+    not_attempted: Set[int] = set()
+    disabled_by: Optional[ErrorCode] = None
+    # As in create_relationships(), the first error we don't know how to handle.
+    failed: Optional[Exception] = None
+    pool = gevent.pool.Pool(greenlets)
+    try:
+        for user_id, result in pool.imap_unordered(call_api, pending):
+            code = _chunk_error_code(result) if isinstance(result, Exception) else None
+            if result is None:
+                not_attempted.add(user_id)
+            elif isinstance(result, requests.exceptions.ConnectionError):
+                log.error("connection error", user_id=user_id, exc_info=result)
+            elif code == ErrorCode.RATE_LIMITED_EXCEEDED:
+                not_attempted.add(user_id)
+                if limited_until is None:
+                    limited_until = pacer.rate_limited(timezone.now())
+                    log.warning("rate limit exceeded", limited_until=str(limited_until))
+            elif code == ErrorCode.NOT_MUTING_SPECIFIED_USER:
+                log.warning("not muting specified user", user_id=user_id)
+                removed.append(user_id)
+            elif code == ErrorCode.PAGE_DOES_NOT_EXIST:
+                # This error shows up when trying to unblock an account that's been deleted.
+                log.warning("page does not exist (user deleted?)", user_id=user_id)
+                removed.append(user_id)
+                logged.append(user_id)
+            elif code in _STOP_CHUNK_ERROR_CODES:
+                disabled_by = code
+            elif isinstance(result, Exception):
+                log.error(
+                    "error during destroy_relationships",
+                    user_id=user_id,
+                    exc_info=result,
+                )
+                # Skip the calls that haven't started, and try this one and those again.
+                stop_calls.set()
+                not_attempted.add(user_id)
+                failed = failed or result
+            else:
+                twitter_users.append(result)
+                removed.append(models.twitter_user_id(result))
+                logged.append(models.twitter_user_id(result))
+    finally:
+        pool.kill()
+        lane.release(greenlets)
+        with transaction.atomic():
+            if twitter_users:
+                models.Account.write_accounts(*twitter_users, now=now)
+            models.Relationship.objects.filter(
+                subject=secateur_user.account_id, type=type, object__in=removed
+            ).delete()
+            models.LogMessage.objects.bulk_create(
+                models.LogMessage(
+                    user=secateur_user, time=now, action=action, account_id=user_id
+                )
+                for user_id in logged
+            )
+    if limited_until is None:
+        pacer.record(timezone.now())
+
+    if disabled_by is not None:
+        # These are the error codes for which we disable the secateur account -- something's
+        # gone wrong that's going to take invervention to fix.
+        secateur_user.is_twitter_api_enabled = False
+        secateur_user.save(update_fields=["is_twitter_api_enabled"])
+        log.warning(
+            "Received error code, disabling twitter api",
+            error_code=str(disabled_by),
+        )
+        return
+    if not_attempted:
+        assert limited_until is not None or failed is not None
+        log.info(
+            "stopped early, rescheduling the rest", len_remaining=len(not_attempted)
+        )
+        reschedule(
+            [user_id for user_id in pending if user_id in not_attempted],
+            (
+                _rate_limit_countdown(limited_until, timezone.now())
+                if limited_until is not None
+                else _FAILED_CHUNK_COUNTDOWN
+            ),
+        )
+    if failed is not None:
+        raise failed
+    log.info("Finished destroy_relationships()", len_removed=len(removed))
+
+
+def _operation_endpoint(action: int) -> Tuple[str, RelationshipType]:
+    """The rate limit pacer endpoint and the Relationship type of an operation."""
+    Action = models.Operation.Action
+    return {
+        Action.CREATE_BLOCK: ("create_block", RelationshipType.BLOCK),
+        Action.CREATE_MUTE: ("create_mute", RelationshipType.MUTE),
+        Action.DESTROY_BLOCK: ("destroy_block", RelationshipType.BLOCK),
+        Action.DESTROY_MUTE: ("destroy_mute", RelationshipType.MUTE),
+    }[action]
+
+
+@app.task(ignore_result=True)
+def dispatch_operations(max_groups: int = 1_000) -> None:
+    """Hand due operations from the operations queue to the blocker, in chunks.
+
+    Each user and action only gets what can run now: as many chunks as the user's
+    `_BlockerLane` has room for, and no more operations than are left in the rate
+    limit window, if we know. Everything else stays in the table for a later run, so
+    a heavy user's backlog never lands in the broker. Operations whose window is used
+    up are postponed till it resets, so they aren't looked at again before then.
+
+    Each user's chunks are claimed and sent in one transaction. If sending fails the
+    claim is rolled back, and if the commit fails a chunk may be sent twice, which
+    create_relationships() and destroy_relationships() both shrug off.
+    """
+    chunk_size = 50
+    now = timezone.now()
+    groups = models.Operation.due_groups(now, max_groups)
+    users = models.User.objects.in_bulk({user_pk for user_pk, _ in groups})
+    len_claimed = len_postponed = 0
+    for user_pk, action in groups:
+        secateur_user = users[user_pk]
+        endpoint, type = _operation_endpoint(action)
+        creating = endpoint.startswith("create")
+        lane = _BlockerLane(secateur_user)
+        limit = chunk_size * lane.room(
+            settings.CREATE_RELATIONSHIPS_CONCURRENCY
+            if creating
+            else settings.DESTROY_RELATIONSHIPS_CONCURRENCY
+        )
+        pacer = _RateLimitPacer(secateur_user, None, endpoint)
+        limited_until = pacer.limited_until(now)
+        status = pacer.status()
+        if limited_until is None and status is not None:
+            if status.remaining <= 0:
+                limited_until = status.reset_time
+            limit = min(limit, status.remaining)
+        if limited_until is not None:
+            len_postponed += models.Operation.postpone(
+                user_pk,
+                action,
+                now,
+                now
+                + datetime.timedelta(seconds=_rate_limit_countdown(limited_until, now)),
+            )
+            continue
+        if not limit:
+            continue
+
+        with transaction.atomic():
+            claimed = models.Operation.claim(user_pk, action, limit, now)
+            by_until: Dict[Optional[datetime.datetime], List[int]] = {}
+            for target_id, until in claimed:
+                by_until.setdefault(until, []).append(target_id)
+            for until, target_ids in by_until.items():
+                for target_ids_chunk in chunks(target_ids, chunk_size):
+                    priority = lane.enqueue()
+                    if creating:
+                        create_relationships.apply_async(
+                            [],
+                            dict(
+                                secateur_user_pk=user_pk,
+                                type=type,
+                                user_ids=target_ids_chunk,
+                                until=until,
+                            ),
+                            priority=priority,
+                        )
+                    else:
+                        destroy_relationships.apply_async(
+                            [],
+                            dict(
+                                secateur_user_pk=user_pk,
+                                type=type,
+                                user_ids=target_ids_chunk,
+                            ),
+                            priority=1,
+                        )
+        len_claimed += len(claimed)
+    logger.info(
+        "Dispatched operations",
+        len_claimed=len_claimed,
+        len_postponed=len_postponed,
+        len_groups=len(groups),
+    )
+
+
+# The paged Twitter API calls a PagedJob can make, by name.
+_PAGED_ENDPOINTS: (
+    "Dict[str, Callable[[TwitterClient, Optional[int], int], Tuple[int, int, list]]]"
+) = {
+    "follower_ids": lambda api, user_id, cursor: api.GetFollowerIDsPaged(
+        user_id=user_id, cursor=cursor
+    ),
+    "friend_ids": lambda api, user_id, cursor: api.GetFriendIDsPaged(
+        user_id=user_id, cursor=cursor
+    ),
+    "friends": lambda api, user_id, cursor: api.GetFriendsPaged(
+        user_id=user_id, cursor=cursor
+    ),
+    "block_ids": lambda api, user_id, cursor: api.GetBlocksIDsPaged(cursor=cursor),
+    "mute_ids": lambda api, user_id, cursor: api.GetMutesIDsPaged(cursor=cursor),
+}
+
+# Accounts handlers that write a Relationship between `account_id` and each account in
+# the page, and the Relationship type and whether the page's accounts are the subjects.
+_ACCOUNT_ADD_HANDLERS = {
+    "add_followers": ("FOLLOWS", True),
+    "add_friends": ("FOLLOWS", False),
+    "add_blocks": ("BLOCKS", False),
+    "add_mutes": ("MUTES", False),
+}
+# Finish handlers that apply the IDs staged by the "stage" accounts handler with
+# Relationship.sync_staged(), and the Relationship type and `reverse` they sync with.
+_SYNC_HANDLERS = {
+    "sync_blocks": ("BLOCKS", False),
+    "sync_mutes": ("MUTES", False),
+    "sync_friends": ("FOLLOWS", False),
+    "sync_followers": ("FOLLOWS", True),
+}
+# Finish handlers that are an Account method taking `updated`.
+_ACCOUNT_REMOVE_HANDLERS = (
+    "remove_followers_older_than",
+    "remove_friends_older_than",
+    "remove_blocks_older_than",
+    "remove_mutes_older_than",
+)
+
+
+@dataclass(frozen=True)
+class PagedJob:
+    """A paged Twitter API call, and what to do with each page of accounts it returns.
+
+    This goes through the Celery broker with every page, so it only holds names, ids and
+    ISO 8601 timestamps. Each handler is a dict with the handler's "name" and its keyword
+    arguments, and is looked up by name when a page arrives:
+
+    - accounts handlers: "add_followers", "add_friends", "add_blocks" and "add_mutes" (with
+      `account_id` and `updated`), "block_multiple" (with `type`, `secateur_user_pk` and
+      `duration` in seconds) and "stage".
+    - finish handlers: the matching "remove_*_older_than" (with `account_id` and `updated`),
+      or after "stage", the matching "sync_*" (with `account_id` and `updated`).
+    """
+
+    secateur_user_pk: int
+    endpoint: str
+    user_id: Optional[int] = None
+    accounts_handlers: List[Dict[str, Any]] = field(default_factory=list)
+    finish_handlers: List[Dict[str, Any]] = field(default_factory=list)
+
+    def __post_init__(self) -> None:
+        if self.endpoint not in _PAGED_ENDPOINTS:
+            raise ValueError(f"Unknown paged endpoint {self.endpoint!r}")
+        for handler in self.accounts_handlers:
+            if handler["name"] not in _ACCOUNT_ADD_HANDLERS and handler["name"] not in (
+                "block_multiple",
+                "stage",
+            ):
+                raise ValueError(f"Unknown accounts handler {handler['name']!r}")
+        for handler in self.finish_handlers:
+            if (
+                handler["name"] not in _ACCOUNT_REMOVE_HANDLERS
+                and handler["name"] not in _SYNC_HANDLERS
+            ):
+                raise ValueError(f"Unknown finish handler {handler['name']!r}")
+
+    def call(self, cursor: int) -> Tuple[int, int, list]:
+        api = models.User.objects.get(pk=self.secateur_user_pk).api
+        return _PAGED_ENDPOINTS[self.endpoint](api, self.user_id, cursor)
+
+    def handle_accounts(self, run: "models.PagedJobRun", user_ids: List[int]) -> None:
+        for handler in self.accounts_handlers:
+            kwargs = dict(handler)
+            name = kwargs.pop("name")
+            if name == "stage":
+                models.Relationship.stage(run.pk, user_ids)
+            elif name == "block_multiple":
+                _block_multiple(
+                    user_ids,
+                    type=kwargs["type"],
+                    secateur_user_pk=kwargs["secateur_user_pk"],
+                    duration=(
+                        datetime.timedelta(seconds=kwargs["duration"])
+                        if kwargs["duration"]
+                        else None
+                    ),
+                )
+            else:
+                type, reverse = _ACCOUNT_ADD_HANDLERS[name]
+                account_ids = [kwargs["account_id"]]
+                models.Relationship.write_relationships(
+                    type=getattr(models.Relationship, type),
+                    subject_ids=user_ids if reverse else account_ids,
+                    object_ids=account_ids if reverse else user_ids,
+                    updated=_as_datetime(kwargs["updated"]),
+                )
+
+    def finish(self, run: "models.PagedJobRun") -> None:
+        for handler in self.finish_handlers:
+            account = models.Account(user_id=handler["account_id"])
+            updated = _as_datetime(handler["updated"])
+            if handler["name"] in _SYNC_HANDLERS:
+                type, reverse = _SYNC_HANDLERS[handler["name"]]
+                models.Relationship.sync_staged(
+                    run.pk,
+                    expected=run.accounts,
+                    type=getattr(models.Relationship, type),
+                    account=account,
+                    updated=updated,
+                    reverse=reverse,
+                )
+            else:
+                getattr(account, handler["name"])(updated)
+
+
+# How many more pages a paused PagedJobRun gets each time it's resumed.
+_PAGED_JOB_PAGES_PER_RESUME = 300
+# How long a running PagedJobRun can go without a checkpoint, on top of its
+# delay_between_pages, before resume_paged_jobs() assumes its message was lost.
+_PAGED_JOB_STALLED_AFTER = datetime.timedelta(hours=1)
+# How many times a run can stall before resume_paged_jobs() gives up on it.
+_PAGED_JOB_MAX_STALLS = 5
+
+
+def start_paged_job(
+    secateur_user: "models.User", job: PagedJob, delay_between_pages: int = 0
+) -> "models.PagedJobRun":
+    """Record a run of `job` and queue its first page once the run is committed."""
+    run = models.PagedJobRun.objects.create(
+        user=secateur_user,
+        job=asdict(job),
+        delay_between_pages=delay_between_pages,
+    )
+    transaction.on_commit(lambda: twitter_paged_call_iterator.delay(run.pk, run.cursor))
+    return run
+
+
+def resume_paged_job(run: "models.PagedJobRun") -> None:
+    """Queue the next page of a paused or stalled run from its checkpointed cursor."""
+    if run.status == models.PagedJobRun.Status.PAUSED:
+        run.max_pages = run.pages + _PAGED_JOB_PAGES_PER_RESUME
+    else:
+        run.stalls += 1
+    run.status = models.PagedJobRun.Status.RUNNING
+    run.updated = timezone.now()
+    run.save(update_fields=["status", "max_pages", "stalls", "updated"])
+    logger.info("Resuming paged job", run_pk=run.pk, cursor=run.cursor)
+    twitter_paged_call_iterator.delay(run.pk, run.cursor)
+
+
+def _fail_paged_job_run(run_pk: int, error: Union[Exception, str]) -> None:
+    models.PagedJobRun.objects.filter(pk=run_pk).update(
+        status=models.PagedJobRun.Status.FAILED,
+        error=str(error),
+        updated=timezone.now(),
+    )
+    models.Relationship.clear_staged(run_pk)
+
+
 @app.task(bind=True, ignore_result=True)
 def twitter_paged_call_iterator(
-    self: celery.Task,
-    api_function: Callable,
-    # It's a list of callables, where each callable takes a single argument which is
-    # an iterable of Account objects, and it returns None
-    accounts_handlers: "List[Callable[[Iterable[models.Account]], None]]",
-    # It's a list of callables that take no arguments and return no result
-    finish_handlers: "List[Callable[[], None]]",
-    cursor: int = -1,
-    max_pages: int = 300,
-    current_page: int = 1,
-    delay_between_pages: int = 0,
+    self: celery.Task, run_pk: int, cursor: int = -1
 ) -> None:
-    logger.info("paged_call_iterator()", api_function=repr(api_function), cursor=cursor)
+    """Fetch the page of a `PagedJobRun` at `cursor`, checkpoint it and queue the next page.
+
+    The cursor is an argument so that a duplicate or superseded message is a no-op.
+    """
+    run = models.PagedJobRun.objects.get(pk=run_pk)
+    log = logger.bind(run_pk=run_pk, cursor=cursor)
+    if run.status != models.PagedJobRun.Status.RUNNING or run.cursor != cursor:
+        log.info("Skipping stale page", status=run.status, run_cursor=run.cursor)
+        return
+    paged_job = PagedJob(**run.job)
+    log.info(
+        "paged_call_iterator()", endpoint=paged_job.endpoint, user_id=paged_job.user_id
+    )
     try:
-        next_cursor, previous_cursor, data = api_function(cursor=cursor)
+        next_cursor, previous_cursor, data = paged_job.call(cursor=cursor)
         if data:
-            logger.info("Got a page of data", len_data=len(data))
+            log.info("Got a page of data", len_data=len(data))
     except TwitterError as e:
         if ErrorCode.from_exception(e) == ErrorCode.RATE_LIMITED_EXCEEDED:
-            logger.warning("Rate limit exceeded, scheduling a retry.")
+            log.warning("Rate limit exceeded, scheduling a retry.")
             self.retry(
                 countdown=_twitter_retry_timeout(base=900, retries=self.request.retries)
             )
         else:
+            _fail_paged_job_run(run_pk, e)
             raise
+    except models.TwitterApiDisabled as e:
+        log.error("Twitter API not enabled, failing paged job")
+        _fail_paged_job_run(run_pk, e)
+        return
+    except requests.exceptions.ConnectionError as e:
+        # Once the retries run out, resume_paged_jobs() picks the run up again.
+        log.warning("Connection error, scheduling a retry.")
+        self.retry(exc=e, countdown=60 * 2**self.request.retries)
+    except Exception as e:
+        _fail_paged_job_run(run_pk, e)
+        raise
 
-    accounts = models.Account.get_accounts(*data)
-    for accounts_handler in accounts_handlers:
-        accounts_handler(accounts)
-    if next_cursor and max_pages:
+    try:
+        with transaction.atomic():
+            run = models.PagedJobRun.objects.select_for_update().get(pk=run_pk)
+            if run.status != models.PagedJobRun.Status.RUNNING or run.cursor != cursor:
+                log.info("Page was checkpointed by another worker")
+                return
+            models.Account.write_accounts(*data)
+            paged_job.handle_accounts(
+                run, [models.twitter_user_id(item) for item in data]
+            )
+            run.cursor = next_cursor
+            run.pages += 1
+            run.accounts += len(data)
+            run.updated = timezone.now()
+            if not next_cursor:
+                # We only run the finish handlers if we actually made it to the end of the list.
+                paged_job.finish(run)
+                run.status = models.PagedJobRun.Status.DONE
+            elif run.pages >= run.max_pages:
+                log.info("Pausing paged job", pages=run.pages)
+                run.status = models.PagedJobRun.Status.PAUSED
+            run.save(update_fields=["cursor", "pages", "accounts", "updated", "status"])
+    except Exception as e:
+        # Whatever went wrong with the page, like lost staged IDs or a bug in a handler,
+        # would go wrong again if the run was resumed.
+        _fail_paged_job_run(run_pk, e)
+        raise
+
+    if run.status == models.PagedJobRun.Status.RUNNING:
         twitter_paged_call_iterator.apply_async(
-            [
-                api_function,
-                accounts_handlers,
-                finish_handlers,
-            ],
-            dict(
-                cursor=next_cursor,
-                max_pages=max_pages - 1,
-                current_page=current_page + 1,
-                delay_between_pages=delay_between_pages,
-            ),
-            countdown=delay_between_pages if delay_between_pages else None,
+            [run_pk, next_cursor],
+            countdown=run.delay_between_pages if run.delay_between_pages else None,
         )
-    if not next_cursor:
-        # We only run the finish_handler if we actually made it to the end of the list.
-        # The consequence of this is that if a list is longer than our max_pages, then
-        # we'll end up never removing people from it.
-        for finish_handler in finish_handlers:
-            finish_handler()
+
+
+@app.task(ignore_result=True)
+def resume_paged_jobs() -> None:
+    """Resume paused runs, and running ones that have gone quiet because a message was lost.
+
+    A run that has stalled `_PAGED_JOB_MAX_STALLS` times is failed instead.
+    """
+    now = timezone.now()
+    for run in models.PagedJobRun.objects.filter(
+        status__in=[
+            models.PagedJobRun.Status.RUNNING,
+            models.PagedJobRun.Status.PAUSED,
+        ],
+        updated__lt=now - _PAGED_JOB_STALLED_AFTER,
+    ):
+        stalled_after = _PAGED_JOB_STALLED_AFTER + datetime.timedelta(
+            seconds=run.delay_between_pages
+        )
+        if run.status == models.PagedJobRun.Status.PAUSED:
+            resume_paged_job(run)
+        elif run.updated < now - stalled_after:
+            if run.stalls >= _PAGED_JOB_MAX_STALLS:
+                logger.warning("Giving up on stalled paged job", run_pk=run.pk)
+                _fail_paged_job_run(run.pk, f"Stalled {run.stalls + 1} times")
+            else:
+                resume_paged_job(run)
 
 
 def twitter_update_followers(
     secateur_user: "models.User", account: "Optional[models.Account]" = None
 ) -> None:
-    """Trigger django-q tasks to update the followers list of a twitter account.
+    """Trigger tasks to update the followers list of a twitter account.
 
     If the account is unspecified, it'll update the followers list of the user.
     """
-    now = timezone.now()
-    api = secateur_user.api
+    now = timezone.now().isoformat()
 
     if account is None:
         account = secateur_user.account
 
     assert account is not None
-    api_function = partial(api.GetFollowerIDsPaged, user_id=account.user_id)
-    accounts_handlers = [partial(account.add_followers, updated=now)]
-    finish_handlers = [partial(account.remove_followers_older_than, now)]
-    twitter_paged_call_iterator.delay(api_function, accounts_handlers, finish_handlers)
+    job = PagedJob(
+        secateur_user_pk=secateur_user.pk,
+        endpoint="follower_ids",
+        user_id=account.user_id,
+        accounts_handlers=[dict(name="stage")],
+        finish_handlers=[
+            dict(name="sync_followers", account_id=account.user_id, updated=now)
+        ],
+    )
+    start_paged_job(secateur_user, job)
 
 
 def twitter_update_friends(
@@ -528,57 +1582,67 @@ def twitter_update_friends(
     account: "Optional[models.Account]" = None,
     get_profiles: bool = False,
 ) -> None:
-    """Trigger django-q tasks to update the friends list of a twitter account.
+    """Trigger tasks to update the friends list of a twitter account.
 
     If the account is unspecified, it'll update the friends list of the user.
     """
-    now = timezone.now()
-    api = secateur_user.api
+    now = timezone.now().isoformat()
     if account is None:
         account = secateur_user.account
     assert account is not None
 
-    if get_profiles:
-        api_function = partial(api.GetFriendsPaged, user_id=account.user_id)
-    else:
-        api_function = partial(api.GetFriendIDsPaged, user_id=account.user_id)
-    accounts_handlers = [partial(account.add_friends, updated=now)]
-    finish_handlers = [partial(account.remove_friends_older_than, now)]
-    twitter_paged_call_iterator.delay(api_function, accounts_handlers, finish_handlers)
+    job = PagedJob(
+        secateur_user_pk=secateur_user.pk,
+        endpoint="friends" if get_profiles else "friend_ids",
+        user_id=account.user_id,
+        accounts_handlers=[dict(name="stage")],
+        finish_handlers=[
+            dict(name="sync_friends", account_id=account.user_id, updated=now)
+        ],
+    )
+    start_paged_job(secateur_user, job)
 
 
 def twitter_update_blocks(secateur_user: "models.User") -> None:
-    """Trigger django-q tasks to update the block list of a secateur user."""
-    now = timezone.now()
-    api = secateur_user.api
+    """Trigger tasks to update the block list of a secateur user."""
+    now = timezone.now().isoformat()
     account = secateur_user.account
     assert account is not None
 
-    api_function = partial(api.GetBlocksIDsPaged)
-    accounts_handlers = [partial(account.add_blocks, updated=now)]
-    finish_handlers = [partial(account.remove_blocks_older_than, now)]
-    twitter_paged_call_iterator.delay(api_function, accounts_handlers, finish_handlers)
+    job = PagedJob(
+        secateur_user_pk=secateur_user.pk,
+        endpoint="block_ids",
+        accounts_handlers=[dict(name="stage")],
+        finish_handlers=[
+            dict(name="sync_blocks", account_id=account.user_id, updated=now)
+        ],
+    )
+    start_paged_job(secateur_user, job)
 
 
 def twitter_update_mutes(secateur_user: "models.User") -> None:
-    """Trigger django-q tasks to update the mute list of a secateur user."""
-    now = timezone.now()
-    api = secateur_user.api
+    """Trigger tasks to update the mute list of a secateur user."""
+    now = timezone.now().isoformat()
     account = secateur_user.account
     assert account is not None
 
-    api_function = partial(api.GetMutesIDsPaged)
-    accounts_handlers = [partial(account.add_mutes, updated=now)]
-    finish_handlers = [partial(account.remove_mutes_older_than, now)]
-    twitter_paged_call_iterator.delay(api_function, accounts_handlers, finish_handlers)
+    job = PagedJob(
+        secateur_user_pk=secateur_user.pk,
+        endpoint="mute_ids",
+        accounts_handlers=[dict(name="stage")],
+        finish_handlers=[
+            dict(name="sync_mutes", account_id=account.user_id, updated=now)
+        ],
+    )
+    start_paged_job(secateur_user, job)
 
 
-# Used as a partial() in twitter_block_followers()
+# The "block_multiple" accounts handler of the PagedJob in twitter_block_followers()
 def _block_multiple(
-    accounts: "Iterable[models.Account]",
+    user_ids: List[int],
     type: int,
     secateur_user_pk: int,
-    duration: datetime.timedelta,
+    duration: Optional[datetime.timedelta],
 ) -> None:
     secateur_user = models.User.objects.get(pk=secateur_user_pk)
     log = logger.bind(
@@ -586,38 +1650,58 @@ def _block_multiple(
     )
     already_blocked_ids = set(
         models.Relationship.objects.filter(
-            subject=secateur_user.account, type=type, object__in=accounts
+            subject=secateur_user.account_id, type=type, object__in=user_ids
         ).values_list("object_id", flat=True)
     )
     log.debug(
         "_block_multiple(): filtering out already blocked accounts.",
-        len_accounts=len(accounts),
+        len_accounts=len(user_ids),
         len_already_blocked_ids=len(already_blocked_ids),
     )
-    accounts_to_block = [
-        account for account in accounts if account.user_id not in already_blocked_ids
+    ids_to_block = [
+        user_id for user_id in user_ids if user_id not in already_blocked_ids
     ]
+    # Don't send out more work than the user's rate limit window has room for: anything
+    # past that waits for the window to reset instead of being turned down by Twitter.
+    now = timezone.now()
+    # Checking the rate limit doesn't need the API client, so a disabled user's accounts
+    # still get queued, to be dealt with when they're dispatched.
+    pacer = _RateLimitPacer(
+        secateur_user,
+        None,
+        "create_block" if type == models.Relationship.BLOCKS else "create_mute",
+    )
+    limited_until = pacer.limited_until(now)
+    status = pacer.status()
+    budget = status.remaining if status is not None else 0
+    action = (
+        models.Operation.Action.CREATE_BLOCK
+        if type == models.Relationship.BLOCKS
+        else models.Operation.Action.CREATE_MUTE
+    )
     chunk_size = 50
-    for accounts_chunk in chunks(accounts_to_block, chunk_size):
+    for ids_chunk in chunks(ids_to_block, chunk_size):
         until: Optional[datetime.datetime] = None
         if duration:
             fudged_duration = fudge_duration(duration, 0.05)
             until = timezone.now() + fudged_duration
-        create_relationships.apply_async(
-            [],
-            {
-                "secateur_user_pk": secateur_user_pk,
-                "type": type,
-                "user_ids": [a.user_id for a in accounts_chunk],
-                "until": until,
-            },
-            # I can't decide if there should be a timeout here. Probably what ought
-            # to happen instead is that blocks are handled by a different celery
-            # queue, so they can start right away and not block paged_iterator tasks.
-            # countdown=1 + int(i * (60 * 15 / 5000)),
-            max_retries=5,
-            priority=random.randint(1, 9),
+        countdown = 0
+        if limited_until:
+            countdown = _rate_limit_countdown(limited_until, now)
+        elif status is not None:
+            if budget <= 0:
+                countdown = _rate_limit_countdown(status.reset_time, now)
+            budget -= len(ids_chunk)
+        models.Operation.schedule(
+            user_id=secateur_user_pk,
+            action=action,
+            target_ids=ids_chunk,
+            due=now + datetime.timedelta(seconds=countdown),
+            until=until,
         )
+    if ids_to_block:
+        # Don't wait for the next scheduled dispatch to start on what's due now.
+        transaction.on_commit(lambda: dispatch_operations.delay())
 
 
 def twitter_block_followers(
@@ -626,24 +1710,24 @@ def twitter_block_followers(
     account: "models.Account",
     duration: Optional[datetime.timedelta],
 ) -> None:
-    api = secateur_user.api
     now = timezone.now()
 
-    api_function = partial(api.GetFollowerIDsPaged, user_id=account.user_id)
-    accounts_handlers = [
-        # I'm removing the task of updating the relationship table to track the followers.
-        # This should save IO and I'm not using this data for anything.
-        # partial(account.add_followers, updated=now),
-        partial(
-            _block_multiple,
-            type=type,
-            secateur_user_pk=secateur_user.pk,
-            duration=duration,
-        ),
-    ]
-    finish_handlers: "List[Callable[[], None]]" = [
-        # partial(account.remove_followers_older_than, now)
-    ]
+    job = PagedJob(
+        secateur_user_pk=secateur_user.pk,
+        endpoint="follower_ids",
+        user_id=account.user_id,
+        accounts_handlers=[
+            # I'm removing the task of updating the relationship table to track the followers.
+            # This should save IO and I'm not using this data for anything.
+            # dict(name="add_followers", account_id=account.user_id, updated=now.isoformat()),
+            dict(
+                name="block_multiple",
+                type=type,
+                secateur_user_pk=secateur_user.pk,
+                duration=duration.total_seconds() if duration else None,
+            ),
+        ],
+    )
     models.LogMessage.objects.create(
         user=secateur_user,
         time=now,
@@ -655,12 +1739,7 @@ def twitter_block_followers(
         account=account,
         until=now + duration if duration else None,
     )
-    twitter_paged_call_iterator.delay(
-        api_function,
-        accounts_handlers,
-        finish_handlers,
-        delay_between_pages=900,
-    )
+    start_paged_job(secateur_user, job, delay_between_pages=900)
 
 
 @app.task()
@@ -669,40 +1748,62 @@ def unblock_expired(now: Optional[datetime.datetime] = None) -> None:
     if now is None:
         now = timezone.now()
 
-    expired_blocks = (
+    # Only fetch the columns we need.
+    expired = list(
         models.Relationship.objects.filter(
-            Q(type=models.Relationship.BLOCKS) | Q(type=models.Relationship.MUTES),
+            type__in=[models.Relationship.BLOCKS, models.Relationship.MUTES],
             until__lt=now,
-            # I think this was making the query a lot more expensive, and I want
-            # to bump all their timestamps anyway.
-            # subject__user__is_twitter_api_enabled=True,
-        )
-        .select_related("subject", "object")
-        .prefetch_related("subject__user_set")
+        ).values_list("pk", "type", "subject_id", "object_id")[:max_per_call]
     )
-    as_list = list(expired_blocks[:max_per_call])
+    # An account can be linked to more than one secateur user, and joining through to
+    # them would repeat its relationships for each. So pick one per account: the first
+    # with the API enabled.
+    secateur_users: Dict[int, int] = {}
+    for account_id, secateur_user_pk in (
+        models.User.objects.filter(
+            account_id__in={subject_id for _, _, subject_id, _ in expired},
+            is_twitter_api_enabled=True,
+        )
+        .order_by("pk")
+        .values_list("account_id", "pk")
+    ):
+        secateur_users.setdefault(account_id, secateur_user_pk)
+
+    pks: List[int] = []
+    due: Dict[Tuple[int, int], List[int]] = {}
+    skipped = 0
+    for pk, type, subject_id, object_id in expired:
+        pks.append(pk)
+        if subject_id not in secateur_users:
+            # Their 'until' just gets bumped along with everything else.
+            skipped += 1
+            continue
+        due.setdefault((secateur_users[subject_id], type), []).append(object_id)
 
     # Bump the 'until' on all of them now.
     time_to_bump = datetime.timedelta(days=7 * 6)
-    models.Relationship.objects.filter(pk__in=[i.pk for i in as_list]).update(
+    models.Relationship.objects.filter(pk__in=pks).update(
         until=F("until") + time_to_bump
     )
     count: int = 0
-    for expired_block in as_list:
-        secateur_user = expired_block.subject.user_set.get()
-        blocked_account_id = expired_block.object_id
-        destroy_relationship.apply_async(
-            [],
-            {
-                "secateur_user_pk": secateur_user.pk,
-                "type": expired_block.type,
-                "user_id": blocked_account_id,
-            },
-            # countdown=random.randint(1, 60 * 60),
-            priority=1,
+    for (secateur_user_pk, type), user_ids in due.items():
+        count += models.Operation.schedule(
+            user_id=secateur_user_pk,
+            action=(
+                models.Operation.Action.DESTROY_BLOCK
+                if type == models.Relationship.BLOCKS
+                else models.Operation.Action.DESTROY_MUTE
+            ),
+            target_ids=user_ids,
+            due=now,
         )
-        count += 1
-    logger.info("Triggered unblock/unmute tasks on %s relationships.", count)
+    if count:
+        transaction.on_commit(lambda: dispatch_operations.delay())
+    logger.info(
+        "Scheduled unblock/unmute operations",
+        len_relationships=count,
+        len_skipped=skipped,
+    )
 
 
 @app.task()
@@ -721,24 +1822,20 @@ def bounce_until_for_disabled_accounts():
 
 @app.task()
 def delete_old_block_log_messages() -> None:
+    """Drop the LogMessage partitions that have expired, and create the upcoming ones.
+
+    Block and mute messages go in a partition for the day they expire, so this is a
+    DROP TABLE on a day's worth of messages rather than a DELETE scanning the log.
+    """
+    from .partitioning import manager
+
     logger.info("starting delete_old_block_log_messages")
-    days_old = 7 * 2
-    cutoff = timezone.now() - datetime.timedelta(days=days_old)
-    queryset = models.LogMessage.objects.filter().filter(
-        action__in=[
-            models.LogMessage.Action.CREATE_BLOCK,
-            models.LogMessage.Action.DESTROY_BLOCK,
-            models.LogMessage.Action.CREATE_MUTE,
-            models.LogMessage.Action.DESTROY_MUTE,
-        ],
-        time__lt=cutoff,
-    )
-    total_deleted, deleted_per_model = queryset.delete()
+    plan = manager.plan()
+    plan.apply()
     logger.info(
         "delete_old_block_log_messages",
-        cutoff=cutoff,
-        days_old=days_old,
-        total_deleted=total_deleted,
+        created=[partition.name() for partition in plan.creations],
+        deleted=[partition.name() for partition in plan.deletions],
     )
 
 
@@ -1,6 +1,11 @@
+import threading
+from datetime import timedelta
+from unittest import mock
+
 import pytest
 import twitter.models
-from django.test import TestCase
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
 from django.utils import timezone
 
 import secateur.models
@@ -38,6 +43,30 @@ class TestAccounts(TestCase):
         user_3 = models.Account.get_account(twitter_user_3, now=new_now)
         assert user_3.screen_name == "3"
 
+    def test_get_accounts_only_writes_changes(self):
+        now = timezone.now()
+        models.Account.get_account(
+            twitter.models.User(id=1, screen_name="one"), now=now
+        )
+
+        # Seeing the same profile again, or just its ID, leaves it alone.
+        later = timezone.now()
+        account = models.Account.get_account(
+            twitter.models.User(id=1, screen_name="one"), now=later
+        )
+        assert account.profile_updated == now
+        assert account.profile_fetched == later
+        account = models.Account.get_account(1, now=timezone.now())
+        assert account.screen_name == "one"
+        assert account.profile_updated == now
+        assert account.profile_fetched == later
+
+        account = models.Account.get_account(
+            twitter.models.User(id=1, screen_name="uno"), now=later
+        )
+        assert account.screen_name == "uno"
+        assert account.profile_updated == later
+
     def test_relationship_helpers(self):
         now = timezone.now()
         a0, a1, a2, a3 = models.Account.get_accounts(*range(4)).order_by("user_id")
@@ -57,6 +86,21 @@ class TestAccounts(TestCase):
         a2.add_mutes([a3], now)
         assert list(a2.mutes) == [a3]
 
+    def test_accounts_from_user_dicts(self):
+        account = models.Account.get_account(
+            {
+                "id": 12,
+                "screen_name": "dict",
+                "name": "From A Dict",
+                "followers_count": 3,
+                "created_at": "Wed Aug 27 13:08:45 +0000 2008",
+            }
+        )
+        assert account.screen_name == "dict"
+        assert account.followers_count == 3
+        assert account.created_at.year == 2008
+        assert account.profile_banner_url is None
+
 
 class TestAddRelationships(TestCase):
     def test_some_combinations(self):
@@ -80,6 +124,234 @@ class TestAddRelationships(TestCase):
         )
         assert len(result) == 2
 
+    def test_a_subjects_relationships_share_a_partition(self):
+        now = timezone.now()
+        subject, *objects = models.Account.get_accounts(*range(1, 11))
+        models.Relationship.add_relationships(
+            type=models.Relationship.BLOCKS,
+            subjects=[subject],
+            objects=objects,
+            updated=now,
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT DISTINCT tableoid::regclass::text FROM secateur_relationship"
+            )
+            ((partition,),) = cursor.fetchall()
+        assert partition.startswith("secateur_relationship_p")
+
+
+class TestWriteRelationships(TestCase):
+    def test_return_modes(self):
+        now = timezone.now()
+        assert models.Account.write_accounts(1, 2, 3, now=now) is None
+        assert models.Account.write_accounts(2, 3, 4, return_ids=True) == [4]
+
+        ids = models.Relationship.write_relationships(
+            type=models.Relationship.BLOCKS,
+            subject_ids=[1],
+            object_ids=[2, 3, 3],
+            updated=now,
+            return_ids=True,
+        )
+        assert len(ids) == 2
+        assert (
+            models.Relationship.write_relationships(
+                type=models.Relationship.BLOCKS,
+                subject_ids=[1],
+                object_ids=[3, 4],
+                updated=now,
+            )
+            is None
+        )
+        assert sorted(
+            models.Relationship.objects.filter(subject=1).values_list(
+                "object_id", flat=True
+            )
+        ) == [2, 3, 4]
+
+
+class TestRemoveRelationships(TestCase):
+    def test_removes_in_batches(self):
+        now = timezone.now()
+        models.Account.write_accounts(*range(1, 10))
+        models.Relationship.write_relationships(
+            type=models.Relationship.BLOCKS,
+            subject_ids=[1],
+            object_ids=range(2, 10),
+            updated=now,
+        )
+        models.Relationship.write_relationships(
+            type=models.Relationship.MUTES,
+            subject_ids=[1],
+            object_ids=[2],
+            updated=now,
+        )
+        with mock.patch.object(models.Relationship, "REMOVE_BATCH_SIZE", 3):
+            removed = models.Account(user_id=1).remove_blocks_older_than(
+                now + timedelta(seconds=1)
+            )
+        assert removed == 8
+        assert list(models.Relationship.objects.values_list("type", flat=True)) == [
+            models.Relationship.MUTES
+        ]
+
+
+class TestRelationshipCount(TestCase):
+    def counts(self, account_id):
+        return {
+            type: (count.count, count.expiring)
+            for type, count in models.RelationshipCount.for_account(account_id).items()
+        }
+
+    def test_triggers_keep_counts(self):
+        now = timezone.now()
+        blocks, mutes = models.Relationship.BLOCKS, models.Relationship.MUTES
+        models.Account.write_accounts(*range(1, 10))
+        assert self.counts(1) == {blocks: (0, 0), mutes: (0, 0)}
+
+        models.Relationship.write_relationships(
+            type=blocks, subject_ids=[1], object_ids=range(2, 8), updated=now
+        )
+        models.Relationship.write_relationships(
+            type=mutes, subject_ids=[1], object_ids=[2], updated=now, until=now
+        )
+        # Follows aren't counted.
+        models.Relationship.write_relationships(
+            type=models.Relationship.FOLLOWS,
+            subject_ids=[1],
+            object_ids=[2],
+            updated=now,
+        )
+        assert self.counts(1) == {blocks: (6, 0), mutes: (1, 1)}
+
+        # An upsert that sets 'until' on some existing blocks and adds another.
+        models.Relationship.write_relationships(
+            type=blocks, subject_ids=[1], object_ids=[6, 7, 8], updated=now, until=now
+        )
+        assert self.counts(1) == {blocks: (7, 3), mutes: (1, 1)}
+
+        models.Relationship.objects.filter(subject=1, type=blocks).update(until=now)
+        assert self.counts(1) == {blocks: (7, 7), mutes: (1, 1)}
+
+        models.Relationship.remove_relationships(subject=1, object__in=[2, 3])
+        assert self.counts(1) == {blocks: (5, 5), mutes: (0, 0)}
+        assert self.counts(2) == {blocks: (0, 0), mutes: (0, 0)}
+
+
+class TestWithdrawTokens(TestCase):
+    def setUp(self) -> None:
+        self.now = 100.0
+        patcher = mock.patch.object(
+            models, "token_bucket_time", side_effect=lambda: self.now
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = models.User.objects.create(
+            username="spender",
+            token_bucket_rate=10,
+            token_bucket_max=100,
+            token_bucket_time=self.now,
+            token_bucket_value=50,
+        )
+
+    def test_withdraw_tokens(self) -> None:
+        self.user.withdraw_tokens(30)
+        assert self.user.token_bucket_value == 20
+        with self.assertRaises(ValueError):
+            self.user.withdraw_tokens(30)
+        self.now += 1
+        self.user.withdraw_tokens(30)
+        self.user.refresh_from_db()
+        assert (self.user.token_bucket_time, self.user.token_bucket_value) == (101, 0)
+
+    def test_refill_matches_token_bucket(self) -> None:
+        self.now += 0.5
+        expected = self.user.token_bucket.withdraw(time=self.now, value=40)
+        self.user.withdraw_tokens(40)
+        self.user.refresh_from_db()
+        assert self.user.token_bucket == expected
+
+    def test_withdraw_tokens_bulk(self) -> None:
+        other = models.User.objects.create(
+            username="other", token_bucket_time=self.now, token_bucket_value=5
+        )
+        assert models.User.withdraw_tokens_bulk({self.user.pk: 60, other.pk: 3}) == {
+            other.pk: 3
+        }
+        assert models.User.withdraw_tokens_bulk(
+            {self.user.pk: 60, other.pk: 3}, partial=True
+        ) == {self.user.pk: 50, other.pk: 2}
+        assert models.User.withdraw_tokens_bulk({other.pk: 1}, partial=True) == {}
+
+
+class TestWithdrawTokensConcurrently(TransactionTestCase):
+    def test_concurrent_withdrawals_cannot_overspend(self) -> None:
+        user = models.User.objects.create(
+            username="racer",
+            token_bucket_rate=0,
+            token_bucket_max=100,
+            token_bucket_value=100,
+        )
+        with connection.cursor() as cursor:
+            cursor.execute("BEGIN")
+            # Hold the row while the other connection starts its withdrawal.
+            cursor.execute(
+                "SELECT 1 FROM secateur_user WHERE id = %s FOR UPDATE", [user.pk]
+            )
+            result = {}
+
+            def withdraw() -> None:
+                result.update(models.User.withdraw_tokens_bulk({user.pk: 70}))
+                connection.close()
+
+            thread = threading.Thread(target=withdraw)
+            thread.start()
+            thread.join(0.5)
+            cursor.execute(
+                "UPDATE secateur_user SET token_bucket_value = 50 WHERE id = %s",
+                [user.pk],
+            )
+            cursor.execute("COMMIT")
+        thread.join()
+        assert result == {}
+        user.refresh_from_db()
+        assert user.token_bucket_value == 50
+
+
+class TestSyncStaged(TestCase):
+    def test_applies_only_the_difference(self):
+        before = timezone.now()
+        account, *others = models.Account.get_accounts(*range(1, 5)).order_by("user_id")
+        account.add_blocks(others[:2], updated=before)
+
+        models.Relationship.stage(run_id=7, user_ids=[3, 4, 4])
+        added, removed = models.Relationship.sync_staged(
+            run_id=7,
+            expected=3,
+            type=models.Relationship.BLOCKS,
+            account=account,
+            updated=timezone.now(),
+        )
+        assert (added, removed) == (1, 1)
+        blocks = dict(account.relationship_subject_set.values_list("object", "updated"))
+        # The block that was already there wasn't rewritten.
+        assert blocks.keys() == {3, 4}
+        assert blocks[3] == before
+
+    def test_refuses_to_sync_lost_ids(self):
+        account = models.Account.get_account(1)
+        models.Relationship.stage(run_id=7, user_ids=[2])
+        with pytest.raises(models.StagedRelationshipsLost):
+            models.Relationship.sync_staged(
+                run_id=7,
+                expected=2,
+                type=models.Relationship.MUTES,
+                account=account,
+                updated=timezone.now(),
+                reverse=True,
+            )
+
 
 def test_api_pool_size():
     api = secateur.models.get_cached_twitter_api(
@@ -88,5 +360,48 @@ def test_api_pool_size():
         access_token_key="c",
         access_token_secret="d",
     )
-    assert api._session.adapters["https://"]._pool_maxsize == 40
-    # pytest.fail()
+    assert api.session.adapters["https://"]._pool_maxsize == 80
+    assert api.session.adapters["https://"]._pool_block
+    other = secateur.models.get_cached_twitter_api(
+        consumer_key="a",
+        consumer_secret="b",
+        access_token_key="e",
+        access_token_secret="f",
+    )
+    assert other is not api
+    assert other.session is api.session
+
+
+class TestLogMessageExpires(TestCase):
+    def test_block_messages_expire_and_others_are_kept(self):
+        now = timezone.now()
+        user = models.User.objects.create(username="alice")
+        block, follow = models.LogMessage.objects.bulk_create(
+            [
+                models.LogMessage(
+                    user=user, time=now, action=models.LogMessage.Action.CREATE_BLOCK
+                ),
+                models.LogMessage(
+                    user=user, time=now, action=models.LogMessage.Action.BLOCK_FOLLOWERS
+                ),
+            ]
+        )
+        assert block.expires == now + models.LogMessage.RETENTION
+        assert follow.expires == models.LogMessage.NEVER
+
+        login = models.LogMessage.objects.create(
+            user=user, time=now, action=models.LogMessage.Action.LOG_IN
+        )
+        assert login.expires == models.LogMessage.NEVER
+        assert models.LogMessage.objects.count() == 3
+
+        # Nothing goes in the default partition.
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT tableoid::regclass::text, count(*) FROM secateur_logmessage"
+                " GROUP BY 1"
+            )
+            partitions = dict(cursor.fetchall())
+        assert partitions.pop("secateur_logmessage_never") == 2
+        assert list(partitions.values()) == [1]
+        assert "secateur_logmessage_default" not in partitions
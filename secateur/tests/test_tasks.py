@@ -0,0 +1,578 @@
+import datetime
+import json
+import time
+from unittest import mock
+
+import requests
+import twitter.models
+import twitter.ratelimit
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from twitter.error import TwitterError
+
+from secateur import models, tasks
+
+
+class FakeApi:
+    """Stands in for TwitterClient, recording which user ids it was asked to block.
+
+    Like Twitter, it reports the rate limit in the headers of every response.
+    """
+
+    base_url = "https://api.twitter.com/1.1"
+
+    def __init__(self, rate_limit_after=None, remaining=None, reset=None, fail_on=()):
+        self.calls = []
+        self.rate_limit_after = rate_limit_after
+        self.fail_on = fail_on
+        self.rate_limit = twitter.ratelimit.RateLimit()
+        self.remaining = remaining
+        self.reset = reset or int(time.time()) + 600
+
+    def _count_call(self, path):
+        if self.remaining is not None:
+            self.remaining = max(self.remaining - 1, 0)
+            self.rate_limit.set_limit(
+                f"{self.base_url}{path}.json", 15, self.remaining, self.reset
+            )
+
+    def CreateBlock(self, user_id=None, screen_name=None, **kwargs):
+        self._count_call("/blocks/create")
+        if (
+            self.rate_limit_after is not None
+            and len(self.calls) >= self.rate_limit_after
+        ):
+            raise TwitterError([{"code": 88, "message": "Rate limit exceeded"}])
+        if user_id in self.fail_on:
+            raise requests.exceptions.ReadTimeout()
+        self.calls.append(user_id)
+        return {"id": user_id, "screen_name": f"user{user_id}"}
+
+    CreateMute = CreateBlock
+
+    def DestroyBlock(self, user_id=None, **kwargs):
+        self._count_call("/blocks/destroy")
+        if user_id in self.fail_on:
+            raise TwitterError([{"code": 131, "message": "Internal error"}])
+        self.calls.append(user_id)
+        return {"id": user_id, "screen_name": f"user{user_id}"}
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+)
+class TestCreateRelationships(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.account = models.Account.get_account(1)
+        self.user = models.User.objects.create(username="one", account=self.account)
+
+    def _run(self, api, user_ids):
+        with mock.patch.object(
+            models.User, "api", new_callable=mock.PropertyMock, return_value=api
+        ):
+            return tasks.create_relationships.apply(
+                [],
+                dict(
+                    secateur_user_pk=self.user.pk,
+                    type=models.Relationship.BLOCKS,
+                    user_ids=user_ids,
+                ),
+            )
+
+    def test_skips_existing_blocks_and_friends(self):
+        now = timezone.now()
+        self.account.add_blocks(models.Account.get_accounts(10), updated=now)
+        self.account.add_friends(models.Account.get_accounts(11), updated=now)
+        api = FakeApi()
+
+        self._run(api, [10, 11, 12, 13])
+
+        assert api.calls == [12, 13]
+        assert set(self.account.blocks.values_list("user_id", flat=True)) == {
+            10,
+            12,
+            13,
+        }
+        assert (
+            models.LogMessage.objects.filter(
+                user=self.user, action=models.LogMessage.Action.CREATE_BLOCK
+            ).count()
+            == 2
+        )
+
+    def _scheduled(self):
+        """The target ids and seconds till due of the operations put back in the queue."""
+        now = time.time()
+        operations = models.Operation.objects.filter(user=self.user).order_by(
+            "target_id"
+        )
+        return [
+            (operation.target_id, operation.due.timestamp() - now)
+            for operation in operations
+        ]
+
+    def test_rate_limit_reschedules_remaining_ids(self):
+        api = FakeApi(rate_limit_after=2)
+        self._run(api, [20, 21, 22, 23])
+
+        assert api.calls == [20, 21]
+        assert [target_id for target_id, _ in self._scheduled()] == [22, 23]
+        assert models.LogMessage.objects.filter(rate_limited=True).count() == 1
+
+    def test_block_multiple_queues_for_a_disabled_user(self):
+        self.user.is_twitter_api_enabled = False
+        self.user.save()
+        with mock.patch.object(tasks.dispatch_operations, "delay"):
+            tasks._block_multiple(
+                [50, 51], models.Relationship.BLOCKS, self.user.pk, duration=None
+            )
+        assert [target_id for target_id, _ in self._scheduled()] == [50, 51]
+
+    @override_settings(CREATE_RELATIONSHIPS_CONCURRENCY=1)
+    def test_unknown_error_reschedules_the_rest_and_raises(self):
+        api = FakeApi(fail_on={41})
+        result = self._run(api, [40, 41, 42, 43])
+
+        assert isinstance(result.result, requests.exceptions.ReadTimeout)
+        assert api.calls == [40]
+        assert [target_id for target_id, _ in self._scheduled()] == [41, 42, 43]
+        assert set(self.account.blocks.values_list("user_id", flat=True)) == {40}
+
+    def test_paces_by_rate_limit_headers(self):
+        api = FakeApi(remaining=3)
+        self._run(api, [30, 31])
+        assert api.calls == [30, 31]
+
+        # Twitter said there's only one call left in this window, so only one is made
+        # and the rest wait for the window to reset.
+        self._run(api, [32, 33, 34])
+        assert api.calls == [30, 31, 32]
+        scheduled = self._scheduled()
+        assert [target_id for target_id, _ in scheduled] == [33, 34]
+        assert all(600 - 10 < due <= 600 + 60 for _, due in scheduled)
+
+        # Now the window's used up, nothing gets called till it resets.
+        self._run(api, [35])
+        assert api.calls == [30, 31, 32]
+        assert [target_id for target_id, _ in self._scheduled()] == [33, 34, 35]
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+    BLOCKER_GREENLETS_PER_USER=6,
+)
+class TestBlockerLane(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.heavy = tasks._BlockerLane(models.User(username="heavy"))
+        self.light = tasks._BlockerLane(models.User(username="light"))
+
+    def test_priority_is_place_in_lane(self):
+        assert [self.heavy.enqueue() for _ in range(12)] == list(range(10)) + [9, 9]
+        # Another user's first chunk goes ahead of all of them.
+        assert self.light.enqueue() == 0
+        self.light.dequeued()
+        self.light.dequeued()
+        assert self.light.enqueue() == 0
+
+    def test_greenlets_are_capped_per_user(self):
+        assert self.heavy.acquire(5) == 5
+        assert self.heavy.acquire(5) == 1
+        assert self.heavy.acquire(5) == 0
+        assert self.light.acquire(5) == 5
+        self.heavy.release(6)
+        assert self.heavy.acquire(5) == 5
+
+    def test_create_relationships_requeues_when_greenlets_are_busy(self):
+        account = models.Account.get_account(1)
+        user = models.User.objects.create(username="heavy", account=account)
+        self.heavy.acquire(6)
+        api = FakeApi()
+        with mock.patch.object(
+            models.User, "api", new_callable=mock.PropertyMock, return_value=api
+        ):
+            tasks.create_relationships.apply(
+                [], dict(secateur_user_pk=user.pk, type=2, user_ids=[2, 3])
+            )
+        assert api.calls == []
+        assert set(
+            models.Operation.objects.filter(user=user).values_list(
+                "target_id", flat=True
+            )
+        ) == {2, 3}
+
+
+class TestCreatedRelationshipsBuffer(TestCase):
+    def test_flushes_in_bulk(self):
+        account = models.Account.get_account(1)
+        user = models.User.objects.create(username="one", account=account)
+        buffer = tasks._CreatedRelationshipsBuffer(
+            secateur_user=user,
+            type=tasks.RelationshipType.MUTE,
+            action=models.LogMessage.Action.CREATE_MUTE,
+            now=timezone.now(),
+            until=None,
+            max_size=2,
+        )
+        buffer.add(twitter.models.User(id=2, screen_name="two"))
+        assert not account.mutes.exists()
+
+        # Reaching max_size writes the accounts, relationships and log messages.
+        buffer.add(twitter.models.User(id=3, screen_name="three"))
+        assert set(account.mutes.values_list("screen_name", flat=True)) == {
+            "two",
+            "three",
+        }
+        assert models.LogMessage.objects.filter(user=user).count() == 2
+        assert len(buffer) == 0
+
+        buffer.add_rate_limited()
+        buffer.flush()
+        assert models.LogMessage.objects.filter(rate_limited=True).count() == 1
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+)
+class TestUnblockExpired(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.past = timezone.now() - datetime.timedelta(days=1)
+        (
+            self.account,
+            self.disabled_account,
+            *blocked,
+        ) = models.Account.get_accounts(
+            *range(1, 6)
+        ).order_by("user_id")
+        self.user = models.User.objects.create(username="one", account=self.account)
+        models.User.objects.create(
+            username="two",
+            account=self.disabled_account,
+            is_twitter_api_enabled=False,
+        )
+        self.account.add_blocks(blocked[:2], updated=self.past, until=self.past)
+        self.disabled_account.add_blocks(
+            blocked[2:], updated=self.past, until=self.past
+        )
+
+    def test_schedules_by_user_and_skips_disabled_users(self):
+        with mock.patch.object(
+            tasks.dispatch_operations, "delay"
+        ) as delay, self.captureOnCommitCallbacks(execute=True):
+            tasks.unblock_expired()
+        delay.assert_called_once()
+        assert sorted(
+            models.Operation.objects.values_list("user", "action", "target_id")
+        ) == [
+            (self.user.pk, models.Operation.Action.DESTROY_BLOCK, 3),
+            (self.user.pk, models.Operation.Action.DESTROY_BLOCK, 4),
+        ]
+        # Everything that was due got bumped, including the disabled user's block.
+        assert not models.Relationship.objects.filter(until__lt=timezone.now()).exists()
+
+    def test_schedules_once_for_an_account_with_several_users(self):
+        other = models.User.objects.create(username="three", account=self.account)
+        with mock.patch.object(tasks.dispatch_operations, "delay"):
+            tasks.unblock_expired()
+        assert sorted(models.Operation.objects.values_list("user", "target_id")) == [
+            (self.user.pk, 3),
+            (self.user.pk, 4),
+        ]
+        assert other.pk > self.user.pk
+
+    def test_destroy_relationships(self):
+        api = FakeApi()
+        with mock.patch.object(
+            models.User, "api", new_callable=mock.PropertyMock, return_value=api
+        ):
+            tasks.destroy_relationships.apply(
+                [self.user.pk, models.Relationship.BLOCKS, [3, 4, 9]]
+            )
+        # 9 wasn't blocked, so there was nothing to unblock.
+        assert sorted(api.calls) == [3, 4]
+        assert not self.account.blocks.exists()
+        assert (
+            models.LogMessage.objects.filter(
+                user=self.user, action=models.LogMessage.Action.DESTROY_BLOCK
+            ).count()
+            == 2
+        )
+
+    @override_settings(DESTROY_RELATIONSHIPS_CONCURRENCY=1)
+    def test_destroy_relationships_reschedules_the_rest_on_unknown_errors(self):
+        self.account.add_blocks(models.Account.get_accounts(6), updated=self.past)
+        api = FakeApi(fail_on={4})
+        with mock.patch.object(
+            models.User, "api", new_callable=mock.PropertyMock, return_value=api
+        ):
+            result = tasks.destroy_relationships.apply(
+                [self.user.pk, models.Relationship.BLOCKS, [3, 4, 6]]
+            )
+        assert isinstance(result.result, TwitterError)
+        assert api.calls == [3]
+        assert sorted(models.Operation.objects.values_list("action", "target_id")) == [
+            (models.Operation.Action.DESTROY_BLOCK, 4),
+            (models.Operation.Action.DESTROY_BLOCK, 6),
+        ]
+        assert sorted(self.account.blocks.values_list("user_id", flat=True)) == [4, 6]
+
+    def test_destroy_relationships_paces_by_rate_limit_headers(self):
+        self.account.add_blocks(models.Account.get_accounts(6, 7), updated=self.past)
+        api = FakeApi(remaining=2)
+        with mock.patch.object(
+            models.User, "api", new_callable=mock.PropertyMock, return_value=api
+        ):
+            tasks.destroy_relationships.apply(
+                [self.user.pk, models.Relationship.BLOCKS, [3]]
+            )
+            # There's one call left in the window, the rest wait for it to reset.
+            tasks.destroy_relationships.apply(
+                [self.user.pk, models.Relationship.BLOCKS, [4, 6, 7]]
+            )
+        assert api.calls == [3, 4]
+        assert sorted(models.Operation.objects.values_list("action", "target_id")) == [
+            (models.Operation.Action.DESTROY_BLOCK, 6),
+            (models.Operation.Action.DESTROY_BLOCK, 7),
+        ]
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+)
+class TestDispatchOperations(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.now = timezone.now()
+
+    def _dispatch(self):
+        with mock.patch.object(
+            tasks.create_relationships, "apply_async"
+        ) as create, mock.patch.object(
+            tasks.destroy_relationships, "apply_async"
+        ) as destroy:
+            tasks.dispatch_operations()
+        return create, destroy
+
+    def test_dispatches_what_the_lane_has_room_for(self):
+        user = models.User.objects.create(username="one")
+        other = models.User.objects.create(username="two")
+        until = self.now + datetime.timedelta(days=1)
+        models.Operation.schedule(
+            user.pk, models.Operation.Action.CREATE_BLOCK, range(120), self.now, until
+        )
+        models.Operation.schedule(
+            other.pk, models.Operation.Action.DESTROY_MUTE, [7], self.now
+        )
+        later = self.now + datetime.timedelta(hours=1)
+        models.Operation.schedule(
+            user.pk, models.Operation.Action.CREATE_BLOCK, [500], later, until
+        )
+
+        create, destroy = self._dispatch()
+        # Ten greenlets a user and five calls a chunk make room for two chunks.
+        assert [len(call.args[1]["user_ids"]) for call in create.call_args_list] == [
+            50,
+            50,
+        ]
+        assert [call.kwargs["priority"] for call in create.call_args_list] == [0, 1]
+        assert create.call_args.args[1]["until"] == until
+        assert destroy.call_args.args[1]["user_ids"] == [7]
+        # The rest stays in the queue till the lane has room again.
+        assert models.Operation.objects.filter(user=user).count() == 21
+        create, _ = self._dispatch()
+        create.assert_not_called()
+
+        tasks._BlockerLane(user).dequeued()
+        create, _ = self._dispatch()
+        assert [len(call.args[1]["user_ids"]) for call in create.call_args_list] == [20]
+        # Only what isn't due yet is left in the queue.
+        assert list(models.Operation.objects.values_list("target_id", flat=True)) == [
+            500
+        ]
+
+    def test_postpones_operations_past_a_used_up_rate_limit(self):
+        user = models.User.objects.create(username="one")
+        models.Operation.schedule(
+            user.pk, models.Operation.Action.CREATE_BLOCK, [1, 2], self.now
+        )
+        reset = self.now + datetime.timedelta(minutes=10)
+        pacer = tasks._RateLimitPacer(user, None, "create_block")
+        cache.set(pacer.key, reset, 600)
+
+        create, _ = self._dispatch()
+        create.assert_not_called()
+        assert all(
+            due > reset
+            for due in models.Operation.objects.values_list("due", flat=True)
+        )
+
+
+class TestPagedJob(TestCase):
+    def setUp(self):
+        self.account = models.Account.get_account(1)
+        self.user = models.User.objects.create(username="one", account=self.account)
+
+    def _run(self, api, run, cursor):
+        with mock.patch.object(
+            tasks.twitter_paged_call_iterator, "apply_async"
+        ) as apply_async, mock.patch.object(
+            models.User, "api", new_callable=mock.PropertyMock, return_value=api
+        ):
+            tasks.twitter_paged_call_iterator.apply([run.pk, cursor])
+        run.refresh_from_db()
+        return apply_async
+
+    def test_update_followers_checkpoints_and_finishes(self):
+        models.Account.get_account(9).add_friends(
+            [self.account], updated=timezone.now()
+        )
+        with mock.patch.object(
+            tasks.twitter_paged_call_iterator, "delay"
+        ) as delay, self.captureOnCommitCallbacks(execute=True):
+            tasks.twitter_update_followers(self.user)
+        run = models.PagedJobRun.objects.get()
+        delay.assert_called_once_with(run.pk, -1)
+        # The job is stored as JSON.
+        assert json.loads(json.dumps(run.job)) == run.job
+
+        api = mock.Mock()
+        api.GetFollowerIDsPaged.return_value = (5, 0, [2, 3])
+        apply_async = self._run(api, run, -1)
+        api.GetFollowerIDsPaged.assert_called_once_with(user_id=1, cursor=-1)
+        assert (run.cursor, run.pages, run.accounts) == (5, 1, 2)
+        assert apply_async.call_args.args[0] == [run.pk, 5]
+
+        # A duplicate message for a page that's already checkpointed does nothing.
+        self._run(api, run, -1)
+        assert api.GetFollowerIDsPaged.call_count == 1
+
+        api.GetFollowerIDsPaged.return_value = (0, 0, [4])
+        apply_async = self._run(api, run, 5)
+        assert run.status == models.PagedJobRun.Status.DONE
+        apply_async.assert_not_called()
+        # The last page ran the finish handler, which removed the stale follower.
+        assert set(self.account.followers.values_list("user_id", flat=True)) == {
+            2,
+            3,
+            4,
+        }
+
+    def test_pauses_at_max_pages_and_resumes_from_cursor(self):
+        job = tasks.PagedJob(
+            secateur_user_pk=self.user.pk,
+            endpoint="block_ids",
+            accounts_handlers=[
+                dict(
+                    name="add_blocks", account_id=1, updated=timezone.now().isoformat()
+                )
+            ],
+        )
+        run = tasks.start_paged_job(self.user, job)
+        run.max_pages = 1
+        run.save()
+        api = mock.Mock()
+        api.GetBlocksIDsPaged.return_value = (7, 0, [2])
+        apply_async = self._run(api, run, -1)
+        assert run.status == models.PagedJobRun.Status.PAUSED
+        apply_async.assert_not_called()
+
+        with mock.patch.object(tasks.twitter_paged_call_iterator, "delay") as delay:
+            tasks.resume_paged_job(run)
+        delay.assert_called_once_with(run.pk, 7)
+        assert run.status == models.PagedJobRun.Status.RUNNING
+        assert run.max_pages == 301
+
+    def test_disabled_api_fails_the_run(self):
+        run = tasks.start_paged_job(
+            self.user,
+            tasks.PagedJob(secateur_user_pk=self.user.pk, endpoint="block_ids"),
+        )
+        self.user.is_twitter_api_enabled = False
+        self.user.save()
+        tasks.twitter_paged_call_iterator.apply([run.pk, -1])
+        run.refresh_from_db()
+        assert run.status == models.PagedJobRun.Status.FAILED
+
+    def test_gives_up_on_a_run_that_keeps_stalling(self):
+        run = tasks.start_paged_job(
+            self.user,
+            tasks.PagedJob(secateur_user_pk=self.user.pk, endpoint="block_ids"),
+        )
+        stalled = timezone.now() - datetime.timedelta(days=1)
+        with mock.patch.object(tasks.twitter_paged_call_iterator, "delay") as delay:
+            for _ in range(tasks._PAGED_JOB_MAX_STALLS + 1):
+                models.PagedJobRun.objects.filter(pk=run.pk).update(updated=stalled)
+                tasks.resume_paged_jobs()
+        assert delay.call_count == tasks._PAGED_JOB_MAX_STALLS
+        run.refresh_from_db()
+        assert run.status == models.PagedJobRun.Status.FAILED
+        assert run.stalls == tasks._PAGED_JOB_MAX_STALLS
+
+    def test_rejects_unknown_handlers(self):
+        with self.assertRaises(ValueError):
+            tasks.PagedJob(
+                secateur_user_pk=1,
+                endpoint="follower_ids",
+                accounts_handlers=[dict(name="delete")],
+            )
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+    ACCOUNT_PROFILE_MAX_AGE=60 * 60,
+)
+class TestResolveAccount(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = models.User.objects.create(username="resolver")
+        self.account = models.Account.get_account(
+            twitter.models.User(id=5, screen_name="Someone", name="Some One")
+        )
+
+    def _resolve(self, screen_name, fetched=None, side_effect=None):
+        with mock.patch.object(
+            tasks, "fetch_account", return_value=fetched, side_effect=side_effect
+        ) as fetch_account:
+            account = tasks.resolve_account(self.user.pk, screen_name)
+        return account, fetch_account.call_count
+
+    def _make_stale(self):
+        models.Account.objects.filter(pk=5).update(
+            profile_fetched=timezone.now() - datetime.timedelta(hours=2)
+        )
+
+    def test_fresh_account_is_served_from_the_database(self):
+        assert self._resolve("SOMEONE") == (self.account, 0)
+
+    def test_fetches_stale_account_once_then_serves_from_cache(self):
+        self._make_stale()
+        assert self._resolve("Someone", fetched=self.account) == (self.account, 1)
+        assert self._resolve("SOMEONE", fetched=self.account) == (self.account, 0)
+
+    def test_disabled_api_serves_stale_account(self):
+        self._make_stale()
+        assert self._resolve("someone", side_effect=models.TwitterApiDisabled()) == (
+            self.account,
+            1,
+        )
+
+    def test_renamed_account_is_not_served_from_cache(self):
+        cache.set(tasks._screen_name_key("oldname"), 5)
+        assert self._resolve("oldname") == (None, 1)
+        # And that it wasn't found is remembered.
+        assert self._resolve("oldname") == (None, 0)
+
+    def test_concurrent_lookups_wait_for_the_first(self):
+        cache.add(tasks._screen_name_key("newname") + ":lock", True)
+
+        def other_lookup_finishes(_):
+            cache.set(tasks._screen_name_key("newname"), 5)
+            models.Account.objects.filter(pk=5).update(screen_name="NewName")
+
+        with mock.patch.object(tasks.time, "sleep", side_effect=other_lookup_finishes):
+            account, calls = self._resolve("newname")
+        assert account.user_id == 5
+        assert calls == 0
@@ -1,6 +1,17 @@
+import http.server
+import json
+import threading
+from unittest import mock
+
 import pytest
+import requests
+import twitter
+import urllib3
 
-from secateur.utils import TokenBucket, chunks
+from secateur import http_pool, otel
+from secateur.fake_twitter import FakeTwitter, FakeTwitterServer
+from secateur.twitter_client import TwitterClient
+from secateur.utils import EndpointRateLimit, ErrorCode, TokenBucket, chunks
 
 
 def test_token_bucket() -> None:
@@ -17,6 +28,21 @@ def test_token_bucket() -> None:
     assert b.value == 2.0
 
 
+def test_endpoint_rate_limit() -> None:
+    api = twitter.Api()
+    assert EndpointRateLimit.from_api(api, "/blocks/create") is None
+
+    url = "https://api.twitter.com/1.1/blocks/create.json"
+    # What python-twitter records when a response has no rate limit headers.
+    api.rate_limit.set_limit(url, 0, 0, 0)
+    assert EndpointRateLimit.from_api(api, "/blocks/create") is None
+
+    api.rate_limit.set_limit(url, 15, 3, 1_600_000_000)
+    rate_limit = EndpointRateLimit.from_api(api, "/blocks/create")
+    assert rate_limit == EndpointRateLimit(limit=15, remaining=3, reset=1_600_000_000)
+    assert rate_limit.reset_time.timestamp() == 1_600_000_000
+
+
 @pytest.mark.parametrize(
     "iterable,size,output",
     [
@@ -28,3 +54,184 @@ def test_token_bucket() -> None:
 )
 def test_chunks(iterable, size, output):
     assert list(chunks(iterable, size)) == output
+
+
+class _KeepAliveHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.send_header("Set-Cookie", "guest_id=1")
+        self.end_headers()
+        self.wfile.write(b"{}")
+
+    def log_message(self, *args):
+        pass
+
+
+def test_shared_session_reuses_connections():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _KeepAliveHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = "http://127.0.0.1:%d/" % server.server_port
+    session = http_pool.get_session()
+    try:
+        with mock.patch.object(otel, "twitter_http_pool_hit_counter") as hits:
+            with mock.patch.object(otel, "twitter_http_pool_miss_counter") as misses:
+                for _ in range(3):
+                    assert session.get(url).json() == {}
+        assert misses.add.call_count == 1
+        assert hits.add.call_count == 2
+        # Cookies set in one user's response aren't kept for the next.
+        assert not session.cookies
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_shared_pool_gives_up_waiting_for_a_connection(settings):
+    settings.TWITTER_HTTP_POOL_TIMEOUT = 0.01
+    pool = http_pool._CountingHTTPConnectionPool("127.0.0.1", maxsize=1, block=True)
+    pool._get_conn()
+    with mock.patch.object(otel, "twitter_http_pool_exhausted_counter") as exhausted:
+        with pytest.raises(urllib3.exceptions.EmptyPoolError):
+            pool._get_conn()
+    assert exhausted.add.call_count == 1
+
+
+def _response(status, body, headers=None):
+    response = requests.Response()
+    response.status_code = status
+    response._content = (
+        body.encode() if isinstance(body, str) else json.dumps(body).encode()
+    )
+    response.headers.update(headers or {})
+    return response
+
+
+def test_twitter_client():
+    client = TwitterClient("a", "b", "c", "d")
+    client.session = mock.Mock()
+    client.session.post.return_value = _response(
+        200,
+        {"id": 5, "screen_name": "someone"},
+        {
+            "x-rate-limit-limit": "15",
+            "x-rate-limit-remaining": "14",
+            "x-rate-limit-reset": "1600000000",
+        },
+    )
+    assert client.CreateBlock(user_id=5, include_entities=False, skip_status=True) == {
+        "id": 5,
+        "screen_name": "someone",
+    }
+    (url,) = client.session.post.call_args.args
+    assert url == "https://api.twitter.com/1.1/blocks/create.json"
+    assert client.session.post.call_args.kwargs["data"] == {
+        "user_id": 5,
+        "include_entities": "false",
+        "skip_status": "true",
+    }
+    assert EndpointRateLimit.from_api(client, "/blocks/create") == EndpointRateLimit(
+        limit=15, remaining=14, reset=1_600_000_000
+    )
+
+    client.session.get.return_value = _response(
+        200, {"ids": [1, 2], "next_cursor": 7, "previous_cursor": 0}
+    )
+    assert client.GetBlocksIDsPaged(cursor=-1) == (7, 0, [1, 2])
+
+
+@pytest.mark.parametrize(
+    "body,code",
+    [
+        ({"errors": [{"code": 88, "message": "Rate limit exceeded"}]}, 88),
+        ({"errors": [{"code": 34, "message": "Sorry, that page does not exist."}]}, 34),
+        ({"error": "Not authorized."}, "Not authorized."),
+    ],
+)
+def test_twitter_client_errors(body, code):
+    client = TwitterClient("a", "b", "c", "d")
+    client.session = mock.Mock()
+    client.session.post.return_value = _response(400, body)
+    with pytest.raises(twitter.error.TwitterError) as e:
+        client.DestroyBlock(user_id=5)
+    assert ErrorCode.from_exception(e.value) == ErrorCode(code)
+
+
+@pytest.mark.parametrize(
+    "status,body,message",
+    [
+        (503, {"detail": "Service Unavailable"}, {"message": "HTTP 503"}),
+        (
+            503,
+            {"errors": [{"code": 88, "message": "Rate limit exceeded"}]},
+            [{"code": 88, "message": "Rate limit exceeded"}],
+        ),
+        (500, [], {"message": "HTTP 500"}),
+        (200, {}, {"message": "Empty response"}),
+    ],
+)
+def test_twitter_client_unsuccessful_responses(status, body, message):
+    client = TwitterClient("a", "b", "c", "d")
+    client.session = mock.Mock()
+    client.session.post.return_value = _response(status, body)
+    with pytest.raises(twitter.error.TwitterError) as e:
+        client.CreateBlock(user_id=5)
+    assert e.value.message == message
+
+
+@pytest.fixture
+def fake_twitter(settings):
+    fake = FakeTwitter(followers=12, rate_limits={"/blocks/create": 3})
+    server = FakeTwitterServer(fake).start()
+    settings.TWITTER_API_BASE_URL = server.base_url
+    yield fake
+    server.stop()
+
+
+def test_fake_twitter(fake_twitter):
+    client = TwitterClient("a", "b", "token", "d")
+    assert client.GetFollowerIDsPaged(user_id=5, cursor=-1, count=10) == (
+        10,
+        0,
+        list(range(50_000_001, 50_000_011)),
+    )
+    assert client.GetFollowerIDsPaged(user_id=5, cursor=10, count=10) == (
+        0,
+        -10,
+        [50_000_011, 50_000_012],
+    )
+    assert client.GetUser(screen_name="user7")["id"] == 7
+
+    for user_id in (1, 2, 3):
+        assert client.CreateBlock(user_id=user_id)["screen_name"] == f"user{user_id}"
+    assert EndpointRateLimit.from_api(client, "/blocks/create").remaining == 0
+    with pytest.raises(twitter.error.TwitterError) as e:
+        client.CreateBlock(user_id=4)
+    assert ErrorCode.from_exception(e.value) == ErrorCode.RATE_LIMITED_EXCEEDED
+    assert client.GetBlocksIDsPaged() == (0, 0, [1, 2, 3])
+
+    with pytest.raises(twitter.error.TwitterError) as e:
+        client.DestroyMute(user_id=1)
+    assert ErrorCode.from_exception(e.value) == ErrorCode.NOT_MUTING_SPECIFIED_USER
+
+    fake_twitter.errors = {326: 1.0}
+    with pytest.raises(twitter.error.TwitterError) as e:
+        client.DestroyBlock(user_id=1)
+    assert ErrorCode.from_exception(e.value) == ErrorCode.ACCOUNT_TEMPORARILY_LOCKED
+
+    fake_twitter.errors = {}
+    fake_twitter.drop_rate = 1.0
+    with pytest.raises(requests.exceptions.ConnectionError):
+        client.DestroyBlock(user_id=1)
+
+    stats = fake_twitter.stats()
+    assert stats["/blocks/create"]["calls"] == 4
+    assert stats["/blocks/create"]["errors"] == 1
+    # The rate limited call to block 4 didn't complete.
+    assert sorted(fake_twitter.completed("/blocks/create")) == [
+        ("token", 1),
+        ("token", 2),
+        ("token", 3),
+    ]
@@ -1,5 +1,14 @@
+import datetime
+from unittest import mock
+
+import twitter.models
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
 from django.test import override_settings, TestCase
-from secateur import models
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.views.generic import ListView
+from secateur import admin, models, pagination, views
 from waffle.testutils import override_flag
 
 
@@ -60,6 +69,71 @@ class TestAdmin(TestCase):
         self.assertTemplateUsed(r, "admin/base_site.html")
         self.assertTemplateUsed(r, "admin/base.html")
 
+    @override_settings(
+        CACHES={"default": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}}
+    )
+    def test_admin_large_tables(self) -> None:
+        u = _test_user()
+        u.is_staff = True
+        u.is_superuser = True
+        u.save()
+        self.client.force_login(u)
+        models.LogMessage.objects.create(
+            user=u, time=timezone.now(), action=models.LogMessage.Action.LOG_OUT
+        )
+        for url in [
+            "/admin/secateur/account/",
+            "/admin/secateur/relationship/?until__gte=2020-01-01",
+            "/admin/secateur/logmessage/",
+            f"/admin/secateur/logmessage/?user_id={u.pk}",
+            "/admin/secateur/logmessage/?user_id=nonsense",
+            "/admin/secateur/operation/",
+        ]:
+            r = self.client.get(url)
+            assert r.status_code == 200, url
+            self.assertTemplateUsed(r, "admin/change_list.html")
+
+        models.Account.get_account(
+            twitter.models.User(id=5, screen_name="Someone", name="Some One")
+        ).add_blocks(models.Account.get_accounts(6, 7), updated=timezone.now())
+        for search in ("@someone", "5"):
+            r = self.client.get(f"/admin/secateur/relationship/?q={search}")
+            assert r.context["cl"].result_count == 2, search
+
+        r = self.client.get(f"/admin/secateur/logmessage/?user_id={u.pk}")
+        assert r.context["cl"].result_count == models.LogMessage.objects.count()
+        r = self.client.get(f"/admin/secateur/logmessage/?user_id={u.pk + 1}")
+        assert r.context["cl"].result_count == 0
+
+    def test_resume_paged_jobs_skips_running_and_done_runs(self) -> None:
+        user = models.User.objects.create(username="someone")
+        Status = models.PagedJobRun.Status
+        for status in Status:
+            models.PagedJobRun.objects.create(
+                user=user, job={"endpoint": "block_ids"}, status=status
+            )
+        with mock.patch("secateur.tasks.resume_paged_job") as resume_paged_job:
+            admin.resume_paged_jobs(None, None, models.PagedJobRun.objects.all())
+        assert sorted(
+            call.args[0].status for call in resume_paged_job.call_args_list
+        ) == [Status.PAUSED, Status.FAILED]
+
+    def test_large_table_paginator(self) -> None:
+        models.Account.write_accounts(*range(1, 31))
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE secateur_account")
+        paginator = admin.LargeTablePaginator(
+            models.Account.objects.order_by("pk"), per_page=10
+        )
+        assert paginator.count == 30
+        with mock.patch.object(admin.LargeTablePaginator, "MAX_ROWS", 15):
+            paginator = admin.LargeTablePaginator(
+                models.Account.objects.filter(user_id__gt=5).order_by("pk"),
+                per_page=10,
+            )
+            assert paginator.count == 15
+            assert paginator.num_pages == 2
+
 
 class TestBlock(TestCase):
     def test_block(self) -> None:
@@ -106,6 +180,69 @@ class TestBlocked(TestCase):
         self.assertTemplateUsed(r, "base.html")
         self.assertTemplateUsed(r, "bootstrap.html")
 
+    def test_blocked_pages(self) -> None:
+        u = _test_user()
+        self.client.force_login(u)
+        now = timezone.now()
+        models.Account.write_accounts(*range(2, 9))
+        for object_id, until in [(2, None), (3, 5), (4, 1), (5, None), (6, 3), (7, 3)]:
+            models.Relationship.write_relationships(
+                type=models.Relationship.BLOCKS,
+                subject_ids=[1],
+                object_ids=[object_id],
+                updated=now,
+                until=now + datetime.timedelta(days=until) if until else None,
+            )
+
+        def walk(query):
+            pages = []
+            while query:
+                r = self.client.get("/blocked/" + query)
+                assert r.status_code == 200
+                pages.append([rel.object_id for rel in r.context["object_list"]])
+                query = r.context["next_page_url"]
+            return pages, r
+
+        with mock.patch.object(views.Blocked, "paginate_by", 4):
+            pages, _ = walk("?")
+            assert pages == [[2, 3, 4, 5], [6, 7]]
+        with mock.patch.object(views.Blocked, "paginate_by", 2):
+            pages, last = walk("?sort=expiry")
+            assert pages == [[4, 6], [7, 3], [2, 5]]
+            r = self.client.get("/blocked/" + last.context["previous_page_url"])
+            assert [rel.object_id for rel in r.context["object_list"]] == [7, 3]
+            assert r.context["next_page_url"]
+            assert r.context["previous_page_url"]
+
+        r = self.client.get("/blocked/?page=nonsense")
+        assert r.status_code == 404
+
+    def test_keyset_is_required(self) -> None:
+        class NoKeyset(pagination.KeysetPaginationMixin, ListView):
+            model = models.LogMessage
+            paginate_by = 10
+
+        with self.assertRaisesMessage(ImproperlyConfigured, "NoKeyset.keyset"):
+            NoKeyset().get_keyset()
+
+    def test_blocked_search(self) -> None:
+        u = _test_user()
+        self.client.force_login(u)
+        models.Account.write_accounts(
+            *(
+                twitter.models.User(id=user_id, screen_name=screen_name)
+                for user_id, screen_name in [(2, "Foo"), (3, "fOObar"), (4, "bar")]
+            )
+        )
+        models.Relationship.write_relationships(
+            type=models.Relationship.BLOCKS,
+            subject_ids=[1],
+            object_ids=[2, 3, 4],
+            updated=timezone.now(),
+        )
+        r = self.client.get("/blocked/?screen_name=@foo")
+        assert [rel.object_id for rel in r.context["object_list"]] == [2, 3]
+
 
 @override_settings(
     CACHES={"default": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}}
@@ -200,6 +337,35 @@ class TestBlockMessages(TestCase):
         self.assertTemplateUsed(r, "base.html")
         self.assertTemplateUsed(r, "bootstrap.html")
 
+    @override_settings(
+        CACHES={"default": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}}
+    )
+    def test_block_messages_query_count(self) -> None:
+        u = _test_user()
+        self.client.force_login(u)
+
+        def log_blocks(*account_ids):
+            models.Account.write_accounts(*account_ids)
+            models.LogMessage.objects.bulk_create(
+                models.LogMessage(
+                    user=u,
+                    time=timezone.now(),
+                    action=models.LogMessage.Action.CREATE_BLOCK,
+                    account_id=account_id,
+                )
+                for account_id in account_ids
+            )
+
+        log_blocks(2)
+        self.client.get("/block-messages/")
+        with CaptureQueriesContext(connection) as one:
+            self.client.get("/block-messages/")
+        log_blocks(*range(3, 30))
+        with CaptureQueriesContext(connection) as many:
+            r = self.client.get("/block-messages/")
+        assert len(r.context["object_list"]) == models.LogMessage.objects.count()
+        assert len(many) == len(one)
+
 
 class TestLogout(TestCase):
     def test_logout(self) -> None:
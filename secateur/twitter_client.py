@@ -0,0 +1,264 @@
+"""A lean Twitter API client for the endpoints secateur calls.
+
+It has the same method names and arguments as twitter.Api, so it can stand in for it,
+but it hands back the JSON Twitter sent rather than building twitter.User objects out
+of it: Account.write_accounts() takes the dicts as they are. Errors are raised as
+python-twitter's TwitterError, with the same message, so utils.ErrorCode can read them,
+and the rate limit headers of every response go in `rate_limit` as they do for
+twitter.Api, so utils.EndpointRateLimit can read them.
+
+The calls block, so to make many at once, make them from greenlets: every client
+shares the connection pool from http_pool.
+"""
+
+from typing import Any, Dict, List, Optional, Tuple
+
+import requests
+import twitter.ratelimit
+from django.conf import settings
+from requests_oauthlib import OAuth1
+from twitter.error import TwitterError
+
+from . import http_pool
+
+# A raw user object, as Twitter returned it.
+UserDict = Dict[str, Any]
+# (next_cursor, previous_cursor, items)
+Page = Tuple[int, int, List[Any]]
+
+
+def _encode(value: Any) -> Any:
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return value
+
+
+class TwitterClient:
+    def __init__(
+        self,
+        consumer_key: str,
+        consumer_secret: str,
+        access_token_key: str,
+        access_token_secret: str,
+        timeout: Optional[float] = None,
+    ) -> None:
+        self.auth = OAuth1(
+            consumer_key, consumer_secret, access_token_key, access_token_secret
+        )
+        self.timeout = timeout
+        self.base_url = settings.TWITTER_API_BASE_URL
+        self.session = http_pool.get_session()
+        self.rate_limit = twitter.ratelimit.RateLimit()
+
+    def _request(self, method: str, path: str, params: Dict[str, Any]) -> Any:
+        """Call `path`, e.g. "/blocks/create", and return the JSON it responds with."""
+        url = f"{self.base_url}{path}.json"
+        params = {k: _encode(v) for k, v in params.items() if v is not None}
+        if method == "GET":
+            response = self.session.get(
+                url, params=params, auth=self.auth, timeout=self.timeout
+            )
+        else:
+            response = self.session.post(
+                url, data=params, auth=self.auth, timeout=self.timeout
+            )
+        self.rate_limit.set_limit(
+            url,
+            response.headers.get("x-rate-limit-limit", 0),
+            response.headers.get("x-rate-limit-remaining", 0),
+            response.headers.get("x-rate-limit-reset", 0),
+        )
+        return self._parse(response)
+
+    @staticmethod
+    def _parse(response: requests.Response) -> Any:
+        """The response's JSON, raising TwitterError as twitter.Api would."""
+        try:
+            data = response.json()
+        except ValueError:
+            text = response.text
+            if "<title>Twitter / Over capacity</title>" in text:
+                raise TwitterError({"message": "Capacity Error"})
+            if "<title>Twitter / Error</title>" in text:
+                raise TwitterError({"message": "Technical Error"})
+            if "Exceeded connection limit for user" in text:
+                raise TwitterError({"message": "Exceeded connection limit for user"})
+            if "Error 401 Unauthorized" in text:
+                raise TwitterError({"message": "Unauthorized"})
+            raise TwitterError({"Unknown error": text})
+        if isinstance(data, dict):
+            if "error" in data:
+                raise TwitterError(data["error"])
+            if "errors" in data:
+                raise TwitterError(data["errors"])
+        # Without an error in the body, the status still has to say it worked, and
+        # every endpoint we call sends something back when it does.
+        if not 200 <= response.status_code < 300:
+            raise TwitterError({"message": f"HTTP {response.status_code}"})
+        if data is None or data == {} or data == "":
+            raise TwitterError({"message": "Empty response"})
+        return data
+
+    ## BLOCKS AND MUTES
+
+    def _block_mute(
+        self,
+        path: str,
+        user_id: Optional[int],
+        screen_name: Optional[str],
+        include_entities: bool,
+        skip_status: bool,
+    ) -> UserDict:
+        if not user_id and not screen_name:
+            raise TwitterError("You must specify either a user_id or screen_name")
+        return self._request(
+            "POST",
+            path,
+            dict(
+                user_id=user_id,
+                screen_name=None if user_id else screen_name,
+                include_entities=include_entities,
+                skip_status=skip_status,
+            ),
+        )
+
+    def CreateBlock(
+        self,
+        user_id: Optional[int] = None,
+        screen_name: Optional[str] = None,
+        include_entities: bool = True,
+        skip_status: bool = False,
+    ) -> UserDict:
+        return self._block_mute(
+            "/blocks/create", user_id, screen_name, include_entities, skip_status
+        )
+
+    def DestroyBlock(
+        self,
+        user_id: Optional[int] = None,
+        screen_name: Optional[str] = None,
+        include_entities: bool = True,
+        skip_status: bool = False,
+    ) -> UserDict:
+        return self._block_mute(
+            "/blocks/destroy", user_id, screen_name, include_entities, skip_status
+        )
+
+    def CreateMute(
+        self,
+        user_id: Optional[int] = None,
+        screen_name: Optional[str] = None,
+        include_entities: bool = True,
+        skip_status: bool = False,
+    ) -> UserDict:
+        return self._block_mute(
+            "/mutes/users/create", user_id, screen_name, include_entities, skip_status
+        )
+
+    def DestroyMute(
+        self,
+        user_id: Optional[int] = None,
+        screen_name: Optional[str] = None,
+        include_entities: bool = True,
+        skip_status: bool = False,
+    ) -> UserDict:
+        return self._block_mute(
+            "/mutes/users/destroy", user_id, screen_name, include_entities, skip_status
+        )
+
+    ## PAGES OF ACCOUNTS
+
+    def _page(self, path: str, key: str, params: Dict[str, Any]) -> Page:
+        data = self._request("GET", path, params)
+        return (
+            data.get("next_cursor", 0),
+            data.get("previous_cursor", 0),
+            data.get(key) or [],
+        )
+
+    def GetFollowerIDsPaged(
+        self,
+        user_id: Optional[int] = None,
+        screen_name: Optional[str] = None,
+        cursor: int = -1,
+        count: int = 5000,
+    ) -> Page:
+        return self._page(
+            "/followers/ids",
+            "ids",
+            dict(user_id=user_id, screen_name=screen_name, cursor=cursor, count=count),
+        )
+
+    def GetFriendIDsPaged(
+        self,
+        user_id: Optional[int] = None,
+        screen_name: Optional[str] = None,
+        cursor: int = -1,
+        count: int = 5000,
+    ) -> Page:
+        return self._page(
+            "/friends/ids",
+            "ids",
+            dict(user_id=user_id, screen_name=screen_name, cursor=cursor, count=count),
+        )
+
+    def GetFriendsPaged(
+        self,
+        user_id: Optional[int] = None,
+        screen_name: Optional[str] = None,
+        cursor: int = -1,
+        count: int = 200,
+        skip_status: bool = True,
+        include_user_entities: bool = False,
+    ) -> Page:
+        return self._page(
+            "/friends/list",
+            "users",
+            dict(
+                user_id=user_id,
+                screen_name=screen_name,
+                cursor=cursor,
+                count=count,
+                skip_status=skip_status,
+                include_user_entities=include_user_entities,
+            ),
+        )
+
+    def GetBlocksIDsPaged(self, cursor: int = -1) -> Page:
+        return self._page("/blocks/ids", "ids", dict(cursor=cursor))
+
+    def GetMutesIDsPaged(self, cursor: int = -1) -> Page:
+        return self._page("/mutes/users/ids", "ids", dict(cursor=cursor))
+
+    ## USERS
+
+    def GetUser(
+        self,
+        user_id: Optional[int] = None,
+        screen_name: Optional[str] = None,
+        include_entities: bool = True,
+    ) -> UserDict:
+        if not user_id and not screen_name:
+            raise TwitterError("Specify at least one of user_id or screen_name.")
+        return self._request(
+            "GET",
+            "/users/show",
+            dict(
+                user_id=user_id,
+                screen_name=None if user_id else screen_name,
+                include_entities=include_entities,
+            ),
+        )
+
+    def UsersLookup(
+        self, user_id: List[int], include_entities: bool = False
+    ) -> List[UserDict]:
+        """Up to 100 users at a time. Suspended and deleted users are left out."""
+        return self._request(
+            "POST",
+            "/users/lookup",
+            dict(
+                user_id=",".join(str(i) for i in user_id),
+                include_entities=include_entities,
+            ),
+        )
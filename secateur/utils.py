@@ -1,9 +1,9 @@
-from typing import Any, List, Iterable
+from typing import Any, List, Iterable, Optional
 from dataclasses import dataclass, replace
 from enum import Enum
 import logging
 import random
-from datetime import timedelta
+from datetime import datetime, timedelta, timezone as dt_timezone
 from django.utils import timezone
 
 import structlog
@@ -11,6 +11,7 @@ import structlog
 
 import secateur.models
 import secateur.otel
+import secateur.twitter_client
 
 import twitter
 
@@ -124,6 +125,35 @@ class TokenBucket:
         return replace(self, time=time, value=new_value)
 
 
+@dataclass(frozen=True)
+class EndpointRateLimit:
+    """Twitter's rate limit for one endpoint, from the x-rate-limit-* response headers."""
+
+    limit: int
+    remaining: int
+    # Seconds since the epoch.
+    reset: float
+
+    @classmethod
+    def from_api(
+        cls, api: "secateur.twitter_client.TwitterClient", path: str
+    ) -> "Optional[EndpointRateLimit]":
+        """The latest rate limit the client has seen for `path`, e.g. "/blocks/create".
+
+        The client records the headers of every response it gets in a python-twitter
+        RateLimit, which records zeros when a response didn't include them, so those are
+        treated as unknown.
+        """
+        limit = api.rate_limit.get_limit(f"{api.base_url}{path}.json")
+        if not limit.limit or not limit.reset:
+            return None
+        return cls(limit=limit.limit, remaining=limit.remaining, reset=limit.reset)
+
+    @property
+    def reset_time(self) -> datetime:
+        return datetime.fromtimestamp(self.reset, tz=dt_timezone.utc)
+
+
 def chunks(iterable: Iterable[Any], size: int) -> List[Any]:
     for chunk in (iterable[i : i + size] for i in range(0, len(iterable), size)):
         yield chunk
@@ -1,4 +1,4 @@
-from typing import Any, Optional, Dict
+from typing import Any, Optional, Dict, Sequence, Tuple
 import datetime
 import logging
 
@@ -12,14 +12,17 @@ from django.contrib.auth import logout
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.db import transaction
 from django.db.models import QuerySet, F, Q
+from django.db.models.expressions import Combinable
 from django.db.models.functions import Now, Random
 from django.urls import reverse, reverse_lazy
 from django.utils import timezone
+from django.utils.functional import cached_property
 from django.utils.timezone import now
 from django.views.generic import DetailView, FormView, ListView, TemplateView
 from waffle.mixins import WaffleFlagMixin
 
 from . import forms, models, tasks, otel
+from .pagination import KeysetPaginationMixin
 
 logger = structlog.get_logger(__name__)
 tracer = opentelemetry.trace.get_tracer(__name__)
@@ -37,7 +40,6 @@ class Suspended(TemplateView):
     template_name = "suspended.html"
 
 
-
 class Account(DetailView):
     template_name = "account.html"
     model = models.Account
@@ -48,15 +50,23 @@ class Account(DetailView):
         return self.get_queryset().get(screen_name=self.kwargs["screen_name"])
 
 
-class LogMessages(LoginRequiredMixin, ListView):
+# A page of log messages fetches its accounts in one query, with only the fields
+# LogMessage.format_message() uses.
+_LOG_MESSAGE_ACCOUNTS = django.db.models.Prefetch(
+    "account", queryset=models.Account.objects.only("user_id", "screen_name", "name")
+)
+
+
+class LogMessages(LoginRequiredMixin, KeysetPaginationMixin, ListView):
     template_name = "log-messages.html"
     model = models.LogMessage
     paginate_by = 50
+    keyset = [(F("id"), django.db.models.IntegerField())]
+    keyset_descending = True
 
     def get_queryset(self) -> django.db.models.query.QuerySet:
-        user = models.User.objects.get(pk=self.request.user.pk)
         return (
-            models.LogMessage.objects.filter(user=user)
+            models.LogMessage.objects.filter(user_id=self.request.user.pk)
             .exclude(
                 action__in=[
                     models.LogMessage.Action.CREATE_BLOCK,
@@ -65,27 +75,49 @@ class LogMessages(LoginRequiredMixin, ListView):
                     models.LogMessage.Action.DESTROY_MUTE,
                 ]
             )
-            .order_by("-id")
+            .prefetch_related(_LOG_MESSAGE_ACCOUNTS)
         )
 
 
-class BlockMessages(LoginRequiredMixin, ListView):
+class BlockMessages(LoginRequiredMixin, KeysetPaginationMixin, ListView):
     template_name = "block-messages.html"
     model = models.LogMessage
     paginate_by = 500
+    keyset = [(F("id"), django.db.models.IntegerField())]
+    keyset_descending = True
 
     def get_queryset(self) -> django.db.models.query.QuerySet:
-        user = models.User.objects.get(pk=self.request.user.pk)
-        return models.LogMessage.objects.filter(user=user).order_by("-id")
+        return models.LogMessage.objects.filter(
+            user_id=self.request.user.pk
+        ).prefetch_related(_LOG_MESSAGE_ACCOUNTS)
 
 
-class Blocked(LoginRequiredMixin, ListView):
+class Blocked(LoginRequiredMixin, KeysetPaginationMixin, ListView):
     template_name = "blocked.html"
     paginate_by = 200
 
+    @cached_property
+    def counts(self) -> Dict[int, models.RelationshipCount]:
+        return models.RelationshipCount.for_account(self.request.user.account_id)
+
+    @property
+    def sort_by_expiry(self) -> bool:
+        return self.request.GET.get("sort") == "expiry"
+
+    def get_keyset(self) -> Sequence[Tuple[Combinable, django.db.models.Field]]:
+        keyset = [(F("object_id"), django.db.models.BigIntegerField())]
+        if self.sort_by_expiry:
+            keyset.insert(
+                0, (models.Relationship.EXPIRY, django.db.models.DateTimeField())
+            )
+        return keyset
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context["form"] = forms.Search(self.request.GET)
+        context["blocked"] = self.counts[models.Relationship.BLOCKS]
+        context["muted"] = self.counts[models.Relationship.MUTES]
+        context["sort_by_expiry"] = self.sort_by_expiry
         return context
 
     def get_queryset(self) -> QuerySet[models.Relationship]:
@@ -93,7 +125,7 @@ class Blocked(LoginRequiredMixin, ListView):
         relationships = models.Relationship.objects.select_related("object").filter(
             subject_id=self.request.user.account_id, type=models.Relationship.BLOCKS
         )
-        if form.is_valid():
+        if form.is_valid() and form.cleaned_data["screen_name"]:
             relationships = relationships.filter(
                 object__screen_name__istartswith=form.cleaned_data["screen_name"]
             )
@@ -144,16 +176,9 @@ class Search(LoginRequiredMixin, FormView):
     ## TODO: check user has API enabled.
 
     def form_valid(self, form: django.forms.BaseForm) -> django.http.HttpResponse:
-        screen_name = form.cleaned_data["screen_name"]
-        account = None
-
-        # First search our local database.
-        try:
-            account = models.Account.objects.get(screen_name__iexact=screen_name)
-        except models.Account.DoesNotExist:
-            logger.debug("Account not found for user: %s", screen_name)
-        if account is None:
-            account = tasks.get_user(self.request.user.pk, screen_name=screen_name)
+        account = self.request.user.get_account_by_screen_name(
+            form.cleaned_data["screen_name"]
+        )
 
         if account is None:
             messages.add_message(
@@ -191,7 +216,7 @@ class Block(LoginRequiredMixin, FormView):
         messages.add_message(
             self.request,
             messages.INFO,
-            "Retrieved account %s from Twitter" % (account,),
+            "Found account %s" % (account,),
         )
 
         bucket = user.token_bucket
@@ -232,18 +257,18 @@ class Block(LoginRequiredMixin, FormView):
             tokens_required += followers_count
         if account.screen_name.lower() == "ThePosieParker".lower():
             pass
-        elif tokens_required > user.current_tokens:
-            messages.add_message(
-                self.request,
-                messages.ERROR,
-                "Rate limited: Sorry, you can only block a certain number of people per day, you'll "
-                "need to try again later. If you're actively being harassed, this limit can be increased "
-                "if you contact the administrator.",
-            )
-            return super().form_valid(form)
         elif tokens_required:
-            user.withdraw_tokens(tokens_required)
-            user.save(update_fields=("token_bucket_time", "token_bucket_value"))
+            try:
+                user.withdraw_tokens(tokens_required)
+            except ValueError:
+                messages.add_message(
+                    self.request,
+                    messages.ERROR,
+                    "Rate limited: Sorry, you can only block a certain number of people per day, you'll "
+                    "need to try again later. If you're actively being harassed, this limit can be increased "
+                    "if you contact the administrator.",
+                )
+                return super().form_valid(form)
 
         WEEK = datetime.timedelta(days=7)
         if form.cleaned_data["duration"]: